@@ -0,0 +1,282 @@
+"""
+Parallel multi-day, multi-radar conversion driver.
+
+Expands a date range and a list of radars into (radar, day) work units
+and converts them on a pool of worker processes with
+day_conversion.convert_day (native reader, streaming writers). Units
+whose output already exists are skipped, failed units are retried, and
+a progress line plus a final throughput summary are printed. With
+partitioned=True the outputs are written in the radar/year/month
+layout of dataset_layout and the dataset manifest is kept up to date.
+"""
+
+import datetime
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import time
+import traceback
+
+import dataset_layout
+import day_conversion
+from conversion_cache import ConversionCache
+from file_catalog import FileCatalog
+
+# Catalog and cache of a worker process (see _init_process)
+_catalog = None
+_cache = None
+
+
+def _init_process(catalogPath=None, cacheArgs=None):
+    """
+    Open the file catalog and the conversion cache in a worker process
+    (their database connections can't be shared with the parent), and
+    leave interrupts to the parent, which stops the pool.
+    """
+    global _catalog, _cache
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if catalogPath is not None:
+        _catalog = FileCatalog(catalogPath)
+    if cacheArgs is not None:
+        _cache = ConversionCache(*cacheArgs)
+
+
+def expand_work_units(sDate, eDate, radList):
+    """
+    List the (radar, day) work units between sDate and eDate
+    (both included), day by day.
+    """
+    units = []
+    cDate = datetime.datetime(sDate.year, sDate.month, sDate.day)
+    while cDate <= eDate:
+        for rad in radList:
+            units.append((rad, cDate))
+        cDate += datetime.timedelta(days=1)
+    return units
+
+
+def get_output_file(rad, cDate, outDir, fileFormat, partitioned=False):
+    """
+    Output file name of a work unit
+    """
+    if partitioned:
+        outDir = dataset_layout.partition_dir(outDir, rad, cDate)
+    return os.path.join(outDir, day_conversion.output_name(rad, cDate,
+                                                           fileFormat))
+
+
+def convert_unit(unit):
+    """
+    Convert one work unit, retrying on failure.
+
+    Parameters
+    ----------
+    unit : tuple
+        (rad, cDate, outDir, fileFormat, maxRetries, skipExisting,
+        partitioned, settings) where settings is a dict of the
+        keyword arguments of day_conversion.convert_day (tmpDir,
+        localdirfmt, fnamefmt, medianFilter, pathToFilter). The
+        catalog and cache of the worker process (see _init_process)
+        are passed on to fetch_concat.
+
+    Returns
+    -------
+    dict
+        rad, date, status ("done", "skipped", "nodata" or "failed"),
+        outFile, nbytes, attempts, elapsed (seconds) and error.
+    """
+    (rad, cDate, outDir, fileFormat, maxRetries, skipExisting,
+     partitioned, settings) = unit
+    t0 = time.time()
+    outFile = get_output_file(rad, cDate, outDir, fileFormat, partitioned)
+    result = {"rad": rad, "date": cDate, "status": "failed",
+              "outFile": outFile, "nbytes": 0, "attempts": 0,
+              "elapsed": 0., "error": None}
+
+    if skipExisting and os.path.exists(outFile):
+        result["status"] = "skipped"
+        result["nbytes"] = os.path.getsize(outFile)
+        return result
+
+    settings = dict(settings)
+    # files made by fetch_concat (when median filtering) are kept only
+    # as entries of the cache
+    tmpDir = os.path.join(settings.pop("tmpDir"),
+                          "{:s}.{:s}".format(rad, cDate.strftime("%Y%m%d")))
+    tmpDir += os.sep
+    for attempt in range(1, maxRetries + 2):
+        result["attempts"] = attempt
+        try:
+            nrec = day_conversion.convert_day(rad, cDate, fileFormat,
+                                              outFile, tmpDir,
+                                              catalog=_catalog, cache=_cache,
+                                              **settings)
+            if nrec == 0:
+                result["status"] = "nodata"
+            else:
+                result["status"] = "done"
+                result["nbytes"] = os.path.getsize(outFile)
+            result["error"] = None
+            break
+        except Exception:
+            result["error"] = traceback.format_exc()
+            logging.warning("attempt {:d} failed for {:s} on {:s}".format(
+                attempt, rad, cDate.strftime("%Y%m%d")))
+        finally:
+            if _cache is None or not settings.get("medianFilter"):
+                shutil.rmtree(tmpDir, ignore_errors=True)
+
+    result["elapsed"] = time.time() - t0
+    return result
+
+
+class BatchConverter(object):
+    """
+    Convert fitacf data of several radars over a date range
+    with a pool of worker processes.
+    """
+
+    def __init__(self, sDate, eDate, radList, outDir, fileFormat="parquet",
+                 nProcs=None, maxRetries=2, skipExisting=True,
+                 partitioned=False, tmpDir="./data/tmp/",
+                 localdirfmt=day_conversion.RAW_DIR_FORMAT,
+                 fnamefmt=day_conversion.RAW_FILE_FORMATS,
+                 medianFilter=False, pathToFilter="./fitexfilter",
+                 catalog=None, cache=None):
+        """
+        Initialize parameters
+
+        Parameters
+        ----------
+        sDate, eDate : datetime.datetime
+            First and last day to convert.
+        radList : list
+            Three-letter radar codes.
+        outDir : str
+            Output directory (must end with a "/").
+        fileFormat : str
+            "parquet", "hdf5" or "csv".
+        nProcs : Optional[int]
+            Number of worker processes (default: number of cpus).
+        maxRetries : int
+            Number of times a failed unit is tried again.
+        skipExisting : bool
+            Skip units whose output file already exists.
+        partitioned : bool
+            Write the outputs in the partitioned layout of
+            dataset_layout under outDir and update its manifest.
+        tmpDir : str
+            Directory of temporary files.
+        localdirfmt, fnamefmt :
+            Location of the raw files, see dmap_to_csv.fetch_concat.
+        medianFilter : bool
+            Boxcar median filter the data first.
+        pathToFilter : str
+            fitexfilter binary used if the native filter (see
+            median_filter) fails.
+        catalog : Optional[file_catalog.FileCatalog]
+            Catalog locating the raw files (instead of listing
+            directories).
+        cache : Optional[conversion_cache.ConversionCache]
+            Cache of the filtered files. Worker processes open the
+            catalog and cache again from their database files.
+        """
+        self.sDate = sDate
+        self.eDate = eDate
+        self.radList = radList
+        self.outDir = outDir
+        self.fileFormat = fileFormat
+        self.nProcs = nProcs if nProcs else multiprocessing.cpu_count()
+        self.maxRetries = maxRetries
+        self.skipExisting = skipExisting
+        self.partitioned = partitioned
+        self.settings = {"tmpDir": tmpDir, "localdirfmt": localdirfmt,
+                         "fnamefmt": fnamefmt, "medianFilter": medianFilter,
+                         "pathToFilter": pathToFilter}
+        self.catalog = catalog
+        self.cache = cache
+
+    def run(self):
+        """
+        Convert all the work units, printing progress as units
+        finish. Returns the list of results of convert_unit.
+        """
+        if not os.path.exists(self.outDir):
+            os.makedirs(self.outDir)
+        units = [(rad, cDate, self.outDir, self.fileFormat,
+                  self.maxRetries, self.skipExisting, self.partitioned,
+                  self.settings)
+                 for rad, cDate in expand_work_units(self.sDate, self.eDate,
+                                                     self.radList)]
+        results = []
+        manifest = None
+        if self.partitioned:
+            manifest = dataset_layout.Manifest(self.outDir)
+        t0 = time.time()
+        initArgs = (None if self.catalog is None else self.catalog.dbPath,
+                    None if self.cache is None else
+                    (self.cache.dbPath, self.cache.maxBytes,
+                     self.cache.maxEntries, self.cache.maxAge))
+        pool = multiprocessing.Pool(self.nProcs, initializer=_init_process,
+                                    initargs=initArgs)
+        try:
+            for result in pool.imap_unordered(convert_unit, units):
+                results.append(result)
+                if manifest is not None:
+                    self.update_manifest(manifest, result)
+                print("[{:d}/{:d}] {:s} {:s} {:s} ({:.1f} s)".format(
+                    len(results), len(units), result["rad"],
+                    result["date"].strftime("%Y%m%d"), result["status"],
+                    result["elapsed"]))
+        finally:
+            pool.close()
+            pool.join()
+            if manifest is not None:
+                manifest.save()
+        self.print_summary(results, time.time() - t0)
+        return results
+
+    def update_manifest(self, manifest, result):
+        """
+        Record the output of a finished unit in the manifest
+        (only the main process writes the manifest)
+        """
+        outFile = result["outFile"]
+        if result["status"] == "done" or (result["status"] == "skipped" and
+                                          not manifest.has_file(outFile)):
+            manifest.add_file(outFile)
+        elif result["status"] in ("nodata", "failed"):
+            manifest.remove_file(outFile)
+
+    def print_summary(self, results, elapsed):
+        """
+        Print counts per status and the conversion throughput
+        """
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        done = [r for r in results if r["status"] == "done"]
+        nbytes = sum(r["nbytes"] for r in done)
+        print("{:d} units in {:.1f} s: ".format(len(results), elapsed) +
+              ", ".join("{:d} {:s}".format(counts[k], k)
+                        for k in sorted(counts.keys())))
+        if elapsed > 0:
+            print("throughput: {:.2f} units/min, {:.2f} MB/s written".format(
+                60. * len(done) / elapsed, nbytes / 1.e6 / elapsed))
+        for result in results:
+            if result["status"] == "failed":
+                print("FAILED {:s} {:s}:\n{:s}".format(
+                    result["rad"], result["date"].strftime("%Y%m%d"),
+                    result["error"]))
+
+
+if __name__ == "__main__":
+    sDate = datetime.datetime(2012,6,1)
+    eDate = datetime.datetime(2012,7,1)
+    selRadList = ["fhe", "fhw", "bks"]
+    pqOutDir = "/home/bharat/Documents/data/fit_cmpr_formats/pq/"
+    bc = BatchConverter(sDate, eDate, selRadList, pqOutDir,
+                        fileFormat="parquet", nProcs=4)
+    bc.run()
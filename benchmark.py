@@ -0,0 +1,496 @@
+"""
+Benchmarks of the conversion pipeline, stage by stage, on synthetic
+fitacf data (see synthetic_fitacf).
+
+An archive of the requested radars, days, beams, range gates and
+records per day is written to a work directory, then every stage is
+timed separately for each radar-day:
+
+    discovery           locating the day's files (dmap_to_csv)
+    catalog             the same through a file_catalog.FileCatalog
+                        (updating it from the archive, then querying)
+    decompression       decompressing and concatenating them
+    decode              reading the dmap file into ColumnBatches
+    decode_records      reading it record by record, as dicts
+    filter              boxcar median filter (median_filter)
+    csv_write           converting the dmap file to csv
+                        (dmap_to_csv.dmap_to_csv)
+    hdf5_write          writing the dicts as an indexed hdf5 file
+                        (HDF5Converter.create_hdf5_file)
+    parquet_write       converting the dmap file to Parquet, as
+                        day_conversion does (ParquetConverter)
+    csv_read            reading the csv file back (csv_to_dict)
+    hdf5_read           reading the hdf5 file back (hdf5_reader)
+    parquet_read        reading the Parquet file back (parquet_reader)
+
+Each stage reports its time, records/s, MB/s (of the bytes it reads or
+writes, see STAGE_BYTES) and peak resident memory, as JSON, so that
+runs can be compared (see compare_results), e.g.
+    python benchmark.py --radars bks,fhe --records-per-day 28800 \\
+        --output before.json
+    python benchmark.py ... --output after.json --compare before.json
+"""
+
+import argparse
+import datetime as dt
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import csv_to_dict
+import dmap_reader
+import dmap_to_csv
+import median_filter
+import synthetic_fitacf
+from dmap_columns import ColumnBatch, read_dmap_columns
+from dmap_streams import concat_files
+from file_catalog import FileCatalog
+from generate_hdf5_files import HDF5Converter
+from generate_parquet_files import ParquetConverter
+from hdf5_reader import HDF5Reader
+from parquet_reader import ParquetReader
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# Version of the JSON results, bumped when their layout changes
+RESULTS_VERSION = 1
+
+STAGES = ["discovery", "catalog", "decompression", "decode",
+          "decode_records", "filter", "csv_write", "hdf5_write",
+          "parquet_write", "csv_read", "hdf5_read", "parquet_read"]
+
+# Bytes the MB/s of a stage are computed from
+STAGE_BYTES = {"discovery": None, "catalog": None,
+               "decompression": "dmap", "decode": "dmap",
+               "decode_records": "dmap", "filter": None,
+               "csv_write": "csv", "hdf5_write": "hdf5",
+               "parquet_write": "parquet", "csv_read": "csv",
+               "hdf5_read": "hdf5", "parquet_read": "parquet"}
+
+LOCALDIRFMT = "{year}/{ftype}/{radar}/"
+FNAMEFMT = ["{date}.{hour}......{radar}.{ftype}"]
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident memory of the process, so that
+    peak_rss() measures the stage that follows. Only possible
+    on Linux; returns False elsewhere.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def current_rss():
+    """Resident memory of the process in bytes, or None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def peak_rss():
+    """Peak resident memory of the process in bytes (since the last
+    reset_peak_rss, if it succeeded), or None."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class StageTimer(object):
+    """
+    Accumulate the time, records, bytes and peak memory of the
+    stages of a benchmark.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.peakReset = reset_peak_rss()
+
+    def run(self, stage, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) as a run of a stage and return its
+        result. The records and bytes of the run are given afterwards
+        with count().
+        """
+        stats = self.stages.setdefault(stage, {
+            "runs": 0, "seconds": 0., "records": 0, "bytes": 0,
+            "peak_rss": 0, "peak_rss_increase": 0})
+        self.peakReset = reset_peak_rss()
+        rss0 = current_rss()
+        t0 = time.time()
+        result = func(*args, **kwargs)
+        stats["seconds"] += time.time() - t0
+        stats["runs"] += 1
+        peak = peak_rss()
+        if peak is not None:
+            stats["peak_rss"] = max(stats["peak_rss"], peak)
+            if rss0 is not None:
+                stats["peak_rss_increase"] = max(stats["peak_rss_increase"],
+                                                 peak - rss0)
+        return result
+
+    def count(self, stage, records=0, nbytes=0):
+        """Add the records and bytes processed by a run of a stage."""
+        self.stages[stage]["records"] += records
+        self.stages[stage]["bytes"] += nbytes
+
+    def results(self):
+        """Statistics of each stage (records_per_s and mb_per_s are
+        None for stages that don't process records or bytes)."""
+        results = {}
+        for stage, stats in self.stages.items():
+            seconds = stats["seconds"]
+            res = {"runs": stats["runs"], "seconds": round(seconds, 4),
+                   "records": stats["records"],
+                   "records_per_s": None, "mb": None, "mb_per_s": None,
+                   "peak_rss_mb": round(stats["peak_rss"] / 1.e6, 1),
+                   "peak_rss_increase_mb": round(
+                       stats["peak_rss_increase"] / 1.e6, 1)}
+            if stats["records"] and seconds > 0:
+                res["records_per_s"] = round(stats["records"] / seconds, 1)
+            if STAGE_BYTES.get(stage) is not None:
+                res["mb"] = round(stats["bytes"] / 1.e6, 3)
+                if seconds > 0:
+                    res["mb_per_s"] = round(stats["bytes"] / 1.e6 /
+                                            seconds, 3)
+            results[stage] = res
+        return results
+
+
+def _write_parquet(source, fname, stime, etime, converter):
+    """Convert a dmap file to a Parquet file, as
+    day_conversion.convert_day does."""
+    return converter.create_parquet_file_stream(
+        converter.iter_record_batches(
+            dmap_reader.read_dmap_records(source, stime, etime)), fname)
+
+
+def _read_hdf5(fname):
+    """Read all the records of an hdf5 file."""
+    with HDF5Reader(fname) as reader:
+        return reader.read()
+
+
+def benchmark_day(timer, rad, day, archiveDir, workDir, catalog, stages):
+    """
+    Run the stages of a radar-day.
+
+    Parameters
+    ----------
+    timer : StageTimer
+        Accumulates the results.
+    rad : str
+        Three-letter radar code.
+    day : datetime.datetime
+        The day.
+    archiveDir : str
+        Root of the synthetic archive.
+    workDir : str
+        Directory of the files written.
+    catalog : file_catalog.FileCatalog
+        Catalog of the archive.
+    stages : list
+        Stages to time; the others still run if later stages need
+        their outputs.
+    """
+    stime = day
+    etime = day + dt.timedelta(days=1)
+    name = day.strftime("%Y%m%d") + "." + rad
+    localdict = {"ftype": "fitacf", "radar": rad, "channel": "."}
+    localdirfmt = os.path.join(archiveDir, LOCALDIRFMT)
+
+    def run(stage, func, *args, **kwargs):
+        if stage in stages:
+            return timer.run(stage, func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    def count(stage, records=0, nbytes=0):
+        if stage in stages:
+            timer.count(stage, records, nbytes)
+
+    srcFiles = run("discovery", dmap_to_csv.locate_local_files, stime,
+                   etime, localdirfmt, dict(localdict), FNAMEFMT)
+    if "catalog" in stages:
+        run("catalog", catalog.query, stime, etime, rad, ftype="fitacf")
+
+    dmapFile = os.path.join(workDir, name + ".fitacf")
+    run("decompression", concat_files, srcFiles, dmapFile)
+    dmapBytes = os.path.getsize(dmapFile)
+
+    colBatches = run("decode", list, read_dmap_columns(dmapFile))
+    nrec = sum(colBatch.nrec for colBatch in colBatches)
+    count("decompression", nrec, dmapBytes)
+    count("decode", nrec, dmapBytes)
+
+    if "filter" in stages:
+        colBatch = ColumnBatch.concat(colBatches)
+        run("filter", median_filter.boxcar_median_filter, colBatch)
+        count("filter", nrec)
+        del colBatch
+    del colBatches
+
+    records = None
+    if "decode_records" in stages or "hdf5_write" in stages or \
+            "hdf5_read" in stages:
+        records = run("decode_records", list,
+                      dmap_reader.read_dmap_records(dmapFile, stime, etime))
+        count("decode_records", nrec, dmapBytes)
+
+    outputs = {}
+    if "csv_write" in stages or "csv_read" in stages:
+        outputs["csv"] = run("csv_write", dmap_to_csv.dmap_to_csv, dmapFile,
+                             stime, etime)
+    if "hdf5_write" in stages or "hdf5_read" in stages:
+        outputs["hdf5"] = os.path.join(workDir, name + ".hdf5")
+        run("hdf5_write", HDF5Converter(stime, etime, rad).create_hdf5_file,
+            records, outputs["hdf5"], index=True)
+    del records
+    if "parquet_write" in stages or "parquet_read" in stages:
+        pqDir = os.path.join(workDir, "parquet", "")
+        if not os.path.exists(pqDir):
+            os.makedirs(pqDir)
+        # named as ParquetReader expects
+        outputs["parquet"] = pqDir + day.strftime("%Y%m%d") + rad + \
+            ".parquet"
+        run("parquet_write", _write_parquet, dmapFile, outputs["parquet"],
+            stime, etime, ParquetConverter(stime, etime, rad))
+    for fmt, fname in outputs.items():
+        count(fmt + "_write", nrec, os.path.getsize(fname))
+
+    if "csv_read" in stages:
+        run("csv_read", csv_to_dict.csv_to_columns, outputs["csv"])
+    if "hdf5_read" in stages:
+        run("hdf5_read", _read_hdf5, outputs["hdf5"])
+    if "parquet_read" in stages:
+        run("parquet_read", ParquetReader(pqDir).read, stime, etime, [rad])
+    for fmt, fname in outputs.items():
+        count(fmt + "_read", nrec, os.path.getsize(fname))
+
+    # keep the work directory small
+    for fname in [dmapFile] + list(outputs.values()):
+        os.remove(fname)
+
+
+def _versions():
+    """Versions of Python, of the libraries used and of the code."""
+    import h5py
+    import pyarrow
+    versions = {"python": platform.python_version(),
+                "numpy": np.__version__, "pyarrow": pyarrow.__version__,
+                "h5py": h5py.__version__, "git_commit": None}
+    try:
+        out = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT)
+        versions["git_commit"] = out.decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return versions
+
+
+def run_benchmark(radars, days, nBeam=16, nRang=75, recordsPerDay=28800,
+                  fillFraction=0.3, workDir=None, stages=None, keep=False,
+                  seed=0):
+    """
+    Write a synthetic archive and time the stages of the conversion
+    of each of its radar-days.
+
+    Parameters
+    ----------
+    radars : list
+        Three-letter radar codes.
+    days : list
+        Days (datetime.datetime).
+    nBeam, nRang, recordsPerDay, fillFraction :
+        See synthetic_fitacf.synthetic_records.
+    workDir : Optional[str]
+        Directory of the archive and of the files written (default: a
+        temporary directory).
+    stages : Optional[list]
+        Stages to time (default: STAGES).
+    keep : bool
+        Keep the work directory.
+    seed : int
+        Seed of the synthetic data.
+
+    Returns
+    -------
+    dict
+        The configuration, the versions, the size of the archive and
+        the results of each stage (see StageTimer.results).
+    """
+    if stages is None:
+        stages = STAGES
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError("unknown stage: " + stage)
+    tmpDir = workDir is None
+    if tmpDir:
+        workDir = tempfile.mkdtemp(prefix="sd_benchmark")
+    archiveDir = os.path.join(workDir, "archive")
+    started = dt.datetime.utcnow()
+    try:
+        t0 = time.time()
+        srcFiles = synthetic_fitacf.write_archive(
+            archiveDir, radars, days, nBeam=nBeam, nRang=nRang,
+            recordsPerDay=recordsPerDay, fillFraction=fillFraction,
+            seed=seed)
+        genTime = time.time() - t0
+        archiveBytes = sum(os.path.getsize(fname) for fname in srcFiles)
+
+        timer = StageTimer()
+        catalog = FileCatalog(os.path.join(workDir, "catalog.sqlite"))
+        try:
+            if "catalog" in stages:
+                timer.run("catalog", catalog.update, archiveDir)
+            else:
+                catalog.update(archiveDir)
+            for rad in radars:
+                for day in days:
+                    benchmark_day(timer, rad, day, archiveDir, workDir,
+                                  catalog, stages)
+        finally:
+            catalog.close()
+    finally:
+        if tmpDir and not keep:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    stageResults = timer.results()
+    return {"version": RESULTS_VERSION,
+            "started": started.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "config": {"radars": radars,
+                       "days": [day.strftime("%Y-%m-%d") for day in days],
+                       "beams": nBeam, "gates": nRang,
+                       "records_per_day": recordsPerDay,
+                       "fill_fraction": fillFraction, "seed": seed},
+            "environment": dict(_versions(), platform=platform.platform(),
+                                cpus=multiprocessing.cpu_count(),
+                                per_stage_peak_rss=timer.peakReset),
+            "archive": {"files": len(srcFiles), "bytes": archiveBytes,
+                        "generation_seconds": round(genTime, 2)},
+            "stages": [dict(stageResults[stage], stage=stage)
+                       for stage in STAGES if stage in stageResults]}
+
+
+def compare_results(old, new):
+    """
+    Lines comparing the stages of two benchmark results: the time of
+    each stage in both and the speedup of the new one (from records/s
+    when the stage processes records, so that runs over different
+    amounts of data compare).
+    """
+    oldStages = dict((res["stage"], res) for res in old["stages"])
+    lines = ["{:<16s}{:>12s}{:>12s}{:>10s}".format(
+        "stage", "old (s)", "new (s)", "speedup")]
+    for res in new["stages"]:
+        ref = oldStages.get(res["stage"])
+        if ref is None:
+            continue
+        if ref["records_per_s"] and res["records_per_s"]:
+            speedup = res["records_per_s"] / ref["records_per_s"]
+        elif res["seconds"]:
+            speedup = ref["seconds"] / res["seconds"]
+        else:
+            speedup = float("inf")
+        lines.append("{:<16s}{:>12.3f}{:>12.3f}{:>9.2f}x".format(
+            res["stage"], ref["seconds"], res["seconds"], speedup))
+    if old["config"] != new["config"]:
+        lines.append("warning: the runs have different configurations")
+    return lines
+
+
+def format_results(results):
+    """Lines of a table of the results of the stages."""
+    def _fmt(value, spec):
+        return "-" if value is None else spec.format(value)
+    lines = ["{:<16s}{:>10s}{:>14s}{:>10s}{:>12s}".format(
+        "stage", "seconds", "records/s", "MB/s", "peak MB")]
+    for res in results["stages"]:
+        lines.append("{:<16s}{:>10.3f}{:>14s}{:>10s}{:>12.1f}".format(
+            res["stage"], res["seconds"],
+            _fmt(res["records_per_s"], "{:.0f}"),
+            _fmt(res["mb_per_s"], "{:.2f}"), res["peak_rss_mb"]))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the conversion stages on synthetic data")
+    parser.add_argument("--radars", default="bks",
+                        help="comma separated radar codes")
+    parser.add_argument("--start", default="2012-12-05",
+                        help="first day (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=1,
+                        help="number of days per radar")
+    parser.add_argument("--beams", type=int, default=16)
+    parser.add_argument("--gates", type=int, default=75)
+    parser.add_argument("--records-per-day", type=int, default=28800)
+    parser.add_argument("--fill-fraction", type=float, default=0.3,
+                        help="fraction of range gates with data")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma separated stages to time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=None,
+                        help="directory of the files written "
+                             "(default: a temporary one)")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the temporary directory")
+    parser.add_argument("--output", default=None,
+                        help="JSON file of the results (default: stdout)")
+    parser.add_argument("--compare", default=None,
+                        help="JSON results of an earlier run to compare to")
+    args = parser.parse_args(argv)
+
+    start = dt.datetime.strptime(args.start, "%Y-%m-%d")
+    days = [start + dt.timedelta(days=i) for i in range(args.days)]
+    results = run_benchmark(
+        args.radars.split(","), days, nBeam=args.beams, nRang=args.gates,
+        recordsPerDay=args.records_per_day, fillFraction=args.fill_fraction,
+        workDir=args.work_dir, stages=args.stages.split(","),
+        keep=args.keep, seed=args.seed)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        for line in format_results(results):
+            print(line)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        for line in compare_results(old, results):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
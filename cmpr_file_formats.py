@@ -13,6 +13,8 @@ if module_path not in sys.path:
 import dmap_to_csv
 import generate_parquet_files
 import generate_hdf5_files
+import shutil
+from conversion_cache import make_key
 
 class CreateFiles(object):
     """
@@ -20,14 +22,46 @@ class CreateFiles(object):
     file formats such as Parquet, HDF5 and csv
     to from fitacf data.
     """
-    def __init__(self, inpTime, inpRad):
+    def __init__(self, inpTime, inpRad, cache=None, catalog=None):
         """
         Initialize date, rad and other variables used.
         NOTE : we'll create 1 file/day
+        If both a conversion_cache.ConversionCache and a
+        file_catalog.FileCatalog (to identify the source files)
+        are given, outputs already made from the same source files
+        with the same settings are reused.
         """
         self.startTime = inpTime
         self.inpRad = inpRad
         self.endTime = self.startTime + datetime.timedelta(days=1)
+        self.cache = cache
+        self.catalog = catalog
+
+    def _cache_key(self, **settings):
+        """
+        Cache key of an output of this day, or None if
+        no cache (or no catalog) is used.
+        """
+        if self.cache is None or self.catalog is None:
+            return None
+        sources = self.catalog.query(self.startTime, self.endTime,
+                                     self.inpRad)
+        return make_key(sources, self.startTime, self.endTime,
+                        radar=self.inpRad, **settings)
+
+    def _get_cached(self, cacheKey, outFile):
+        """
+        Put the cached output of cacheKey at outFile.
+        Returns False if there is none.
+        """
+        if cacheKey is None:
+            return False
+        cached = self.cache.get(cacheKey)
+        if cached is None:
+            return False
+        if cached != outFile:
+            shutil.copyfile(cached, outFile)
+        return True
 
     def create_csv_fitacf_files(self, csvOutDir, fitOutDir):
         """
@@ -47,29 +81,65 @@ class CreateFiles(object):
         os.rename(fitFilePath + "/" + fitFileName, fitOutDir + fitFileName)
 
     def create_parquet_files(self, pqOutDir, \
-            compression='brotli',version="2.0"):
+            compression='brotli',version=None):
         """
-        Generate Parquet files from fitacf data
+        Generate Parquet files from fitacf data, written
+        in row groups by ParquetConverter.create_parquet_file_stream
+        (version is the Parquet format version, pyarrow's
+        default if None).
+        Returns the file name, or None if there were no data.
         """
+        outParquetFile = self.get_parquet_file_name(pqOutDir)
+        cacheKey = self._cache_key(output="parquet", compression=compression,
+                                   version=version)
+        if self._get_cached(cacheKey, outParquetFile):
+            return outParquetFile
         pqObj = generate_parquet_files.ParquetConverter(self.startTime,\
                          self.endTime, self.inpRad)
         fData = pqObj.get_dmap_dicts()
-        paTab = pqObj.json_to_pyarrow_table(fData)
-        outParquetFile = pqOutDir + self.startTime.strftime("%Y%m%d") +\
-                         self.inpRad + ".parquet"
-        pqObj.create_parquet_file(paTab, outParquetFile,\
-                 compression=compression,version=version)
+        if fData is None:
+            return None
+        pqKwargs = {"compression": compression}
+        if version is not None:
+            pqKwargs["version"] = version
+        pqObj.create_parquet_file_stream(pqObj.iter_record_batches(fData),\
+                 outParquetFile, **pqKwargs)
+        if cacheKey is not None:
+            self.cache.put(cacheKey, outParquetFile)
+        return outParquetFile
 
     def create_hdf5_files(self, hdf5OutDir):
         """
-        Generate hdf5 files from fitacf data
+        Generate hdf5 files from fitacf data.
+        Returns the file name, or None if there were no data.
         """
+        outFile = self.get_hdf5_file_name(hdf5OutDir)
+        cacheKey = self._cache_key(output="hdf5")
+        if self._get_cached(cacheKey, outFile):
+            return outFile
         hdf5Obj = generate_hdf5_files.HDF5Converter(self.startTime,\
                          self.endTime, self.inpRad)
         fData = hdf5Obj.get_dmap_dicts()
-        outFile = hdf5OutDir + self.startTime.strftime("%Y%m%d") +\
-                         "."+self.inpRad + ".hdf5"
+        if fData is None:
+            return None
         hdf5Obj.create_hdf5_file(fData, outFile)
+        if cacheKey is not None:
+            self.cache.put(cacheKey, outFile)
+        return outFile
+
+    def get_parquet_file_name(self, pqOutDir):
+        """
+        Name of the Parquet file created by create_parquet_files
+        """
+        return pqOutDir + self.startTime.strftime("%Y%m%d") +\
+               self.inpRad + ".parquet"
+
+    def get_hdf5_file_name(self, hdf5OutDir):
+        """
+        Name of the hdf5 file created by create_hdf5_files
+        """
+        return hdf5OutDir + self.startTime.strftime("%Y%m%d") +\
+               "."+self.inpRad + ".hdf5"
 
 if __name__ == "__main__":
     sDate = datetime.datetime(2012,6,1)
@@ -82,6 +152,6 @@ if __name__ == "__main__":
             print sDate, sr
             cfo = CreateFiles(sDate, sr)
             cfo.create_parquet_files(pqOutDir)
-            sDate += datetime.timedelta(days=1)
             print " ******* Created Parquet File *******"
+        sDate += datetime.timedelta(days=1)
     # cfo = CreateFiles(currDate, selRad)
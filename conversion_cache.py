@@ -0,0 +1,209 @@
+"""
+Content-addressed cache of conversion outputs.
+
+An output (a concatenated or filtered dmap file, a csv, Parquet or HDF5
+file) is registered under a key hashed from the identities (path, size,
+mtime) of the source files it was made from, the time window and the
+converter settings. A later request with the same key gets the existing
+file back instead of redoing the work; a changed source file changes
+the key. The total size of the registered files is capped by evicting
+the least recently used ones, and entries can be given a maximum age.
+"""
+
+import datetime as dt
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+
+def source_identity(paths):
+    """(absolute path, size, mtime) of each source file, in order."""
+    ident = []
+    for path in paths:
+        st = os.stat(path)
+        ident.append((os.path.abspath(path), st.st_size, st.st_mtime))
+    return ident
+
+
+def make_key(sources, stime=None, etime=None, **settings):
+    """Cache key of a conversion.
+
+    Parameters
+    ----------
+    sources : list
+        Full paths of the source files.
+    stime, etime : Optional[datetime.datetime]
+        Time window of the conversion.
+    **settings
+        Anything else the output depends on (output format, filter
+        settings, compression, ...); values must be JSON serializable.
+
+    Returns
+    -------
+    str
+        A hex digest.
+
+    """
+    def _time(t):
+        return t.isoformat() if isinstance(t, dt.datetime) else t
+
+    desc = {"sources": source_identity(sources),
+            "stime": _time(stime), "etime": _time(etime),
+            "settings": settings}
+    text = json.dumps(desc, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ConversionCache(object):
+    """
+    SQLite index of cached conversion outputs with LRU, size-capped
+    eviction. The output files stay where the converters wrote them
+    (tmpdir, output directories); evicted files are deleted.
+    """
+
+    def __init__(self, dbPath, maxBytes=None, maxEntries=None, maxAge=None):
+        """
+        Parameters
+        ----------
+        dbPath : str
+            SQLite file holding the index (created if needed).
+        maxBytes : Optional[int]
+            Maximum total size of the cached files.
+        maxEntries : Optional[int]
+            Maximum number of cached files.
+        maxAge : Optional[float]
+            Entries older than maxAge seconds are expired.
+        """
+        self.dbPath = dbPath
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self.maxAge = maxAge
+        # several conversion processes may share the cache
+        self.conn = sqlite3.connect(dbPath, timeout=60)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used);
+            """)
+
+    def close(self):
+        """Close the database connection."""
+        self.conn.close()
+
+    def get(self, key):
+        """
+        Path of the output cached under key, or None. Entries whose
+        file was removed or modified since it was cached are dropped,
+        and expired ones removed.
+        """
+        row = self.conn.execute(
+            "SELECT path, size, mtime, created FROM entries WHERE key = ?",
+            (key,)).fetchone()
+        if row is None:
+            return None
+        path, size, mtime, created = row
+        if self.maxAge is not None and time.time() - created > self.maxAge:
+            self.remove(key)
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if st is None or st.st_size != size or st.st_mtime != mtime:
+            logging.info("stale cache entry for " + path)
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.conn.commit()
+            return None
+        self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?",
+                          (time.time(), key))
+        self.conn.commit()
+        return path
+
+    def put(self, key, path):
+        """
+        Register the output file path under key, then evict the least
+        recently used entries beyond the size/count limits.
+        Returns path.
+        """
+        st = os.stat(path)
+        now = time.time()
+        old = self.conn.execute("SELECT path FROM entries WHERE key = ?",
+                                (key,)).fetchone()
+        if old is not None and old[0] != path and os.path.exists(old[0]):
+            self._remove_file(old[0])
+        # entries of other keys made at the same path were overwritten:
+        # drop them, without deleting the file that is now this entry's
+        self.conn.execute("DELETE FROM entries WHERE path = ? AND key != ?",
+                          (path, key))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+            (key, path, st.st_size, st.st_mtime, now, now))
+        self.conn.commit()
+        self.evict(keep=key)
+        return path
+
+    def remove(self, key):
+        """Drop an entry and delete its file."""
+        row = self.conn.execute("SELECT path FROM entries WHERE key = ?",
+                                (key,)).fetchone()
+        if row is not None:
+            self._remove_file(row[0])
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.conn.commit()
+
+    def total_bytes(self):
+        """Total size of the cached files."""
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self, keep=None):
+        """
+        Delete expired entries, then least recently used entries (and
+        their files) until the cache is within maxBytes and maxEntries.
+        The entry keep is never evicted. Returns the number of evicted
+        entries.
+        """
+        nEvicted = 0
+        if self.maxAge is not None:
+            expired = list(self.conn.execute(
+                "SELECT key, path FROM entries WHERE created < ? AND key != ?",
+                (time.time() - self.maxAge, keep or "")))
+            for key, path in expired:
+                self._remove_file(path)
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            nEvicted += len(expired)
+        rows = list(self.conn.execute(
+            "SELECT key, path, size FROM entries ORDER BY last_used DESC"))
+        total = sum(row[2] for row in rows)
+        count = len(rows)
+        # walk from the least recently used end
+        for key, path, size in reversed(rows):
+            overSize = self.maxBytes is not None and total > self.maxBytes
+            overCount = self.maxEntries is not None and count > self.maxEntries
+            if not (overSize or overCount):
+                break
+            if key == keep:
+                continue
+            self._remove_file(path)
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            count -= 1
+            nEvicted += 1
+        self.conn.commit()
+        return nEvicted
+
+    def _remove_file(self, path):
+        """Delete a cached file, if it is still there."""
+        try:
+            os.remove(path)
+            logging.info("evicted " + path)
+        except OSError:
+            pass
@@ -8,7 +8,8 @@ import numpy as np
 import pandas as pd
 import sys
 sys.path.append("./")
-from csv_to_dict import csv_to_dict
+from csv_to_dict import csv_to_columns
+from gate_table import flatten_to_gates, gates_to_dataframe
 
 # input parameters
 stime = None
@@ -28,27 +29,18 @@ fdir = "./data/tmp/"
 fname = fdir + "20121205.000000.20121206.000000.bks.fitacf.csv"
 fname_out = fname[:-4] + ".vel" +".csv"
 
-data_dict = csv_to_dict(fname, stime=stime, etime=etime, sep=csv_sep)
-
 # Store selected parameters into a data frame
 params = ["time", "v", "slist", "bmnum", "bmazm", "gflg", "rsep", "frang"]
-
-# Flatten the data
-dct = {}
-dct["UT_Time"] = [x for i in range(len(data_dict["time"]))\
-                  for x in [data_dict["time"][i]]*len(data_dict["v"][i])]
-dct["LOS_Velocity"] = [x for i in range(len(data_dict["time"]))\
-                  for x in data_dict["v"][i]]
-dct["Range_Gate"] = [x for i in range(len(data_dict["time"]))\
-                     for x in data_dict["slist"][i]]
-dct["Beam_Number"] = [x for i in range(len(data_dict["time"]))\
-                      for x in [data_dict["bmnum"][i]]*len(data_dict["v"][i])]
-dct["Beam_Azimuth"] = [x for i in range(len(data_dict["time"]))\
-                       for x in [data_dict["bmazm"][i]]*len(data_dict["v"][i])]
-dct["Ground_Scatter_Flag"] = [x for i in range(len(data_dict["time"]))\
-                              for x in data_dict["gflg"][i]]
-
-df = pd.DataFrame(data=dct)
+colBatch = csv_to_columns(fname, stime=stime, etime=etime, sep=csv_sep,
+                          usecols=params)
+
+# Flatten the data, one row per range gate
+columns = {"time": "UT_Time", "v": "LOS_Velocity", "slist": "Range_Gate",
+           "bmnum": "Beam_Number", "bmazm": "Beam_Azimuth",
+           "gflg": "Ground_Scatter_Flag"}
+table = flatten_to_gates(colBatch, scalar_names=["time", "bmnum", "bmazm"],
+                         array_names=["v", "slist", "gflg"], rename=columns)
+df = gates_to_dataframe(table, time_column="UT_Time")
 df.set_index("UT_Time", inplace=True)
 df.to_csv(fname_out, index_label="UT_Time")
 
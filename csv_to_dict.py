@@ -6,9 +6,132 @@ import datetime as dt
 import logging
 import numpy as np
 import pandas as pd
-import ast
+from csv_writer import CSV_COLUMNS
+from dmap_columns import ColumnBatch, fill_value
+from fitacf_schema import COLUMN_DTYPES
 
-def csv_to_dict(fname, stime=None, etime=None, sep="|", orient="list"):
+# csv column -> fitacf parameter, for the columns written by dmap_to_csv
+CSV_PARAMS = dict((col, name) for col, name, kind in CSV_COLUMNS)
+
+# List-valued columns, as "[a, b, ...]" strings
+LIST_COLUMNS = [col for col, name, kind in CSV_COLUMNS if kind == "list"]
+
+# Trailing shapes of multi-dimensional list columns
+LIST_SHAPES = {"ltab": (2,)}
+
+# Format of the time column
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_list_column(cells, dtype=np.float64):
+    """Parses a column of "[a, b, ...]" strings (nested lists, such as
+    ltab, are flattened) into flat values and offsets.
+
+    Parameters
+    ----------
+    cells : sequence of str
+        One string per record; missing cells are read as empty lists.
+    dtype : numpy dtype
+        dtype of the values.
+
+    Returns
+    -------
+    values : numpy.ndarray
+        The values of all the records; those of record i are
+        values[offsets[i]:offsets[i+1]].
+    offsets : numpy.ndarray
+        int64 offsets of length len(cells)+1.
+
+    """
+    cells = pd.Series(cells, dtype=object).fillna("[]")
+    nonEmpty = (cells != "[]").values
+    lens = np.where(nonEmpty, cells.str.count(",").values + 1, 0)
+    offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+    np.cumsum(lens, out=offsets[1:])
+    # strip the brackets of all the cells at once
+    text = ",".join(cells.values[nonEmpty].tolist())
+    text = text.replace("[", "").replace("]", "")
+    values = np.fromstring(text, dtype=np.float64, sep=",") if text \
+        else np.zeros(0)
+    if len(values) != offsets[-1]:
+        raise ValueError("malformed list column")
+    return values.astype(dtype), offsets
+
+
+def _read_csv(fname, stime, etime, sep, usecols):
+    """Loads the csv file into a DataFrame whose list columns are kept
+    as strings and whose time column is parsed, selecting usecols and
+    the records between stime and etime."""
+    if usecols is not None:
+        usecols = list(usecols)
+        if "time" not in usecols:
+            usecols.append("time")
+    dtypes = dict((col, str) for col in LIST_COLUMNS)
+    df = pd.read_csv(fname, sep=sep, na_values="None", usecols=usecols,
+                     dtype=dtypes)
+    df["time"] = pd.to_datetime(df["time"], format=TIME_FORMAT)
+    if stime is not None:
+        df = df.loc[df.time >= stime, :]
+    if etime is not None:
+        df = df.loc[df.time <= etime, :]
+    return df
+
+
+def csv_to_columns(fname, stime=None, etime=None, sep="|", usecols=None):
+    """Reads data from a csv file written by dmap_to_csv into columns.
+
+    Parameter
+    ---------
+    fname : str
+        Full path of a csv file.
+    stime : Optional[datetime.datetime]
+        The start time of interest
+    etime : Optional[datetime.datetime]
+        The end time of interest
+    sep : str
+        Delimiter to use
+    usecols : Optional[list]
+        csv columns to read (time is always read)
+
+    Returns
+    -------
+    dmap_columns.ColumnBatch
+        Keyed by fitacf parameter names (e.g., "intt.sc" for inttsc);
+        time is in seconds since the epoch and missing integers are
+        set to dmap_columns.fill_value.
+
+    """
+    df = _read_csv(fname, stime, etime, sep, usecols)
+    nrec = len(df)
+    scalars = {}
+    arrays = {}
+    shapes = {}
+    epoch = df["time"].values.astype("datetime64[us]").astype(np.int64)
+    scalars["time"] = epoch * 1e-6
+    for col in df.columns:
+        name = CSV_PARAMS.get(col, col)
+        if col == "time":
+            continue
+        dtype = COLUMN_DTYPES.get(name)
+        if col in LIST_COLUMNS:
+            values, offsets = parse_list_column(df[col].values,
+                                                dtype or np.float64)
+            arrays[name] = (values, offsets)
+            if col in LIST_SHAPES:
+                shapes[name] = LIST_SHAPES[col]
+        elif dtype is not None and np.dtype(dtype).kind in "iu" and \
+                df[col].dtype.kind in "fiu":
+            vals = df[col].values
+            if vals.dtype.kind == "f":
+                vals = np.where(np.isnan(vals), fill_value(dtype), vals)
+            scalars[name] = vals.astype(dtype)
+        else:
+            scalars[name] = df[col].values
+    return ColumnBatch(nrec, scalars, arrays, shapes)
+
+
+def csv_to_dict(fname, stime=None, etime=None, sep="|", orient="list",
+                usecols=None):
 
     """Reads data from a csv file and returns a dictionary.
 
@@ -23,6 +146,8 @@ def csv_to_dict(fname, stime=None, etime=None, sep="|", orient="list"):
         If set to None, reads data to the end of a day
     sep : str
         Delimiter to use
+    usecols : Optional[list]
+        csv columns to read (time is always read)
 
     Returns
     -------
@@ -33,15 +158,7 @@ def csv_to_dict(fname, stime=None, etime=None, sep="|", orient="list"):
 
     # Load to a pandas dataframe
     print("Loading csv file to pandas dataframe")
-    date_parser = lambda x: dt.datetime.strptime(x, "%Y-%m-%d %H:%M:%S")
-    df = pd.read_csv(fname, sep=sep, na_values="None",
-                     parse_dates=['time'],
-                     date_parser=date_parser)
-    
-    if stime is not None:
-        df = df.loc[df.time >= stime, :]
-    if etime is not  None:
-        df = df.loc[df.time <= etime, :]
+    df = _read_csv(fname, stime, etime, sep, usecols)
 
     # Convert to a dict
     print("Converting pandas dataframe to dict")
@@ -52,23 +169,21 @@ def csv_to_dict(fname, stime=None, etime=None, sep="|", orient="list"):
     # and it becomes messy, this is a simple 
     # method Muhammad deviced and I'm building on it.
     data_dict = df.to_dict(orient="list")
-    print df["ptab"].dtypes
-    # Convert a string representation of list to a list 
-    prm_keys = ["ptab", "ltab"]
-    fit_keys = ["elv", "gflg", "nlag", "p_l", "p_l_e", "p_s",
-                "p_s_e", "phi0", "phi0_e", "pwr0", "qflg", "slist", "v",
-                "v_e", "w_l", "w_l_e", "w_s", "w_s_e"]
-
-    keys_list = prm_keys + fit_keys
+
+    # Convert a string representation of list to a list, parsing each
+    # column at once into flat values and splitting them by record
     print("Converting string representation of lists to normal lists")
-    for ky in keys_list:
-        data_dict[ky] = [ast.literal_eval(x) for x in data_dict[ky]]
-        #for x in data_dict[ky]:
-        #    try:
-        #        ast.literal_eval(x)
-        #    except:
-        #        import pdb
-        #        pdb.set_trace()
+    for ky in LIST_COLUMNS:
+        if ky not in data_dict:
+            continue
+        dtype = COLUMN_DTYPES.get(CSV_PARAMS[ky], np.float64)
+        values, offsets = parse_list_column(df[ky].values, dtype)
+        if ky in LIST_SHAPES:
+            values = values.reshape((-1,) + LIST_SHAPES[ky])
+            offsets = offsets // int(np.prod(LIST_SHAPES[ky]))
+        values = values.tolist()
+        data_dict[ky] = [values[a:b] for a, b in zip(offsets[:-1],
+                                                     offsets[1:])]
 
 #    # if we need a list of dicts conver the dict of lists to the format
 #    if orient == "records":
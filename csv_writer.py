@@ -0,0 +1,274 @@
+"""
+Vectorised csv export of fitacf data.
+
+Records are read in blocks of columns (see dmap_columns) and each csv
+column is formatted for the whole block at once with NumPy and Arrow
+compute kernels, instead of calling str() on every parameter of every
+record and joining the strings line by line. Infinite, NaN and
+missing values are written as configurable sentinels, and floats can be
+rounded to a given number of decimals. With compat=True the output is
+byte for byte the one of the record by record writer of dmap_to_csv.
+"""
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from dmap_columns import read_dmap_columns, fill_value
+
+# (csv column, fitacf parameter, kind) in the order of the csv file;
+# kind is "time", "channel", "ftype" (the file type), "flag" (1 if the
+# file type is the parameter name), "scalar" or "list"
+CSV_COLUMNS = [("time", "time", "time"), ("bmnum", "bmnum", "scalar"),
+               ("channel", "channel", "channel"), ("stid", "stid", "scalar"),
+               ("cp", "cp", "scalar"), ("lmfit", "lmfit", "flag"),
+               ("fitex", "fitex", "flag"), ("exflg", "exflg", "scalar"),
+               ("iqflg", "iqflg", "scalar"), ("offset", "offset", "scalar"),
+               ("lmflg", "lmflg", "scalar"), ("rawflg", "rawflg", "scalar"),
+               ("fType", "fType", "ftype"), ("acflg", "acflg", "scalar"),
+               ("fitacf", "fitacf", "flag"),
+               # params in myBeam.fit
+               ("elv", "elv", "list"), ("gflg", "gflg", "list"),
+               ("nlag", "nlag", "list"), ("npnts", "npnts", "scalar"),
+               ("p_l", "p_l", "list"), ("p_l_e", "p_l_e", "list"),
+               ("p_s", "p_s", "list"), ("p_s_e", "p_s_e", "list"),
+               ("phi0", "phi0", "list"), ("phi0_e", "phi0_e", "list"),
+               ("pwr0", "pwr0", "list"), ("qflg", "qflg", "list"),
+               ("slist", "slist", "list"), ("v", "v", "list"),
+               ("v_e", "v_e", "list"), ("w_l", "w_l", "list"),
+               ("w_l_e", "w_l_e", "list"), ("w_s", "w_s", "list"),
+               ("w_s_e", "w_s_e", "list"),
+               # params in myBeam.prm
+               ("bmazm", "bmazm", "scalar"), ("frang", "frang", "scalar"),
+               ("ifmode", "ifmode", "scalar"), ("inttsc", "intt.sc", "scalar"),
+               ("inttus", "intt.us", "scalar"), ("lagfr", "lagfr", "scalar"),
+               ("ltab", "ltab", "list"), ("mpinc", "mpinc", "scalar"),
+               ("mplgexs", "mplgexs", "scalar"), ("mplgs", "mplgs", "scalar"),
+               ("mppul", "mppul", "scalar"), ("nave", "nave", "scalar"),
+               ("noisemean", "noise.mean", "scalar"),
+               ("noisesearch", "noise.search", "scalar"),
+               ("noisesky", "noise.sky", "scalar"), ("nrang", "nrang", "scalar"),
+               ("ptab", "ptab", "list"), ("rsep", "rsep", "scalar"),
+               ("rxrise", "rxrise", "scalar"), ("scan", "scan", "scalar"),
+               ("smsep", "smsep", "scalar"), ("tfreq", "tfreq", "scalar"),
+               ("txpl", "txpl", "scalar"), ("xcf", "xcf", "scalar")]
+
+CSV_HEADER = [col for col, name, kind in CSV_COLUMNS]
+
+# Parameters whose infinite values were always written as 999999
+INF_PARAMS = ["p_l_e", "p_s_e", "phi0_e", "v_e", "w_l", "w_l_e",
+              "w_s", "w_s_e"]
+
+# Channel number -> channel letter, as in davitpy's beamData
+CHANNEL_LETTERS = {2: "b", 3: "c", 4: "d"}
+
+# str() of floats is their repr() (python 3)
+_STR_IS_REPR = str(1. / 3) == repr(1. / 3)
+
+
+def _repr_strings(values):
+    """Formats a float array as repr() formats Python floats. Arrow
+    writes the same shortest round-trip digits, but leaves out the ".0"
+    of integral values and switches to exponent notation at other
+    magnitudes, so repr() is only called outside [1e-4, 1e10)."""
+    values = values.astype(np.float64)
+    strs = pa.array(values).cast(pa.string())
+    absValues = np.abs(values)
+    fixed = (absValues >= 1e-4) & (absValues < 1e10)
+    integral = (fixed & (values == np.floor(values))) | (values == 0)
+    if integral.any():
+        strs = pc.if_else(pa.array(integral),
+                          pc.binary_join_element_wise(strs, ".0", ""), strs)
+    other = ~fixed & np.isfinite(values) & (values != 0)
+    if other.any():
+        strs = pc.replace_with_mask(
+            strs, pa.array(other),
+            pa.array([repr(x) for x in values[other].tolist()],
+                     type=pa.string()))
+    return strs
+
+
+def _float_strings(values, precision, compat, list_values):
+    """Formats a float array. In compat mode values are formatted as
+    Python formats floats: repr() in lists and str() for scalars (which
+    differ in python 2 only). Otherwise they are formatted by Arrow with
+    the shortest representation of their own dtype, after rounding to
+    precision decimals if precision is not None."""
+    if compat:
+        if list_values or _STR_IS_REPR:
+            return _repr_strings(values)
+        return pa.array([str(x) for x in values.tolist()], type=pa.string())
+    if precision is not None:
+        values = np.round(values, precision)
+    return pa.array(values).cast(pa.string())
+
+
+def _value_strings(values, name, precision, compat, infSentinel, nanSentinel,
+                   list_values):
+    """Formats the values of a column, applying the sentinels."""
+    if values.dtype.kind != "f":
+        return pa.array(values).cast(pa.string())
+    strs = _float_strings(values, precision, compat, list_values)
+    if not compat or name in INF_PARAMS:
+        isinf = np.isinf(values)
+        if isinf.any():
+            strs = pc.if_else(pa.array(isinf & (values > 0)), infSentinel, strs)
+            strs = pc.if_else(pa.array(isinf & (values < 0)),
+                              "-" + infSentinel, strs)
+    if not compat:
+        isnan = np.isnan(values)
+        if isnan.any():
+            strs = pc.if_else(pa.array(isnan), nanSentinel, strs)
+    return strs
+
+
+def _join_lists(strs, offsets, sep=", "):
+    """"[a, b, ...]" strings of the lists given by offsets."""
+    lists = pa.ListArray.from_arrays(pa.array(offsets.astype(np.int32)), strs)
+    return pc.binary_join_element_wise("[", pc.binary_join(lists, sep), "]",
+                                       "")
+
+
+def _list_strings(values, offsets, shape, name, precision, compat,
+                  infSentinel, nanSentinel):
+    """Formats an array parameter as python lists, one string per record."""
+    strs = _value_strings(values, name, precision, compat, infSentinel,
+                          nanSentinel, True)
+    if shape:
+        # e.g. ltab: group the flattened values into inner lists
+        width = int(np.prod(shape))
+        strs = _join_lists(strs, np.arange(0, len(values) + 1, width))
+        offsets = offsets // width
+    return _join_lists(strs, offsets)
+
+
+def _constant(nrec, value):
+    """A string column holding the same value for every record."""
+    return pa.array(np.full(nrec, value, dtype=object), type=pa.string())
+
+
+def format_columns(colBatch, fileType="fitacf", floatPrecision=None,
+                   infSentinel="999999", nanSentinel="nan", missing="None",
+                   compat=True):
+    """Formats a ColumnBatch as csv column strings.
+
+    Parameters
+    ----------
+    colBatch : dmap_columns.ColumnBatch
+        Records to format.
+    fileType : str
+        SuperDARN fit data type (e.g., fitacf)
+    floatPrecision : Optional[int]
+        Decimals floats are rounded to (ignored if compat).
+    infSentinel : str
+        Written for +inf (and "-"+infSentinel for -inf); in compat
+        mode only for INF_PARAMS, as the record writer did.
+    nanSentinel : str
+        Written for NaN (compat mode keeps "nan").
+    missing : str
+        Written for scalars missing from a record.
+    compat : bool
+        Produce exactly the output of the record by record writer,
+        with Python's float formatting (floats are written with the
+        shortest digits of float64 instead of those of their own dtype).
+
+    Returns
+    -------
+    list
+        One pyarrow string array (one string per record) per CSV_COLUMNS.
+
+    """
+    nrec = colBatch.nrec
+    columns = []
+    for col, name, kind in CSV_COLUMNS:
+        if kind == "time":
+            usec = np.round(colBatch.scalars["time"] * 1e6).astype(np.int64)
+            strs = pa.array(usec, type=pa.timestamp("us")).cast(pa.string())
+            # drop the fraction of seconds
+            strs = pc.utf8_slice_codeunits(strs, 0, 19)
+        elif kind == "channel":
+            letters = np.full(nrec, "a", dtype=object)
+            if "channel" in colBatch.scalars:
+                chan = colBatch.scalars["channel"]
+                for num, letter in CHANNEL_LETTERS.items():
+                    letters[chan == num] = letter
+                other = (chan > 4) & (chan != fill_value(chan.dtype))
+                letters[other] = [str(x) for x in chan[other].tolist()]
+            strs = pa.array(letters, type=pa.string())
+        elif kind == "ftype":
+            strs = _constant(nrec, str(fileType))
+        elif kind == "flag":
+            strs = _constant(nrec, "1" if fileType == name else missing)
+        elif kind == "scalar":
+            if name not in colBatch.scalars:
+                strs = _constant(nrec, missing)
+            else:
+                vals = colBatch.scalars[name]
+                strs = _value_strings(vals, name, floatPrecision, compat,
+                                      infSentinel, nanSentinel, False)
+                if vals.dtype.kind == "f" and compat:
+                    absent = np.isnan(vals)
+                elif vals.dtype.kind == "i":
+                    absent = vals == fill_value(vals.dtype)
+                else:
+                    absent = None
+                if absent is not None and absent.any():
+                    strs = pc.if_else(pa.array(absent), missing, strs)
+        else:
+            if name not in colBatch.arrays:
+                strs = _constant(nrec, "[]")
+            else:
+                values, offsets = colBatch.arrays[name]
+                strs = _list_strings(values, offsets,
+                                     colBatch.shapes.get(name), name,
+                                     floatPrecision, compat, infSentinel,
+                                     nanSentinel)
+        columns.append(strs)
+    return columns
+
+
+def format_lines(columns, sep="|"):
+    """Joins csv column strings (see format_columns) into the bytes of
+    the csv lines, each ending with a newline."""
+    lines = pc.binary_join_element_wise(*(list(columns) + [sep]))
+    lines = pc.binary_join_element_wise(lines, "\n", "")
+    offsets = np.frombuffer(lines.buffers()[1], dtype=np.int32,
+                            count=len(lines) + 1, offset=lines.offset * 4)
+    data = lines.buffers()[2]
+    return data.to_pybytes()[offsets[0]:offsets[-1]]
+
+
+def write_csv(source, fname_csv, stime=None, etime=None, sep="|",
+              fileType="fitacf", batchSize=10000, **kwargs):
+    """Writes the records of a dmap file to a csv file, a block of
+    batchSize records at a time.
+
+    Parameters
+    ----------
+    source : str, VirtualDay or file-like
+        See dmap_reader.read_dmap_records.
+    fname_csv : str
+        Output file name.
+    stime, etime : Optional[datetime.datetime]
+        Time range of interest.
+    sep : str
+        Delimiter to use
+    fileType : str
+        SuperDARN fit data type (e.g., fitacf)
+    **kwargs
+        See format_columns.
+
+    Returns
+    -------
+    int
+        Number of records written.
+
+    """
+    nrec = 0
+    with open(fname_csv, "wb") as f:
+        f.write((sep.join(CSV_HEADER) + "\n").encode("utf-8"))
+        for colBatch in read_dmap_columns(source, batch_size=batchSize,
+                                          stime=stime, etime=etime):
+            columns = format_columns(colBatch, fileType=fileType, **kwargs)
+            f.write(format_lines(columns, sep))
+            nrec += colBatch.nrec
+    return nrec
@@ -0,0 +1,261 @@
+"""
+Hive-style partitioned layout of the converted files, and the manifest
+describing it.
+
+Day files are stored under rootDir/radar=<rad>/year=<YYYY>/month=<MM>/
+with the names CreateFiles gives them (YYYYMMDDrad.parquet,
+YYYYMMDD.rad.hdf5). rootDir/_manifest.json lists every partition with
+its record count, time bounds, size and schema version, and the same
+for each of its files, so readers and the batch driver can select
+files without listing directories or opening files.
+"""
+
+import datetime as dt
+import json
+import os
+import re
+import fitacf_schema
+from dmap_reader import datetime_to_epoch
+
+MANIFEST_NAME = "_manifest.json"
+
+PARTITION_DIR = re.compile(r"^radar=([a-z0-9]+)/year=(\d{4})/month=(\d{2})$")
+DAY_FILE = re.compile(r"^(\d{8})\.?([a-z0-9]+)\.(parquet|hdf5)$")
+
+
+def partition_name(rad, day):
+    """Relative path of the partition of a radar and day."""
+    return "radar={:s}/year={:04d}/month={:02d}".format(rad, day.year,
+                                                        day.month)
+
+
+def partition_dir(rootDir, rad, day):
+    """Full path of the partition of a radar and day, ending with "/"."""
+    return os.path.join(rootDir, partition_name(rad, day)) + "/"
+
+
+def _month_bounds(year, month):
+    """First instant of a month and of the next one."""
+    start = dt.datetime(year, month, 1)
+    if month == 12:
+        return start, dt.datetime(year + 1, 1, 1)
+    return start, dt.datetime(year, month + 1, 1)
+
+
+def file_stats(path):
+    """Record count and (start, end) epoch times of a day file."""
+    if path.endswith(".parquet"):
+        import parquet_reader
+        import pyarrow.parquet as pq
+        metadata = pq.ParquetFile(path).metadata
+        bounds = [b for b in parquet_reader.row_group_bounds(metadata, "time")
+                  if b is not None]
+        if not bounds:
+            return metadata.num_rows, None, None
+        return (metadata.num_rows, min(b[0] for b in bounds),
+                max(b[1] for b in bounds))
+    import hdf5_reader
+    import h5py
+    f = h5py.File(path, "r")
+    try:
+        if hdf5_reader.INDEX_GROUP in f:
+            usec = f[hdf5_reader.INDEX_GROUP]["time"][:]
+        else:
+            usec = hdf5_reader.read_scalar_column(f, "time") * 1e6
+        if len(usec) == 0:
+            return 0, None, None
+        return len(usec), usec.min() * 1e-6, usec.max() * 1e-6
+    finally:
+        f.close()
+
+
+class Manifest(object):
+    """
+    The manifest of a partitioned dataset directory.
+    """
+
+    def __init__(self, rootDir):
+        """
+        Parameters
+        ----------
+        rootDir : str
+            Root directory of the dataset; the manifest is read from
+            rootDir/_manifest.json if it exists.
+        """
+        self.rootDir = rootDir
+        self.path = os.path.join(rootDir, MANIFEST_NAME)
+        self.partitions = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.partitions = json.load(f)["partitions"]
+
+    def save(self):
+        """Write the manifest (atomically, through a temporary file)."""
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump({"schema_version": fitacf_schema.SCHEMA_VERSION,
+                       "partitions": self.partitions}, f, sort_keys=True,
+                      separators=(",", ":"))
+        os.rename(tmpPath, self.path)
+
+    def _split(self, path):
+        """(partition name, file name) of a file of the dataset."""
+        relPath = os.path.relpath(path, self.rootDir).replace(os.sep, "/")
+        if "/" not in relPath:
+            return "", relPath
+        return tuple(relPath.rsplit("/", 1))
+
+    def has_file(self, path):
+        """True if a day file is in the manifest."""
+        partName, fileName = self._split(path)
+        part = self.partitions.get(partName)
+        return part is not None and fileName in part["files"]
+
+    def add_file(self, path):
+        """Add (or update) a day file of the dataset."""
+        partName, fileName = self._split(path)
+        match = DAY_FILE.match(fileName)
+        if PARTITION_DIR.match(partName) is None or match is None:
+            raise ValueError("not a partitioned day file: " + path)
+        nrec, stime, etime = file_stats(path)
+        part = self.partitions.setdefault(partName, {"files": {}})
+        part["files"][fileName] = {
+            "date": match.group(1), "radar": match.group(2),
+            "format": match.group(3), "nrec": int(nrec),
+            "stime": stime, "etime": etime,
+            "nbytes": os.path.getsize(path),
+            "schema_version": fitacf_schema.SCHEMA_VERSION}
+        self._update_partition(partName)
+
+    def remove_file(self, path):
+        """Drop a day file from the manifest."""
+        partName, fileName = self._split(path)
+        part = self.partitions.get(partName)
+        if part is not None and part["files"].pop(fileName, None) is not None:
+            if part["files"]:
+                self._update_partition(partName)
+            else:
+                del self.partitions[partName]
+
+    def _update_partition(self, partName):
+        """Recompute the totals of a partition from its files."""
+        part = self.partitions[partName]
+        files = list(part["files"].values())
+        stimes = [f["stime"] for f in files if f["stime"] is not None]
+        etimes = [f["etime"] for f in files if f["etime"] is not None]
+        radar, year, month = PARTITION_DIR.match(partName).groups()
+        part.update({"radar": radar, "year": int(year), "month": int(month),
+                     "nrec": sum(f["nrec"] for f in files),
+                     "nbytes": sum(f["nbytes"] for f in files),
+                     "stime": min(stimes) if stimes else None,
+                     "etime": max(etimes) if etimes else None,
+                     "schema_version": min(f["schema_version"]
+                                           for f in files)})
+
+    def select_files(self, stime=None, etime=None, radars=None,
+                     fileFormat=None):
+        """
+        Day files that may hold data of radars in [stime, etime],
+        pruning partitions and files on their time bounds.
+
+        Returns
+        -------
+        list
+            (radar, day, full path) tuples sorted by day and radar.
+
+        """
+        sEpoch = None if stime is None else datetime_to_epoch(stime)
+        eEpoch = None if etime is None else datetime_to_epoch(etime)
+        selected = []
+        for partName, part in self.partitions.items():
+            if radars is not None and part["radar"] not in radars:
+                continue
+            if not _overlaps(part, sEpoch, eEpoch):
+                continue
+            for fileName, info in part["files"].items():
+                if fileFormat is not None and info["format"] != fileFormat:
+                    continue
+                if not _overlaps(info, sEpoch, eEpoch):
+                    continue
+                day = dt.datetime.strptime(info["date"], "%Y%m%d")
+                selected.append((day, info["radar"], os.path.join(
+                    self.rootDir, partName, fileName)))
+        return [(rad, day, path) for day, rad, path in sorted(selected)]
+
+
+def _overlaps(info, sEpoch, eEpoch):
+    """True if the time bounds of a manifest entry may overlap
+    [sEpoch, eEpoch]; entries without records never do."""
+    if info["stime"] is None:
+        return False
+    if sEpoch is not None and info["etime"] < sEpoch:
+        return False
+    if eEpoch is not None and info["stime"] > eEpoch:
+        return False
+    return True
+
+
+def walk_partitions(rootDir, stime=None, etime=None, radars=None,
+                    fileFormat=None):
+    """
+    Day files of a partitioned dataset without a manifest, only
+    listing the partition directories that can match.
+    Returns (radar, day, full path) tuples sorted by day and radar.
+    """
+    selected = []
+    for radDir in os.listdir(rootDir):
+        if not radDir.startswith("radar="):
+            continue
+        rad = radDir[len("radar="):]
+        if radars is not None and rad not in radars:
+            continue
+        for yearDir in os.listdir(os.path.join(rootDir, radDir)):
+            for monthDir in os.listdir(os.path.join(rootDir, radDir,
+                                                    yearDir)):
+                partName = "/".join([radDir, yearDir, monthDir])
+                match = PARTITION_DIR.match(partName)
+                if match is None:
+                    continue
+                mStart, mEnd = _month_bounds(int(match.group(2)),
+                                             int(match.group(3)))
+                if (etime is not None and mStart > etime) or \
+                        (stime is not None and mEnd <= stime):
+                    continue
+                partDir = os.path.join(rootDir, partName)
+                for fileName in os.listdir(partDir):
+                    fMatch = DAY_FILE.match(fileName)
+                    if fMatch is None or fMatch.group(2) != rad:
+                        continue
+                    if fileFormat is not None and \
+                            fMatch.group(3) != fileFormat:
+                        continue
+                    day = dt.datetime.strptime(fMatch.group(1), "%Y%m%d")
+                    if (etime is not None and day > etime) or \
+                            (stime is not None and
+                             day + dt.timedelta(days=1) <= stime):
+                        continue
+                    selected.append((day, rad,
+                                     os.path.join(partDir, fileName)))
+    return [(rad, day, path) for day, rad, path in sorted(selected)]
+
+
+def select_files(rootDir, stime=None, etime=None, radars=None,
+                 fileFormat=None):
+    """
+    Day files of a partitioned dataset in [stime, etime] for radars,
+    from the manifest if there is one, otherwise by walking the
+    partition directories.
+    """
+    if radars is not None:
+        radars = set(radars)
+    if os.path.exists(os.path.join(rootDir, MANIFEST_NAME)):
+        return Manifest(rootDir).select_files(stime, etime, radars,
+                                              fileFormat)
+    return walk_partitions(rootDir, stime, etime, radars, fileFormat)
+
+
+def is_partitioned(rootDir):
+    """True if rootDir holds a partitioned dataset."""
+    if os.path.exists(os.path.join(rootDir, MANIFEST_NAME)):
+        return True
+    return any(name.startswith("radar=") for name in os.listdir(rootDir))
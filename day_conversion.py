@@ -0,0 +1,121 @@
+"""
+Conversion of one radar-day of fitacf data to a csv, hdf5 or Parquet
+file with the native readers and writers: the day is located with
+dmap_to_csv.fetch_concat (read in place as a VirtualDay unless median
+filtered), decoded with dmap_reader and streamed to the writer, so
+neither davitpy nor a copy of the raw files is needed. Used by the
+batch driver (batch_convert) and the conversion jobs of the web
+service.
+"""
+
+import datetime as dt
+import os
+import shutil
+
+import dmap_reader
+import dmap_to_csv
+from generate_hdf5_files import HDF5Converter
+from generate_parquet_files import ParquetConverter
+
+FILE_FORMATS = ["csv", "hdf5", "parquet"]
+
+# Default location of the raw files (see dmap_to_csv.fetch_concat)
+RAW_DIR_FORMAT = "/sd-data/{year}/{ftype}/{radar}/"
+RAW_FILE_FORMATS = ['{date}.{hour}......{radar}.{channel}.{ftype}',
+                    '{date}.{hour}......{radar}.{ftype}']
+
+
+def output_name(rad, day, fileFormat):
+    """File name of the output of a radar-day, named as CreateFiles
+    of cmpr_file_formats names them."""
+    date = day.strftime("%Y%m%d")
+    if fileFormat == "parquet":
+        return date + rad + ".parquet"
+    return date + "." + rad + "." + fileFormat
+
+
+def convert_day(rad, day, fileFormat, outFile, tmpDir,
+                localdirfmt=RAW_DIR_FORMAT, fnamefmt=RAW_FILE_FORMATS,
+                medianFilter=False, pathToFilter="./fitexfilter",
+                catalog=None, cache=None):
+    """
+    Convert a day of fitacf data of a radar to outFile.
+
+    Parameters
+    ----------
+    rad : str
+        Three-letter radar code.
+    day : datetime.datetime
+        Day to convert.
+    fileFormat : str
+        "csv", "hdf5" or "parquet".
+    outFile : str
+        Output file; it is written under another name next to it and
+        renamed once complete, so it never exists half written.
+    tmpDir : str
+        Directory of the files made by fetch_concat (only when median
+        filtering).
+    localdirfmt, fnamefmt :
+        Location of the raw files, see dmap_to_csv.fetch_concat.
+    medianFilter : bool
+        Boxcar median filter the data first, see fetch_concat.
+    pathToFilter : str
+        fitexfilter binary used if the native filter fails, see
+        fetch_concat.
+    catalog : Optional[file_catalog.FileCatalog]
+        Catalog locating the raw files, see fetch_concat.
+    cache : Optional[conversion_cache.ConversionCache]
+        Cache of the filtered files, see fetch_concat.
+
+    Returns
+    -------
+    int or None
+        Number of records written (None for csv, which doesn't count
+        them), 0 if there were no data, in which case no file is
+        written.
+    """
+    if fileFormat not in FILE_FORMATS:
+        raise ValueError("unknown file format " + str(fileFormat))
+    stime = dt.datetime(day.year, day.month, day.day)
+    etime = stime + dt.timedelta(days=1)
+    localdict = {"ftype": "fitacf", "radar": rad, "channel": "."}
+    fname = dmap_to_csv.fetch_concat(stime, localdirfmt, localdict, tmpDir,
+                                     fnamefmt, median_filter=medianFilter,
+                                     path_to_filter=pathToFilter,
+                                     catalog=catalog, virtual=True,
+                                     cache=cache)
+    if fname is None:
+        return 0
+
+    outDir = os.path.dirname(outFile)
+    if outDir and not os.path.exists(outDir):
+        try:
+            os.makedirs(outDir)
+        except OSError:
+            # created by another process meanwhile
+            pass
+    tmpFile = outFile + ".part"
+    nrec = None
+    try:
+        if fileFormat == "csv":
+            shutil.move(dmap_to_csv.dmap_to_csv(fname, stime, etime),
+                        tmpFile)
+        elif fileFormat == "hdf5":
+            converter = HDF5Converter(stime, etime, rad)
+            # the layout create_hdf5_file (CreateFiles) writes, so a
+            # radar-day gives the same file whatever converts it
+            nrec = converter.create_hdf5_file_stream(
+                dmap_reader.read_dmap_records(fname, stime, etime), tmpFile,
+                layout="vlen")
+        else:
+            converter = ParquetConverter(stime, etime, rad)
+            nrec = converter.create_parquet_file_stream(
+                converter.iter_record_batches(
+                    dmap_reader.read_dmap_records(fname, stime, etime)),
+                tmpFile)
+        if nrec != 0:
+            os.rename(tmpFile, outFile)
+    finally:
+        if os.path.exists(tmpFile):
+            os.remove(tmpFile)
+    return nrec
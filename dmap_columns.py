@@ -0,0 +1,522 @@
+"""
+Columnar (struct-of-arrays) decoding of fitacf records.
+
+A block of dmap records is turned into one contiguous NumPy array per
+scalar parameter, and a flat values array plus an int64 offsets array
+per range-gate parameter, so that the HDF5, Parquet and csv writers can
+work on whole columns instead of looping over records.
+"""
+
+import struct
+import numpy as np
+from dmap_reader import (read_dmap_bodies, datetime_to_epoch, DMAP_DTYPES,
+                         DATACHAR, DATASTRING, TIME_FIELDS)
+from fitacf_schema import SCALAR_NAMES, ARRAY_NAMES, VOID_NAMES, COLUMN_DTYPES
+
+_COUNTS = struct.Struct("<ii")
+_TYPE = struct.Struct("<B")
+_TYPE_NDIM = struct.Struct("<Bi")
+_INT32 = struct.Struct("<i")
+# DMAP type code -> size in bytes of one value
+_SIZES = dict((code, dtype.itemsize) for code, dtype in DMAP_DTYPES.items())
+
+
+def fill_value(dtype):
+    """Value used for a scalar that is missing from a record:
+    NaN for floats, the most negative value for signed integers,
+    zero for unsigned integers and an empty string/bytes otherwise."""
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return np.nan
+    if dtype.kind == "i":
+        return np.iinfo(dtype).min
+    if dtype.kind == "u":
+        return 0
+    if dtype.kind == "V":
+        return b"\0" * dtype.itemsize
+    return ""
+
+
+class ColumnBatch(object):
+    """
+    A block of fitacf records stored column by column.
+
+    Attributes
+    ----------
+    nrec : int
+        Number of records.
+    scalars : dict
+        name -> 1-D numpy array of length nrec.
+    arrays : dict
+        name -> (values, offsets); the values of record i are
+        values[offsets[i]:offsets[i+1]] and offsets has length nrec+1.
+    shapes : dict
+        name -> trailing shape of multi-dimensional array parameters
+        (e.g. (2,) for ltab), whose values are stored flattened.
+    """
+
+    def __init__(self, nrec, scalars=None, arrays=None, shapes=None):
+        self.nrec = nrec
+        self.scalars = {} if scalars is None else scalars
+        self.arrays = {} if arrays is None else arrays
+        self.shapes = {} if shapes is None else shapes
+
+    def __len__(self):
+        return self.nrec
+
+    def column_names(self):
+        """Sorted names of all the columns in the batch."""
+        return sorted(list(self.scalars.keys()) + list(self.arrays.keys()))
+
+    def lengths(self, name):
+        """Number of values of an array parameter in each record."""
+        return np.diff(self.arrays[name][1])
+
+    def row_array(self, name, i):
+        """Values of array parameter name for record i."""
+        values, offsets = self.arrays[name]
+        arr = values[offsets[i]:offsets[i + 1]]
+        if name in self.shapes:
+            arr = arr.reshape((-1,) + tuple(self.shapes[name]))
+        return arr
+
+    def take(self, index):
+        """Returns a new ColumnBatch with the records given by index
+        (an integer array or a boolean mask)."""
+        index = np.arange(self.nrec)[index]
+        scalars = dict((name, col[index])
+                       for name, col in self.scalars.items())
+        arrays = {}
+        for name, (values, offsets) in self.arrays.items():
+            lens = offsets[index + 1] - offsets[index]
+            new_offsets = np.zeros(len(index) + 1, dtype=np.int64)
+            np.cumsum(lens, out=new_offsets[1:])
+            # positions of the selected values in the flat array
+            pos = np.repeat(offsets[index] - new_offsets[:-1], lens) +\
+                  np.arange(new_offsets[-1])
+            arrays[name] = (values[pos], new_offsets)
+        return ColumnBatch(len(index), scalars, arrays, dict(self.shapes))
+
+    @classmethod
+    def concat(cls, batches):
+        """Concatenates a list of ColumnBatch objects into one."""
+        batches = [b for b in batches if b.nrec > 0]
+        if len(batches) == 0:
+            return cls(0)
+        if len(batches) == 1:
+            return batches[0]
+        nrec = sum(b.nrec for b in batches)
+        scalars = {}
+        arrays = {}
+        shapes = {}
+        names = set()
+        for b in batches:
+            names.update(b.scalars.keys())
+        for name in names:
+            dtype = [b.scalars[name].dtype for b in batches
+                     if name in b.scalars][0]
+            scalars[name] = np.concatenate(
+                [b.scalars[name] if name in b.scalars else
+                 np.full(b.nrec, fill_value(dtype), dtype=dtype)
+                 for b in batches])
+        names = set()
+        for b in batches:
+            names.update(b.arrays.keys())
+            shapes.update(b.shapes)
+        for name in names:
+            dtype = [b.arrays[name][0].dtype for b in batches
+                     if name in b.arrays][0]
+            values = []
+            lens = []
+            for b in batches:
+                if name in b.arrays:
+                    values.append(b.arrays[name][0])
+                    lens.append(np.diff(b.arrays[name][1]))
+                else:
+                    lens.append(np.zeros(b.nrec, dtype=np.int64))
+            offsets = np.zeros(nrec + 1, dtype=np.int64)
+            np.cumsum(np.concatenate(lens), out=offsets[1:])
+            arrays[name] = (np.concatenate(values).astype(dtype, copy=False),
+                            offsets)
+        return cls(nrec, scalars, arrays, shapes)
+
+
+def records_to_columns(records, scalar_names=None, array_names=None):
+    """Decodes a list of dmap records (dicts) into a ColumnBatch.
+
+    Parameters
+    ----------
+    records : list of dict
+        Records as returned by dmap_reader.read_dmap_records
+        (or davitpy's recordDict).
+    scalar_names : Optional[list]
+        Scalar parameters to keep. Defaults to SCALAR_NAMES + VOID_NAMES.
+    array_names : Optional[list]
+        Array parameters to keep. Defaults to ARRAY_NAMES.
+
+    Returns
+    -------
+    ColumnBatch
+        Only parameters present in at least one record are included.
+
+    """
+    if scalar_names is None:
+        scalar_names = SCALAR_NAMES + VOID_NAMES
+    if array_names is None:
+        array_names = ARRAY_NAMES
+    nrec = len(records)
+
+    # parameters present in the records
+    present = set()
+    for rec in records:
+        present.update(rec.keys())
+
+    scalars = {}
+    for name in scalar_names:
+        if name not in present:
+            continue
+        dtype = COLUMN_DTYPES.get(name)
+        col = [rec.get(name) for rec in records]
+        if dtype is None:
+            dtype = np.asarray([x for x in col if x is not None][0]).dtype
+        fill = fill_value(dtype)
+        scalars[name] = np.array([fill if x is None else x for x in col],
+                                 dtype=dtype)
+
+    arrays = {}
+    shapes = {}
+    for name in array_names:
+        if name not in present:
+            continue
+        dtype = COLUMN_DTYPES.get(name)
+        lens = np.zeros(nrec, dtype=np.int64)
+        values = []
+        for i, rec in enumerate(records):
+            arr = rec.get(name)
+            if arr is None:
+                continue
+            arr = np.asarray(arr)
+            if arr.ndim > 1:
+                shapes[name] = arr.shape[1:]
+            arr = arr.ravel()
+            lens[i] = arr.size
+            values.append(arr)
+        if dtype is None:
+            dtype = values[0].dtype if values else np.dtype("float32")
+        offsets = np.zeros(nrec + 1, dtype=np.int64)
+        np.cumsum(lens, out=offsets[1:])
+        if values:
+            values = np.concatenate(values).astype(dtype, copy=False)
+        else:
+            values = np.zeros(0, dtype=dtype)
+        arrays[name] = (values, offsets)
+
+    return ColumnBatch(nrec, scalars, arrays, shapes)
+
+
+def columns_to_records(colBatch):
+    """Yields the records of a ColumnBatch as dicts, the inverse of
+    records_to_columns: scalars as numpy scalars (strings as str, void
+    fields as length-1 bytes) and arrays as numpy arrays. Arrays with
+    no values in a record are left out of it."""
+    for i in range(colBatch.nrec):
+        rec = {}
+        for name, col in colBatch.scalars.items():
+            value = col[i]
+            if col.dtype.kind == "V":
+                value = value.tobytes()
+            rec[name] = value
+        for name, (values, offsets) in colBatch.arrays.items():
+            if offsets[i + 1] > offsets[i]:
+                rec[name] = colBatch.row_array(name, i)
+        yield rec
+
+
+def _index_records(buf, starts):
+    """Walks the entries of the dmap records in buf, whose bodies start
+    at the positions starts, and returns where the value(s) of every
+    parameter are, without decoding them.
+
+    Returns
+    -------
+    scalars : dict
+        name (bytes) -> (codes, positions): lists with the DMAP type code
+        and the position in buf of the value in each record (0 and -1
+        where the record lacks the parameter).
+    strings : dict
+        name (bytes) -> list of the raw value of a DATASTRING scalar in
+        each record (None where missing).
+    arrays : dict
+        name (bytes) -> [codes, positions, counts, dims]: type code,
+        position of the first value and number of values in each
+        record, and the dimensions of the last record.
+    """
+    nrec = len(starts)
+    scalars = {}
+    strings = {}
+    arrays = {}
+    for i, pos in enumerate(starts):
+        snum, anum = _COUNTS.unpack_from(buf, pos)
+        pos += _COUNTS.size
+        for _ in range(snum):
+            end = buf.index(b"\0", pos)
+            name = buf[pos:end]
+            code = _TYPE.unpack_from(buf, end + 1)[0]
+            pos = end + 2
+            if code == DATASTRING:
+                end = buf.index(b"\0", pos)
+                col = strings.get(name)
+                if col is None:
+                    col = strings[name] = [None] * nrec
+                col[i] = buf[pos:end]
+                pos = end + 1
+                continue
+            col = scalars.get(name)
+            if col is None:
+                col = scalars[name] = ([0] * nrec, [-1] * nrec)
+            col[0][i] = code
+            col[1][i] = pos
+            pos += _SIZES[code]
+        for _ in range(anum):
+            end = buf.index(b"\0", pos)
+            name = buf[pos:end]
+            code, ndim = _TYPE_NDIM.unpack_from(buf, end + 1)
+            pos = end + 1 + _TYPE_NDIM.size
+            if ndim == 1:
+                dims = _INT32.unpack_from(buf, pos)
+                count = dims[0]
+            else:
+                dims = struct.unpack_from("<%di" % ndim, buf, pos)
+                count = int(np.prod(dims)) if ndim > 0 else 0
+            pos += _INT32.size * ndim
+            if code == DATASTRING:
+                # arrays of strings are not fitacf parameters: skip them
+                for _ in range(count):
+                    pos = buf.index(b"\0", pos) + 1
+                continue
+            col = arrays.get(name)
+            if col is None:
+                col = arrays[name] = [[0] * nrec, [0] * nrec, [0] * nrec,
+                                      dims]
+            col[0][i] = code
+            col[1][i] = pos
+            col[2][i] = count
+            col[3] = dims
+            pos += _SIZES[code] * count
+    return scalars, strings, arrays
+
+
+def _gather(buf, code, positions, counts):
+    """Concatenates the values of type code found at the byte positions
+    of buf (counts values at each), as one array of the DMAP dtype."""
+    dtype = DMAP_DTYPES[code]
+    size = dtype.itemsize
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    out = np.empty(offsets[-1], dtype=dtype)
+    if offsets[-1] == 0:
+        return out
+    # values need not be aligned in buf: read each group of positions
+    # with the same misalignment through its own view of buf
+    shifts = positions % size
+    for shift in np.unique(shifts[counts > 0]):
+        sel = np.nonzero((shifts == shift) & (counts > 0))[0]
+        view = np.frombuffer(buf, dtype, (len(buf) - shift) // size, shift)
+        lens = counts[sel]
+        starts = np.zeros(len(sel), dtype=np.int64)
+        np.cumsum(lens[:-1], out=starts[1:])
+        local = np.arange(starts[-1] + lens[-1]) - np.repeat(starts, lens)
+        src = np.repeat((positions[sel] - shift) // size, lens) + local
+        if len(sel) == len(counts):
+            out[:] = view[src]
+        else:
+            out[np.repeat(offsets[sel], lens) + local] = view[src]
+    return out
+
+
+def _cast(values, dtype):
+    """values (as read from the file) as dtype."""
+    if dtype.kind == "V":
+        return values.view(dtype)
+    return values.astype(dtype, copy=False)
+
+
+def _scalar_column(buf, codes, positions, dtype):
+    """Column of a numeric scalar parameter, with the fill value of
+    dtype where it is missing."""
+    codes = np.array(codes)
+    positions = np.array(positions, dtype=np.int64)
+    present = positions >= 0
+    if dtype is None:
+        dtype = DMAP_DTYPES[codes[present][0]]
+        if codes[present][0] == DATACHAR:
+            dtype = np.dtype("V1")
+    col = np.full(len(positions), fill_value(dtype), dtype=dtype)
+    for code in np.unique(codes[present]):
+        sel = codes == code
+        col[sel] = _cast(_gather(buf, code, positions[sel],
+                                 np.ones(sel.sum(), dtype=np.int64)), dtype)
+    return col
+
+
+def _epoch_seconds(parts):
+    """Seconds since the epoch from the time.* columns (see
+    dmap_reader.TIME_FIELDS), as dmap_reader._collapse_time."""
+    yr, mo, dy, hr, mt, sc, us = [part.astype(np.int64) for part in parts]
+    months = (yr - 1970) * 12 + mo - 1
+    days = (np.datetime64("1970-01", "M") + months.astype("timedelta64[M]"))
+    days = days.astype("datetime64[D]").astype(np.int64) + dy - 1
+    seconds = days * 86400 + hr * 3600 + mt * 60 + sc
+    return seconds.astype(np.float64) + us * 1e-6
+
+
+def bodies_to_columns(bodies, scalar_names=None, array_names=None):
+    """Decodes the bodies of dmap records (see dmap_reader.parse_record)
+    straight into a ColumnBatch, without building a dict per record.
+
+    Parameters
+    ----------
+    bodies : list of bytes
+        Record bodies, as yielded by dmap_reader.read_dmap_bodies.
+    scalar_names, array_names : Optional[list]
+        See records_to_columns.
+
+    Returns
+    -------
+    ColumnBatch
+        The same as records_to_columns for the parsed records.
+
+    """
+    if scalar_names is None:
+        scalar_names = SCALAR_NAMES + VOID_NAMES
+    if array_names is None:
+        array_names = ARRAY_NAMES
+    nrec = len(bodies)
+    buf = b"".join(bodies)
+    starts = np.zeros(nrec, dtype=np.int64)
+    np.cumsum([len(body) for body in bodies[:-1]], out=starts[1:])
+    found, strings, found_arrays = _index_records(buf, starts.tolist())
+    found = dict((name.decode("latin-1"), col)
+                 for name, col in found.items())
+    strings = dict((name.decode("latin-1"), col)
+                   for name, col in strings.items())
+    found_arrays = dict((name.decode("latin-1"), col)
+                        for name, col in found_arrays.items())
+
+    scalars = {}
+    if "time.yr" in found and "time" in scalar_names:
+        present = np.array(found["time.yr"][1]) >= 0
+        parts = [_scalar_column(buf, found[key][0], found[key][1],
+                                np.dtype(np.int64)) if key in found
+                 else np.zeros(nrec, dtype=np.int64) for key in TIME_FIELDS]
+        parts = [np.where(part == fill_value(np.int64), 0, part)
+                 for part in parts]
+        dtype = COLUMN_DTYPES.get("time", np.dtype(np.float64))
+        scalars["time"] = np.where(present, _epoch_seconds(parts),
+                                   fill_value(dtype)).astype(dtype)
+    for name in scalar_names:
+        dtype = COLUMN_DTYPES.get(name)
+        if name in found and name not in TIME_FIELDS:
+            scalars[name] = _scalar_column(buf, found[name][0],
+                                           found[name][1], dtype)
+        elif name in strings:
+            dtype = object if dtype is None else dtype
+            fill = fill_value(dtype)
+            scalars[name] = np.array(
+                [fill if x is None else x.decode("latin-1")
+                 for x in strings[name]], dtype=dtype)
+
+    arrays = {}
+    shapes = {}
+    for name in array_names:
+        if name not in found_arrays:
+            continue
+        codes, positions, counts, dims = found_arrays[name]
+        codes = np.array(codes)
+        positions = np.array(positions, dtype=np.int64)
+        counts = np.array(counts, dtype=np.int64)
+        if len(dims) > 1:
+            # DMAP stores the fastest-varying dimension first
+            shapes[name] = tuple(dims[::-1][1:])
+        dtype = COLUMN_DTYPES.get(name)
+        present = np.unique(codes[counts > 0])
+        if dtype is None:
+            dtype = DMAP_DTYPES[present[0]] if len(present) else \
+                np.dtype("float32")
+        if len(present) <= 1:
+            code = present[0] if len(present) else codes[codes > 0][0]
+            values = _cast(_gather(buf, code, positions, counts), dtype)
+        else:
+            # a parameter stored with different types in different records
+            values = np.concatenate(
+                [_cast(_gather(buf, codes[i], positions[i:i + 1],
+                               counts[i:i + 1]), dtype)
+                 for i in range(nrec)])
+        offsets = np.zeros(nrec + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        arrays[name] = (values, offsets)
+
+    return ColumnBatch(nrec, scalars, arrays, shapes)
+
+
+def read_dmap_columns(source, batch_size=10000, stime=None, etime=None,
+                      scalar_names=None, array_names=None):
+    """Yields the records of a dmap file as ColumnBatch objects of
+    at most batch_size records each, decoded straight from the record
+    bodies (see bodies_to_columns).
+
+    Parameters
+    ----------
+    source : str, list, VirtualDay or file-like
+        See dmap_reader.read_dmap_bodies.
+    batch_size : int
+        Maximum number of records per ColumnBatch.
+    stime, etime : Optional[datetime.datetime]
+        Time range of interest: records before stime are skipped and
+        reading stops at the first record after etime, as in
+        dmap_reader.read_dmap_records.
+    scalar_names, array_names : Optional[list]
+        See records_to_columns.
+
+    """
+    stime_epoch = None if stime is None else datetime_to_epoch(stime)
+    etime_epoch = None if etime is None else datetime_to_epoch(etime)
+    drop_time = False
+    if scalar_names is not None and "time" not in scalar_names and \
+            (stime is not None or etime is not None):
+        # the times are needed to select the records
+        scalar_names = list(scalar_names) + ["time"]
+        drop_time = True
+
+    bodies = read_dmap_bodies(source)
+    try:
+        done = False
+        while not done:
+            batch = []
+            for body in bodies:
+                batch.append(body)
+                if len(batch) >= batch_size:
+                    break
+            else:
+                done = True
+            if not batch:
+                return
+            colBatch = bodies_to_columns(batch, scalar_names, array_names)
+            times = colBatch.scalars.get("time")
+            if times is not None and etime_epoch is not None:
+                after = np.nonzero(times > etime_epoch)[0]
+                if len(after) > 0:
+                    colBatch = colBatch.take(slice(0, after[0]))
+                    times = colBatch.scalars["time"]
+                    done = True
+            if times is not None and stime_epoch is not None:
+                # records without a time (NaN) are kept
+                before = times < stime_epoch
+                if before.any():
+                    colBatch = colBatch.take(~before)
+            if drop_time:
+                colBatch.scalars.pop("time", None)
+            if colBatch.nrec > 0:
+                yield colBatch
+    finally:
+        bodies.close()
@@ -0,0 +1,252 @@
+"""
+Native reader for SuperDARN DMAP files (fitacf, fitex, lmfit, ...).
+
+Parses the binary block/scalar/array layout of each record straight into
+Python scalars and NumPy arrays, without going through davitpy's
+radDataPtr/beamData objects. Records are yielded one at a time (or in
+batches) so a whole day never has to be held in memory.
+"""
+
+import calendar
+import datetime as dt
+import logging
+import struct
+import numpy as np
+from dmap_streams import open_dmap_stream, ChainedStream
+
+# DMAP data type codes (see dmap.h in the RST)
+DATACHAR = 1
+DATASHORT = 2
+DATAINT = 3
+DATAFLOAT = 4
+DATADOUBLE = 8
+DATASTRING = 9
+DATALONG = 10
+DATAUCHAR = 16
+DATAUSHORT = 17
+DATAUINT = 18
+DATAULONG = 19
+
+# DMAP type code -> little-endian numpy dtype
+DMAP_DTYPES = {DATACHAR: np.dtype("<i1"),
+               DATASHORT: np.dtype("<i2"),
+               DATAINT: np.dtype("<i4"),
+               DATAFLOAT: np.dtype("<f4"),
+               DATADOUBLE: np.dtype("<f8"),
+               DATALONG: np.dtype("<i8"),
+               DATAUCHAR: np.dtype("<u1"),
+               DATAUSHORT: np.dtype("<u2"),
+               DATAUINT: np.dtype("<u4"),
+               DATAULONG: np.dtype("<u8")}
+
+# The DMAP code every record block starts with
+DMAP_CODE = 0x00010001
+
+# Time fields that are collapsed into a single "time" (epoch seconds) entry,
+# the same way davitpy's recordDict presents them
+TIME_FIELDS = ["time.yr", "time.mo", "time.dy", "time.hr",
+               "time.mt", "time.sc", "time.us"]
+
+# DMAP type code -> struct of a single scalar value
+_SCALAR_STRUCTS = {DATASHORT: struct.Struct("<h"),
+                   DATAINT: struct.Struct("<i"),
+                   DATAFLOAT: struct.Struct("<f"),
+                   DATADOUBLE: struct.Struct("<d"),
+                   DATALONG: struct.Struct("<q"),
+                   DATAUCHAR: struct.Struct("<B"),
+                   DATAUSHORT: struct.Struct("<H"),
+                   DATAUINT: struct.Struct("<I"),
+                   DATAULONG: struct.Struct("<Q")}
+
+_HEADER = struct.Struct("<ii")
+_COUNTS = struct.Struct("<ii")
+_INT32 = struct.Struct("<i")
+
+
+def _read_name(buf, pos):
+    """Reads a null-terminated string from buf starting at pos."""
+    end = buf.index(b"\0", pos)
+    return buf[pos:end].decode("latin-1"), end + 1
+
+
+def parse_record(buf):
+    """Parses the body of one DMAP record.
+
+    Parameters
+    ----------
+    buf : bytes
+        A DMAP record without its leading (code, size) header, i.e.,
+        starting at the scalar count.
+
+    Returns
+    -------
+    rec : dict
+        Scalars are returned as Python/NumPy scalars (strings as str,
+        DATACHAR scalars as length-1 bytes) and arrays as NumPy arrays.
+
+    """
+    snum, anum = _COUNTS.unpack_from(buf, 0)
+    pos = _COUNTS.size
+    rec = {}
+
+    # Scalars
+    for _ in range(snum):
+        name, pos = _read_name(buf, pos)
+        dtype = ord(buf[pos:pos + 1])
+        pos += 1
+        if dtype == DATASTRING:
+            rec[name], pos = _read_name(buf, pos)
+        elif dtype == DATACHAR:
+            rec[name] = buf[pos:pos + 1]
+            pos += 1
+        else:
+            fmt = _SCALAR_STRUCTS[dtype]
+            rec[name] = fmt.unpack_from(buf, pos)[0]
+            pos += fmt.size
+
+    # Arrays
+    for _ in range(anum):
+        name, pos = _read_name(buf, pos)
+        dtype = ord(buf[pos:pos + 1])
+        pos += 1
+        ndim = _INT32.unpack_from(buf, pos)[0]
+        pos += _INT32.size
+        dims = struct.unpack_from("<%di" % ndim, buf, pos)
+        pos += _INT32.size * ndim
+        count = int(np.prod(dims)) if ndim > 0 else 0
+        if dtype == DATASTRING:
+            vals = []
+            for _ in range(count):
+                val, pos = _read_name(buf, pos)
+                vals.append(val)
+            rec[name] = vals
+        else:
+            ndt = DMAP_DTYPES[dtype]
+            arr = np.frombuffer(buf, ndt, count, pos).copy()
+            pos += ndt.itemsize * count
+            # DMAP stores the fastest-varying dimension first
+            if ndim > 1:
+                arr = arr.reshape(dims[::-1])
+            rec[name] = arr
+
+    return rec
+
+
+def datetime_to_epoch(t):
+    """Converts a (naive, UT) datetime to seconds since the epoch."""
+    return calendar.timegm(t.utctimetuple()) + t.microsecond * 1e-6
+
+
+def record_datetime(rec):
+    """Returns the time of a record (as read by read_dmap_records)
+    as a datetime.datetime object."""
+    return dt.datetime(1970, 1, 1) + dt.timedelta(seconds=float(rec["time"]))
+
+
+def _collapse_time(rec):
+    """Replaces the time.* fields of a record by a single "time" entry
+    holding seconds since the epoch."""
+    if "time.yr" not in rec:
+        return rec
+    vals = [int(rec.pop(key, 0)) for key in TIME_FIELDS]
+    epoch = calendar.timegm((vals[0], vals[1], vals[2], vals[3],
+                             vals[4], vals[5], 0, 0, 0))
+    rec["time"] = epoch + vals[6] * 1e-6
+    return rec
+
+
+def read_dmap_bodies(source):
+    """Yields the bodies of the records of a DMAP file, i.e. each record
+    without its leading (code, size) header (see parse_record).
+
+    Parameters
+    ----------
+    source : str, list, VirtualDay or file-like
+        Full path of a dmap file (.bz2, .gz and .zip files are
+        decompressed on the fly), a list of such paths read one after
+        the other, a dmap_streams.VirtualDay, or an open binary
+        file-like object positioned at the start of a record.
+
+    """
+    fp = None
+    if isinstance(source, str):
+        fp = open_dmap_stream(source)
+    elif isinstance(source, (list, tuple)):
+        fp = ChainedStream(source)
+    elif hasattr(source, "open_stream"):
+        fp = source.open_stream()
+    if fp is not None:
+        try:
+            for body in read_dmap_bodies(fp):
+                yield body
+        finally:
+            fp.close()
+        return
+
+    while True:
+        header = source.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            if len(header) > 0:
+                logging.warning("truncated dmap record header, stop reading")
+            return
+        code, size = _HEADER.unpack(header)
+        if code != DMAP_CODE or size <= _HEADER.size:
+            logging.warning("invalid dmap record (code={:d}, size={:d}), "
+                            "stop reading".format(code, size))
+            return
+        body = source.read(size - _HEADER.size)
+        if len(body) < size - _HEADER.size:
+            logging.warning("truncated dmap record, stop reading")
+            return
+        yield body
+
+
+def read_dmap_records(source, stime=None, etime=None):
+    """Yields the records of a DMAP file one at a time.
+
+    Parameters
+    ----------
+    source : str, list, VirtualDay or file-like
+        See read_dmap_bodies.
+    stime : Optional[datetime.datetime]
+        Records before stime are skipped.
+    etime : Optional[datetime.datetime]
+        Reading stops at the first record after etime.
+
+    Yields
+    ------
+    rec : dict
+        One record; see parse_record. The time.* fields are replaced by
+        "time" in seconds since the epoch, as in davitpy's recordDict.
+
+    """
+    stime_epoch = None if stime is None else datetime_to_epoch(stime)
+    etime_epoch = None if etime is None else datetime_to_epoch(etime)
+
+    bodies = read_dmap_bodies(source)
+    try:
+        for body in bodies:
+            rec = _collapse_time(parse_record(body))
+            if "time" in rec:
+                if etime_epoch is not None and rec["time"] > etime_epoch:
+                    return
+                if stime_epoch is not None and rec["time"] < stime_epoch:
+                    continue
+            yield rec
+    finally:
+        bodies.close()
+
+
+def read_dmap_batches(source, batch_size=1000, stime=None, etime=None):
+    """Yields lists of at most batch_size records from a DMAP file.
+
+    Parameters are the same as for read_dmap_records.
+    """
+    batch = []
+    for rec in read_dmap_records(source, stime=stime, etime=etime):
+        batch.append(rec)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,327 @@
+"""
+In-process decompression and chaining of dmap files.
+
+Compressed archive files (bz2, gz, zip) are opened as binary streams of
+their decompressed bytes, so they can be fed straight to
+dmap_reader.read_dmap_records without writing an uncompressed copy to
+disk or spawning bunzip2/gunzip/unzip. Several files can be read as one
+logical stream with ChainedStream instead of being concatenated with cat,
+and a day of archive files is presented as one record stream by VirtualDay.
+"""
+
+import bz2
+import gzip
+import io
+import logging
+import mmap
+import os
+import re
+import shutil
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+# file extension -> compression type
+COMPRESSION_TYPES = {".bz2": "bz2", ".gz": "gzip", ".zip": "zip"}
+
+# Start of a bzip2 stream: "BZh", the block size and the block magic
+_BZ2_STREAM_START = re.compile(b"BZh[1-9]\x31\x41\x59\x26\x53\x59")
+
+
+def compression_type(fname):
+    """Compression type ("bz2", "gzip", "zip") of a file from its
+    extension, or None if it is not compressed."""
+    for ext, ctype in COMPRESSION_TYPES.items():
+        if fname.endswith(ext):
+            return ctype
+    return None
+
+
+def strip_compression(fname):
+    """File name without its compression extension."""
+    for ext in COMPRESSION_TYPES.keys():
+        if fname.endswith(ext):
+            return fname[:-len(ext)]
+    return fname
+
+
+def _bz2_stream_ended(decomp):
+    """Whether a BZ2Decompressor reached the end of its stream."""
+    if hasattr(decomp, "eof"):
+        return decomp.eof
+    # Python 2: decompressing past the end of the stream fails
+    try:
+        decomp.decompress(b"")
+    except EOFError:
+        return True
+    return False
+
+
+def _decompress_bz2_segment(data):
+    """Decompresses one or more complete bzip2 streams. Raises
+    EOFError if the data end in the middle of a stream."""
+    out = []
+    while data:
+        decomp = bz2.BZ2Decompressor()
+        out.append(decomp.decompress(data))
+        if not _bz2_stream_ended(decomp):
+            raise EOFError("bzip2 data ended before the end-of-stream "
+                           "marker")
+        data = decomp.unused_data
+    return b"".join(out)
+
+
+def _try_decompress_bz2_segment(data):
+    """_decompress_bz2_segment, or None if the data are not complete
+    bzip2 streams."""
+    try:
+        return _decompress_bz2_segment(data)
+    except (IOError, OSError, EOFError, ValueError):
+        return None
+
+
+def decompress_bz2_parallel(fname, processes=None):
+    """Decompresses a bzip2 file made of several concatenated streams
+    (as written by pbzip2, or by concatenating .bz2 files) by
+    decompressing the streams on a pool of threads.
+
+    Parameters
+    ----------
+    fname : str
+        Full path of a .bz2 file.
+    processes : Optional[int]
+        Number of threads (default: number of cpus).
+
+    Returns
+    -------
+    bytes
+        The decompressed data. Files with a single stream, or whose
+        stream boundaries cannot be determined, are decompressed
+        serially. Raises EOFError (or IOError) for truncated (or
+        corrupt) files.
+
+    """
+    with open(fname, "rb") as fp:
+        data = fp.read()
+    starts = [m.start() for m in _BZ2_STREAM_START.finditer(data)]
+    if len(starts) < 2 or starts[0] != 0:
+        return _decompress_bz2_segment(data)
+
+    segments = [data[s:e] for s, e in zip(starts, starts[1:] + [len(data)])]
+    pool = ThreadPool(processes)
+    try:
+        parts = pool.map(_try_decompress_bz2_segment, segments)
+    finally:
+        pool.close()
+        pool.join()
+
+    # A segment that is not made of complete streams ends at a false
+    # boundary (the stream start pattern occurring inside compressed
+    # data): it is merged with the next segments until it decompresses.
+    out = []
+    i = 0
+    while i < len(segments):
+        part = parts[i]
+        merged = segments[i]
+        i += 1
+        while part is None:
+            if i == len(segments):
+                # truncated or corrupt: raise the error
+                return _decompress_bz2_segment(merged)
+            logging.info("false bzip2 stream boundary in " + fname)
+            merged += segments[i]
+            i += 1
+            part = _try_decompress_bz2_segment(merged)
+        out.append(part)
+    return b"".join(out)
+
+
+def open_dmap_stream(fname, parallel_bz2=False, processes=None):
+    """Opens a (possibly compressed) dmap file for reading.
+
+    Parameters
+    ----------
+    fname : str
+        Full path of a file; .bz2, .gz and .zip files are decompressed
+        on the fly (the first member of a zip archive is read).
+    parallel_bz2 : bool
+        Decompress multi-stream .bz2 files in parallel (in memory).
+    processes : Optional[int]
+        Number of threads for parallel_bz2.
+
+    Returns
+    -------
+    file-like
+        A binary stream of the uncompressed data.
+
+    """
+    ctype = compression_type(fname)
+    if ctype == "bz2":
+        if parallel_bz2:
+            return io.BytesIO(decompress_bz2_parallel(fname, processes))
+        return bz2.BZ2File(fname, "rb")
+    if ctype == "gzip":
+        return gzip.GzipFile(fname, "rb")
+    if ctype == "zip":
+        zf = zipfile.ZipFile(fname)
+        data = zf.read(zf.namelist()[0])
+        zf.close()
+        return io.BytesIO(data)
+    return open(fname, "rb")
+
+
+class MappedFile(object):
+    """
+    Read-only binary stream over a memory-mapped (uncompressed) file.
+    """
+
+    def __init__(self, fname):
+        self.name = fname
+        with open(fname, "rb") as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, size=-1):
+        """Read up to size bytes (everything left if size < 0)."""
+        return self._map.read(size if size >= 0 else len(self._map))
+
+    def close(self):
+        """Unmap the file."""
+        self._map.close()
+
+
+def open_mapped_stream(fname):
+    """Opens a dmap file like open_dmap_stream, but memory-maps
+    uncompressed (non-empty) files instead of reading them."""
+    if compression_type(fname) is None and os.path.getsize(fname) > 0:
+        return MappedFile(fname)
+    return open_dmap_stream(fname)
+
+
+class ChainedStream(object):
+    """
+    Read-only binary stream over a sequence of (possibly compressed)
+    files, read one after the other as if they had been concatenated.
+    Each file is only opened when the previous one is exhausted.
+    """
+
+    def __init__(self, sources, opener=open_dmap_stream):
+        """
+        Parameters
+        ----------
+        sources : list
+            File names (opened with opener) or open binary streams.
+        opener : callable
+            Function opening a file name as a binary stream.
+        """
+        self.sources = list(sources)
+        self.opener = opener
+        self._index = -1
+        self._current = None
+
+    def _next_source(self):
+        """Close the current source and open the next one."""
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        self._index += 1
+        if self._index >= len(self.sources):
+            return False
+        source = self.sources[self._index]
+        if hasattr(source, "read"):
+            self._current = source
+        else:
+            self._current = self.opener(source)
+        return True
+
+    def read(self, size=-1):
+        """Read up to size bytes (everything left if size < 0)."""
+        chunks = []
+        while size != 0:
+            if self._current is None and not self._next_source():
+                break
+            data = self._current.read(size)
+            if not data:
+                if not self._next_source():
+                    break
+                continue
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(chunks)
+
+    def close(self):
+        """Close the source being read and skip the remaining ones."""
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        self._index = len(self.sources)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def uncompress_to_file(fname, outname, parallel_bz2=False):
+    """Writes the uncompressed content of fname to outname."""
+    src = open_dmap_stream(fname, parallel_bz2=parallel_bz2)
+    try:
+        with open(outname, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    finally:
+        src.close()
+    return outname
+
+
+def concat_files(fnames, outname):
+    """Writes the (uncompressed) content of fnames, in order, to outname."""
+    with ChainedStream(fnames) as src:
+        with open(outname, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    return outname
+
+
+class VirtualDay(object):
+    """
+    The ordered source files of a day (or of any time range), presented
+    as a single sequential stream of dmap records. Nothing is copied,
+    uncompressed to disk or concatenated: compressed files are decoded
+    on the fly and uncompressed files are memory-mapped.
+    """
+
+    def __init__(self, files, name=None, use_mmap=True):
+        """
+        Parameters
+        ----------
+        files : list
+            Full paths of the source files, in time order.
+        name : Optional[str]
+            Name the concatenated file would have had; used to name
+            files derived from the day (e.g., the csv output).
+        use_mmap : bool
+            Memory-map the uncompressed files.
+        """
+        self.files = list(files)
+        self.name = name
+        self.use_mmap = use_mmap
+
+    def __len__(self):
+        return len(self.files)
+
+    def __str__(self):
+        return self.name if self.name is not None else " ".join(self.files)
+
+    def nbytes(self):
+        """Total size of the source files on disk."""
+        return sum(os.path.getsize(f) for f in self.files)
+
+    def open_stream(self):
+        """A ChainedStream over the uncompressed bytes of all the files."""
+        opener = open_mapped_stream if self.use_mmap else open_dmap_stream
+        return ChainedStream(self.files, opener=opener)
+
+    def read_records(self, stime=None, etime=None):
+        """Yields the records of the day; see
+        dmap_reader.read_dmap_records."""
+        from dmap_reader import read_dmap_records
+        return read_dmap_records(self, stime=stime, etime=etime)
@@ -4,23 +4,25 @@ Written by Muhammad on 09/01/2018
 
 import datetime as dt
 #from davitpy.pydarn.sdio.fetchUtils import fetch_local_files
-from davitpy.pydarn.sdio import radDataPtr, radDataReadRec
-from davitpy.pydarn.sdio import radDataPtr
-from davitpy import pydarn
+from csv_writer import write_csv
+from dmap_streams import (compression_type, strip_compression,
+                          uncompress_to_file, concat_files, VirtualDay)
+from conversion_cache import make_key
+from median_filter import write_filtered_dmap
 import logging
 import os
 import glob
 import string
-from time import clock
+import zipfile
 import numpy as np
 from dateutil.relativedelta import relativedelta
 
-def uncompress_file(filename, outname=None, remove=False):
+def uncompress_file(filename, outname=None, remove=False, parallel_bz2=False):
     """
     A function to perform an appropriate type of uncompression on a specified 
-    file.  Current extensions include: bz2, gz, zip. This function does not 
-    removed the compressed file. Requires bunzip2, gunzip, and unzip to be 
-    installed.
+    file.  Current extensions include: bz2, gz, zip. The uncompression is
+    done in-process (see dmap_streams), bunzip2, gunzip and unzip are not
+    needed.
     Parameters
     -----------
     filename : (str)
@@ -31,11 +33,13 @@ def uncompress_file(filename, outname=None, remove=False):
         will stay in the same directory).  (default=None)
     remove : (bool)
         Remove compressed file after uncompression (default=False)
+    parallel_bz2 : (bool)
+        Decompress multi-stream bz2 files on several threads (default=False)
     Returns
     ---------
     outname : (NoneType/str)
-        name of uncompressed file or None if the command was unsuccessful or
-        the compression method could not be determined
+        name of uncompressed file or None if the uncompression was unsuccessful
+        or the compression method could not be determined
     """
     import os
 
@@ -46,52 +50,36 @@ def uncompress_file(filename, outname=None, remove=False):
     assert isinstance(remove, bool), \
         logging.error('remove status must be Boolian')
 
-    command = None  # Initialize command as None. It will be updated 
-                    # if a known file compression is found.
+    if compression_type(filename) is None:
+        estr = "unknown compression type for [{:s}]".format(filename)
+        logging.warning(estr)
+        return None
 
     if outname is None:
         outname = filename
+    outname = strip_compression(outname)
 
-    if filename.find('.bz2') != -1:
-        outname = outname.replace('.bz2', '')
-        command = 'bunzip2 -c ' + filename + ' > ' + outname
-    elif filename.find('.gz') != -1:
-        outname = outname.replace('.gz', '')
-        command = 'gunzip -c ' + filename + ' > ' + outname
-    elif filename.find('.zip') != -1:
-        outname = outname.replace('.zip', '')
-        command = 'unzip -c ' + filename + ' > ' + outname
-    #elif filename.find('.tar') != -1:
-    #    outname = outname.replace('.tar', '')
-    #    command = 'tar -xf ' + filename
-
-    if command is not None:
-        try:
-            os.system(command)
-            logging.info("performed [{:s}]".format(command))
-        except:
-            logging.warning("unable to perform [{:s}]".format(command))
-            # Returning None instead of setting outname=None to avoid
-            # messing with inputted outname variable
-            return None
-
-        if remove:
-            command = 'rm {:s}'.format(filename)
-
-            try:
-                os.system(command)
-                logging.info("performed [{:s}]".format(command))
-            except:
-                logging.warning("unable to perform [{:s}]".format(command))
-    else:
+    try:
+        uncompress_to_file(filename, outname, parallel_bz2=parallel_bz2)
+        logging.info("uncompressed [{:s}] to [{:s}]".format(filename, outname))
+    except (IOError, OSError, EOFError, zipfile.BadZipfile):
+        logging.warning("unable to uncompress [{:s}]".format(filename))
+        # Returning None instead of setting outname=None to avoid
+        # messing with inputted outname variable
         return None
-        estr = "unknown compression type for [{:s}]".format(filename)
-        logging.warning(estr)
+
+    if remove:
+        try:
+            os.remove(filename)
+            logging.info("removed [{:s}]".format(filename))
+        except OSError:
+            logging.warning("unable to remove [{:s}]".format(filename))
 
     return outname
 
 def fetch_local_files(stime, etime, localdirfmt, localdict, outdir, fnamefmt,
-                      back_time=relativedelta(years=1), remove=False):
+                      back_time=relativedelta(years=1), remove=False,
+                      catalog=None):
 
     """
     A routine to locate and retrieve file names from locally stored SuperDARN 
@@ -134,6 +122,9 @@ def fetch_local_files(stime, etime, localdirfmt, localdict, outdir, fnamefmt,
         until before giving up. (default=relativedelta(years=1))
     remove : (bool)
         Remove compressed file after uncompression (default=False)
+    catalog : (NoneType/file_catalog.FileCatalog)
+        If given, the files are looked up in this catalog with one
+        query instead of listing directories. (default=None)
     Returns
     --------
     file_stime : (datetime)
@@ -146,10 +137,73 @@ def fetch_local_files(stime, etime, localdirfmt, localdict, outdir, fnamefmt,
     (e.g. localdict['channel'] = '.').
     """
     import os
-    import glob
+
+    # Test input
+    assert isinstance(outdir, str) and outdir[-1] == "/", \
+        logging.error('outdir must be a string ending in "/"')
+    assert os.path.isdir(outdir), logging.error("outdir is not a directory")
+
+    return copy_local_files(locate_local_files(stime, etime, localdirfmt,
+                                               localdict, fnamefmt,
+                                               back_time=back_time,
+                                               catalog=catalog),
+                            outdir, remove)
+
+
+def copy_local_files(paths, outdir, remove=False):
+    """
+    Copies located files (see locate_local_files) to outdir and
+    uncompresses them.
+    Parameters
+    ------------
+    paths : (list)
+        full paths of the (possibly compressed) source files
+    outdir : (str)
+        Directory in which to store uncompressed files (must end with
+        a "/")
+    remove : (bool)
+        Remove compressed file after uncompression (default=False)
+    Returns
+    --------
+    filelist : (list)
+        list of uncompressed files (including path)
+    """
+    import os
+    import shutil
+
+    temp_filelist = []
+    for path in paths:
+        # copy the file to outdir
+        lf = os.path.basename(path)
+        try:
+            shutil.copyfile(path, os.path.join(outdir, lf))
+            logging.info("copied [{:s}] to [{:s}]".format(path, outdir))
+            temp_filelist.append(lf)
+        except (IOError, OSError):
+            estr = "unable to copy [{:s}]".format(path)
+            logging.warning(estr)
+
+    return _uncompress_files(temp_filelist, outdir, remove)
+
+
+def locate_local_files(stime, etime, localdirfmt, localdict, fnamefmt,
+                       back_time=relativedelta(years=1), catalog=None):
+    """
+    Locates the locally stored SuperDARN radar files that fit the input
+    criteria, without copying or uncompressing them.
+    Parameters
+    ------------
+    stime, etime, localdirfmt, localdict, fnamefmt, back_time, catalog :
+        See fetch_local_files.
+    Returns
+    --------
+    filelist : (list)
+        full paths of the (possibly compressed) source files, sorted by
+        file name
+    """
+    import os
     import re
 
-    filelist = []
     temp_filelist = []
 
     # Test input
@@ -159,12 +213,17 @@ def fetch_local_files(stime, etime, localdirfmt, localdict, outdir, fnamefmt,
         logging.error('eTime must be datetime object')
     assert isinstance(localdirfmt, str) and localdirfmt[-1] == "/", \
         logging.error('localdirfmt must be a string ending in "/"')
-    assert isinstance(outdir, str) and outdir[-1] == "/", \
-        logging.error('outdir must be a string ending in "/"')
-    assert os.path.isdir(outdir), logging.error("outdir is not a directory")
     assert isinstance(fnamefmt, (str, list)), \
         logging.error('fnamefmt must be str or list')
 
+    #--------------------------------------------------------------------------
+    # If a catalog is given, return the files it lists and skip the search
+    if catalog is not None:
+        return sorted(catalog.query(stime, etime, localdict["radar"],
+                                    ftype=localdict["ftype"],
+                                    channel=localdict.get("channel")),
+                      key=os.path.basename)
+
     #--------------------------------------------------------------------------
     # If fnamefmt isn't a list, make it one.
     if isinstance(fnamefmt,str):
@@ -185,6 +244,10 @@ def fetch_local_files(stime, etime, localdirfmt, localdict, outdir, fnamefmt,
     for key in keys_in_localdir:
         checkstruct[key] = ''
 
+    # compiled regular expressions by file name, and names already found
+    regex_cache = {}
+    seen_files = set()
+
     while ctime <= etime:
         # set the temporal parts of the possible local directory structure
         localdict["year"] = "{:04d}".format(ctime.year)
@@ -219,27 +282,19 @@ def fetch_local_files(stime, etime, localdirfmt, localdict, outdir, fnamefmt,
         for namefmt in fnamefmt:
             # create a regular expression to check for the desired files
             name = namefmt.format(**localdict)
-            regex = re.compile(name)
+            regex = regex_cache.get(name)
+            if regex is None:
+                regex = regex_cache[name] = re.compile(name)
 
             # Go thorugh all the files in the directory
             for lf in files:
                 #if we have a file match between a file and our regex
                 if(regex.match(lf)):
-                    if lf in temp_filelist: 
+                    if lf in seen_files:
                         continue
                     else:
-                        temp_filelist.append(lf)
-
-                    # copy the file to outdir
-                    outname = os.path.join(outdir,lf)
-                    command='cp {:s} {:s}'.format(os.path.join(local_dir, lf),
-                                                  outname)
-                    try:
-                        os.system(command)
-                        logging.info("performed [{:s}]".format(command))
-                    except:
-                        estr = "unable to perform [{:s}]".format(command)
-                        logging.warning(estr)
+                        seen_files.add(lf)
+                        temp_filelist.append(os.path.join(local_dir, lf))
 
         # Advance the cycle time by the "lowest" time increment 
         # in the namefmt (either forward or reverse)
@@ -262,6 +317,17 @@ def fetch_local_files(stime, etime, localdirfmt, localdict, outdir, fnamefmt,
         elif "{year}" in namefmt:    
             ctime = ctime + relativedelta(years=base_time_inc)
 
+    # Make sure the found files are in order.  Otherwise the concatenation later
+    # will put records out of order
+    return sorted(temp_filelist, key=os.path.basename)
+
+
+def _uncompress_files(temp_filelist, outdir, remove=False):
+    """Uncompresses the files of temp_filelist (names in outdir)
+    and returns the sorted list of uncompressed files."""
+
+    filelist = []
+
     # Make sure the found files are in order.  Otherwise the concatenation later
     # will put records out of order
     temp_filelist = sorted(temp_filelist)
@@ -284,10 +350,12 @@ def fetch_local_files(stime, etime, localdirfmt, localdict, outdir, fnamefmt,
 
 def fetch_concat(ctr_date, localdirfmt, localdict, tmpdir, fnamefmt,
 		 remove_extra_file=True, median_filter=False,
-		 path_to_filter='./fitexfilter'):
+		 path_to_filter='./fitexfilter', catalog=None, virtual=False,
+		 cache=None):
 
     """ fetches files for a single day given by ctr_date,
-    then unzips and concatenates them into a single file.
+    then unzips and concatenates them into a single file
+    (or, if virtual is set, presents them as a single VirtualDay).
     
     Parameters
     ----------
@@ -309,14 +377,25 @@ def fetch_concat(ctr_date, localdirfmt, localdict, tmpdir, fnamefmt,
         If set to True, files other than the concatenated file will be removed
     median_filter : bool
         If set to True, data will be filtered by a boxcar median filtere
+        (see boxcar_filter)
     path_to_filter : full path to the boxcar filter binary file, including
-	the file name.
+	the file name, used if the native filter fails.
+    catalog : file_catalog.FileCatalog or None
+        If given, files are located through this catalog instead of
+        by listing directories.
+    virtual : bool
+        If set to True, the source files are not copied, uncompressed or
+        concatenated; a dmap_streams.VirtualDay reading them in place is
+        returned instead (unless median_filter is set, which needs a file).
+    cache : conversion_cache.ConversionCache or None
+        If given, a file already made from the same (unchanged) source
+        files with the same settings is returned without redoing the work.
 
     
     Returns
     -------
-    str
-	full path of the contatenated filename.
+    str or VirtualDay
+	full path of the contatenated filename (or the VirtualDay).
     
     """
   
@@ -333,13 +412,50 @@ def fetch_concat(ctr_date, localdirfmt, localdict, tmpdir, fnamefmt,
     ftype = localdict["ftype"]
     channel = localdict["channel"]
 
+    # choose a temp file name with time span info for cacheing
+    if (channel is None) or (channel == "."):
+        fname = '%s%s.%s.%s.%s.%s.%s' % \
+                  (tmpdir, stime.strftime("%Y%m%d"),
+                   stime.strftime("%H%M%S"),
+                   etime.strftime("%Y%m%d"),
+                   etime.strftime("%H%M%S"), radcode, ftype)
+    else:
+        fname = '%s%s.%s.%s.%s.%s.%s.%s' % \
+                   (tmpdir, stime.strftime("%Y%m%d"),
+                   stime.strftime("%H%M%S"),
+                   etime.strftime("%Y%m%d"),
+                   etime.strftime("%H%M%S"),
+                   radcode, channel, ftype)
+
     # fetch the data for a given day
     #file_list = fetch_local_files(stime, etime, localdirfmt, localdict, tmpdir, fnamefmt)
     ###################
     # Due to a bug related to davitpy, here is a walkaround to find the list of files need
     # Note: the .bz files have to be manually copied from sd-data to the folder defined by localdirfmt	
 
-    file_list = fetch_local_files(stime, etime, localdirfmt, localdict, tmpdir, fnamefmt)
+    # the source files are located once, for the cache key and the copy
+    src_list = locate_local_files(stime, etime, localdirfmt, localdict,
+                                  fnamefmt, catalog=catalog)
+    src_list = [x for x in src_list if ftype in os.path.basename(x)]
+
+    if virtual and not median_filter:
+        # read the source files in place, nothing is copied or concatenated
+        if len(src_list) == 0:
+            return None
+        return VirtualDay(src_list, name=fname)
+
+    # return the cached file if the same sources were already processed
+    cache_key = None
+    if cache is not None:
+        cache_key = make_key(src_list, stime, etime, output="concat",
+                             median_filter=median_filter,
+                             path_to_filter=path_to_filter if median_filter else None)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print("using cached file " + cached)
+            return cached
+
+    file_list = copy_local_files(src_list, tmpdir)
 
     #file_list = glob.glob(os.path.join(tmpdir, '*bz2'))
     ###################
@@ -352,75 +468,86 @@ def fetch_concat(ctr_date, localdirfmt, localdict, tmpdir, fnamefmt,
         # concatenate the files into a single file
         print("Concatenating all the " + ftype + " files into one")
 
-        # choose a temp file name with time span info for cacheing
-        if (channel is None) or (channel == "."):
-            fname = '%s%s.%s.%s.%s.%s.%s' % \
-                      (tmpdir, stime.strftime("%Y%m%d"),
-                       stime.strftime("%H%M%S"),
-                       etime.strftime("%Y%m%d"),
-                       etime.strftime("%H%M%S"), radcode, ftype)
-        else:
-            fname = '%s%s.%s.%s.%s.%s.%s.%s' % \
-                       (tmpdir, stime.strftime("%Y%m%d"),
-                       stime.strftime("%H%M%S"),
-                       etime.strftime("%Y%m%d"),
-                       etime.strftime("%H%M%S"),
-                       radcode, channel, ftype)
-        logging.debug('cat ' + string.join(file_list) + ' > ' + fname)
-        os.system('cat ' + string.join(file_list) + ' > ' + fname)
+        logging.debug('concatenating ' + ' '.join(file_list) + ' into ' + fname)
+        concat_files(file_list, fname)
 
         # remove the unneeded files from the tmpdir
         if remove_extra_file:
             print("removing unneeded " + ftype + " files")
             for fn in file_list:
                 logging.debug('rm ' + fn)
-                os.system('rm ' + fn)
-                os.system('rm ' + fn+".bz2")
+                for extra in [fn, fn + ".bz2"]:
+                    if os.path.exists(extra):
+                        os.remove(extra)
                 #os.system('rm ' + fn+".gz")
     else:
         fname = None
 
     # Boxcar filter
     if median_filter:
-	fname = boxcar_filter(fname, path_to_filter)
+        fname = boxcar_filter(fname, path_to_filter)
+
+    if cache_key is not None and fname is not None:
+        cache.put(cache_key, fname)
         
     return fname
 
-def boxcar_filter(fname, path_to_filter):
-    """Does boxcar median filtering to data in a file.
+def boxcar_filter(fname, path_to_filter=None):
+    """Does boxcar median filtering to data in a file, with the native
+    filter of median_filter (which gives the same output as fitexfilter)
+    or, if that fails, with the fitexfilter binary.
 
     Parameters
     -----------
     fname : str
         Full path of a file (fitacf, fitex).
     path_to_filter : full path to the boxcar filter binary file, including
-	the file name.
+	the file name, used if the native filter fails (or None).
 
     Returns
     -------
     ffname : str
         Full path of a data file that is boxcar median filtered. 
-	The filtered file name will be fname+"f" 
+	The filtered file name will be fname+"f". An existing filtered
+        file is reused only if it is not older than fname.
     
     """
 
     if fname is not None:
         # extract the data type (e.g., fitacf, fitex, etc.) from fname
         ftype = fname.split(".")[-1]
-        if not ftype+'f' in fname:
-            try:
-                print("boxcar filtering the data")
-                # do boxcar filtering
-                ffname = fname + 'f'
-                command = path_to_filter + ' ' + fname + ' > ' + ffname
-                logging.debug("performing: {:s}".format(command))
-                os.system(command)
-                logging.debug("done filtering")
-            except Exception, e:
-                estr = 'problem filtering file, using the unfiltered one'
-                logging.warning(estr)
-        else:
-            print("file " + fname + " exists")
+        if ftype.endswith("f") and ftype[:-1] in ["fitacf", "fitex", "lmfit"]:
+            # fname is already a filtered file
+            return fname
+        ffname = fname + 'f'
+        if os.path.exists(ffname) and os.path.getsize(ffname) > 0 and \
+           os.path.getmtime(ffname) >= os.path.getmtime(fname):
+            print("file " + ffname + " exists")
+            return ffname
+        print("boxcar filtering the data")
+        try:
+            write_filtered_dmap(fname, ffname)
+            logging.debug("done filtering")
+            return ffname
+        except Exception:
+            logging.warning('problem filtering file natively, trying ' +
+                            str(path_to_filter), exc_info=True)
+        try:
+            if path_to_filter is None:
+                raise OSError("no filter binary")
+            # do boxcar filtering
+            command = path_to_filter + ' ' + fname + ' > ' + ffname
+            logging.debug("performing: {:s}".format(command))
+            status = os.system(command)
+            if status != 0:
+                raise OSError("exit status {:d}".format(status))
+            logging.debug("done filtering")
+        except Exception:
+            estr = 'problem filtering file, using the unfiltered one'
+            logging.warning(estr)
+            # don't leave a partial file that would look current
+            if os.path.exists(ffname):
+                os.remove(ffname)
             ffname = fname
     else:
         ffname = None
@@ -428,158 +555,71 @@ def boxcar_filter(fname, path_to_filter):
 
 
 def dmap_to_csv(fname, stime, etime=None, sep="|",
-                fileType="fitacf", readOnly=False):
+                fileType="fitacf", readOnly=False, cache=None,
+                compat=True, floatPrecision=None):
 
    
     """Reads data from a dmap file and writes it to
     a csv file.
     Parameter
     ---------
-    fname : str
-        Full path of a dmap file (fitacf, fitex).
+    fname : str or VirtualDay
+        Full path of a dmap file (fitacf, fitex), or a VirtualDay
+        as returned by fetch_concat.
     stime : datetime.datetime
         The start time of interest
     etime : datetime.datetime
-        The end time of interest
+        The end time of interest. If set to None, reads data to the
+        end of the day of stime.
     sep : str
         Delimiter to use
     fileType : str
         SuperDARN fit data type (e.g., fitacf)
+    cache : conversion_cache.ConversionCache or None
+        If given, a csv file already made from the same (unchanged)
+        input with the same settings is returned instead.
+    compat : bool
+        Write floats exactly as the former record by record writer did
+        (str() of Python floats). If False, floats are written with the
+        shortest representation of their dtype, which is shorter and
+        somewhat faster.
+    floatPrecision : int or None
+        If compat is False, decimals floats are rounded to.
     Returns
     -------
     fname_csv : str 
-        Full path (including the file name) of a csv file
+        Full path (including the file name) of a csv file: fname+".csv",
+        or with a cache fname+".<key>.csv", the key depending on the
+        time span and settings.
     """
 
-    # Get a file poiter
-    myPtr = radDataPtr(sTime=stime, eTime=etime, fileName=fname, fileType=fileType)
-
-    # Parameter names in a fitacf file
-    header = sep.join(["time", "bmnum", "channel", "stid", "cp", "lmfit" , "fitex",
-                       "exflg", "iqflg", "offset", "lmflg", "rawflg", "fType",
-                       "acflg", "fitacf",                 # upto here are params in myBeam
-                       "elv", "gflg", "nlag", "npnts", "p_l", "p_l_e", "p_s",
-                       "p_s_e", "phi0", "phi0_e", "pwr0", "qflg", "slist", "v",
-                       "v_e", "w_l", "w_l_e", "w_s", "w_s_e",  # upto here are params in myBeam.fit
-                       "bmazm", "frang", "ifmode", "inttsc", "inttus", "lagfr",
-                       "ltab", "mpinc", "mplgexs", "mplgs", "mppul", "nave", "noisemean",
-                       "noisesearch", "noisesky", "nrang", "ptab", "rsep", "rxrise",
-                       "scan", "smsep", "tfreq", "txpl", "xcf"]) # upto here are params in myBeam.prm
+    # Same default as davitpy's radDataPtr
+    if etime is None:
+        etime = stime.replace(hour=0, minute=0, second=0, microsecond=0) +\
+                dt.timedelta(days=1)
 
     # Output file name
-    fname_csv = fname + ".csv"
-
-    # Read the parameters of interest.
-    try:
-        myPtr.rewind()
-    except Exception as e:
-        logging.error(e)
-
-    myBeam = myPtr.readRec()
-    with open(fname_csv, "w") as f:
-        f.write(header +"\n")
-        while(myBeam is not None):
-            if(myBeam.time > myPtr.eTime): break
-            if(myPtr.sTime <= myBeam.time):
-
-                # Params in myBeam
-                time = str(myBeam.time).split(".")[0]    # Remove millisecond part
-                bmnum = str(myBeam.bmnum)
-                stid = str(myBeam.stid)
-                cp = str(myBeam.cp)
-                channel = str(myBeam.channel)
-                lmfit = str(myBeam.lmfit)
-                fitex = str(myBeam.fitex)
-                exflg = str(myBeam.exflg)
-                iqflg = str(myBeam.iqflg)
-                offset = str(myBeam.offset)
-                lmflg = str(myBeam.lmflg)
-                rawflg = str(myBeam.rawflg)
-                fType = str(myBeam.fType)
-                acflg = str(myBeam.acflg)
-                fitacf = str(myBeam.fitacf)
-
-                # Params in myBeam.fit
-                elv = "[]" if myBeam.fit.elv is None else str(myBeam.fit.elv) 
-                gflg = "[]" if myBeam.fit.gflg is None else str(myBeam.fit.gflg)
-                nlag = "[]" if myBeam.fit.nlag is None else str(myBeam.fit.nlag)
-                npnts = str(myBeam.fit.npnts)
-                p_l = "[]" if myBeam.fit.p_l is None else str(myBeam.fit.p_l)
-                p_l_e = "[]" if myBeam.fit.p_l_e is None else str(myBeam.fit.p_l_e)
-                p_l_e = p_l_e.replace("inf", "999999")
-                p_s = "[]" if myBeam.fit.p_s is None else str(myBeam.fit.p_s)
-                p_s_e = "[]" if myBeam.fit.p_s_e is None else str(myBeam.fit.p_s_e)
-                p_s_e = p_s_e.replace("inf", "999999")
-                phi0 = "[]" if myBeam.fit.phi0 is None else str(myBeam.fit.phi0)
-                phi0_e = "[]" if myBeam.fit.phi0_e is None else str(myBeam.fit.phi0_e)
-                phi0_e = phi0_e.replace("inf", "999999")
-                pwr0 = "[]" if myBeam.fit.pwr0 is None else str(myBeam.fit.pwr0)
-                qflg = "[]" if myBeam.fit.qflg is None else str(myBeam.fit.qflg)
-                slist = str(myBeam.fit.slist)
-                v = "[]" if myBeam.fit.v is None else str(myBeam.fit.v)
-                v_e = "[]" if myBeam.fit.v_e is None else str(myBeam.fit.v_e)
-                v_e = v_e.replace("inf", "999999")
-                w_l = "[]" if myBeam.fit.w_l is None else str(myBeam.fit.w_l)
-                w_l = w_l.replace("inf", "999999")
-                w_l_e = "[]" if myBeam.fit.w_l_e is None else str(myBeam.fit.w_l_e)
-                w_l_e = w_l_e.replace("inf", "999999")
-                w_s = "[]" if myBeam.fit.w_s is None else str(myBeam.fit.w_s)
-                w_s = w_s.replace("inf", "999999")
-                w_s_e = "[]" if myBeam.fit.w_s_e is None else str(myBeam.fit.w_s_e)
-                w_s_e = w_s_e.replace("inf", "999999")
-
-                # Params in myBeam.prm
-                bmazm = str(myBeam.prm.bmazm)
-                frang = str(myBeam.prm.frang)
-                ifmode = str(myBeam.prm.ifmode)
-                inttsc = str(myBeam.prm.inttsc)
-                inttus = str(myBeam.prm.inttus)
-                lagfr = str(myBeam.prm.lagfr)
-                ltab = "[]" if myBeam.prm.ltab is None else str(myBeam.prm.ltab)
-                mpinc = str(myBeam.prm.mpinc)
-                mplgexs = str(myBeam.prm.mplgexs)
-                mplgs = str(myBeam.prm.mplgs)
-                mppul = str(myBeam.prm.mppul)
-                nave = str(myBeam.prm.nave)
-                noisemean = str(myBeam.prm.noisemean)
-                noisesearch = str(myBeam.prm.noisesearch)
-                noisesky = str(myBeam.prm.noisesky)
-                nrang = str(myBeam.prm.nrang)
-                ptab = "[]" if myBeam.prm.ptab is None else  str(myBeam.prm.ptab)
-                rsep = str(myBeam.prm.rsep)
-                rxrise = str(myBeam.prm.rxrise)
-                scan = str(myBeam.prm.scan)
-                smsep = str(myBeam.prm.smsep)
-                tfreq = str(myBeam.prm.tfreq)
-                txpl = str(myBeam.prm.txpl)
-                xcf = str(myBeam.prm.xcf)
-
-
-                # Params in myBeam.rawacf
-                #NOTE: add if needed
-
-                # Params in myBeam.iqdat
-                #NOTE: add if needed
-
-                # Params in myBeam.fPtr
-                #NOTE: add if needed
-
-
-                # Write the current lbeam record to fname_csv
-                line = sep.join([time, bmnum, channel, stid, cp, lmfit , fitex,
-                                 exflg, iqflg, offset, lmflg, rawflg, fType,
-                                 acflg, fitacf,                 # upto here are params in myBeam
-                                 elv, gflg, nlag, npnts, p_l, p_l_e, p_s,
-                                 p_s_e, phi0, phi0_e, pwr0, qflg, slist, v,
-                                 v_e, w_l, w_l_e, w_s, w_s_e,   # upto here are params in myBeam.fit
-                                 bmazm, frang, ifmode, inttsc, inttus, lagfr,
-                                 ltab, mpinc, mplgexs, mplgs, mppul, nave, noisemean,
-                                 noisesearch, noisesky, nrang, ptab, rsep, rxrise,
-                                 scan, smsep, tfreq, txpl, xcf]) # upto here are params in myBeam.prm
-                f.write(line +"\n")
-
-            # Read the next beam record
-            myBeam = myPtr.readRec()
+    fname_csv = str(fname) + ".csv"
+
+    cache_key = None
+    if cache is not None:
+        sources = fname.files if isinstance(fname, VirtualDay) else [fname]
+        cache_key = make_key(sources, stime, etime, output="csv", sep=sep,
+                             fileType=fileType, compat=compat,
+                             floatPrecision=floatPrecision)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+        # outputs of other time spans or settings are cached as well
+        fname_csv = str(fname) + "." + cache_key[:12] + ".csv"
+
+    # Format and write the parameters of interest, a block of records
+    # at a time (see csv_writer.CSV_COLUMNS for the columns)
+    write_csv(fname, fname_csv, stime=stime, etime=etime, sep=sep,
+              fileType=fileType, compat=compat, floatPrecision=floatPrecision)
+
+    if cache_key is not None:
+        cache.put(cache_key, fname_csv)
 
     return fname_csv
 
@@ -592,7 +632,7 @@ def main():
     # input parameters
     #ctr_date = dt.datetime(2012,12,31)
     #ctr_date = dt.datetime(2014,11,02)
-    ctr_date = dt.datetime(2012,12,05)
+    ctr_date = dt.datetime(2012,12,5)
     stime = ctr_date
     etime = ctr_date + dt.timedelta(days=1)
     #etime = None
@@ -609,6 +649,7 @@ def main():
     remove_extra_file = True 
     median_filter=False
     path_to_filter = './fitexfilter'
+    virtual = True    # read the day's files in place instead of concatenating
 
     #localdirfmt = "/sd-data/{year}/{ftype}/{radar}/"
     localdirfmt = "./sd-data/{year}/{ftype}/{radar}/"
@@ -622,7 +663,7 @@ def main():
     fname = fetch_concat(ctr_date, localdirfmt, localdict, tmpdir, fnamefmt,
                          remove_extra_file=remove_extra_file,
 			 median_filter=median_filter,
-			 path_to_filter=path_to_filter)
+			 path_to_filter=path_to_filter, virtual=virtual)
 
 
     # Convert dmap format to csv
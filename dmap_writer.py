@@ -0,0 +1,89 @@
+"""
+Writer of SuperDARN DMAP records, the inverse of dmap_reader.
+
+Encodes records given as dicts of scalars and NumPy arrays (as
+dmap_reader.parse_record returns them, before the time fields are
+collapsed) into the binary block/scalar/array layout of DMAP files.
+"""
+
+import struct
+import numpy as np
+
+import dmap_reader
+from fitacf_schema import VOID_NAMES
+
+# numpy dtype -> DMAP type code
+DMAP_TYPE_CODES = dict((dtype, code) for code, dtype in
+                       dmap_reader.DMAP_DTYPES.items())
+
+_INT32 = struct.Struct("<i")
+# DMAP type code -> struct of a single scalar value
+_SCALAR_STRUCTS = dict((code, struct.Struct("<" + fmt)) for code, fmt in
+                       [(dmap_reader.DATACHAR, "b"),
+                        (dmap_reader.DATASHORT, "h"),
+                        (dmap_reader.DATAINT, "i"),
+                        (dmap_reader.DATAFLOAT, "f"),
+                        (dmap_reader.DATADOUBLE, "d"),
+                        (dmap_reader.DATALONG, "q"),
+                        (dmap_reader.DATAUCHAR, "B"),
+                        (dmap_reader.DATAUSHORT, "H"),
+                        (dmap_reader.DATAUINT, "I"),
+                        (dmap_reader.DATAULONG, "Q")])
+# (name, numpy dtype) -> (name and type code, struct) of numeric scalars
+_scalar_encoders = {}
+
+
+def _encode_name(name, code):
+    """Name and type code of a DMAP entry."""
+    return name.encode("latin-1") + b"\0" + struct.pack("<B", code)
+
+
+def encode_record(rec):
+    """
+    Encode a record as the bytes of a DMAP record (the inverse of
+    dmap_reader.parse_record, before the time fields are collapsed).
+    Scalars are numpy scalars or strings (DATASTRING), except the void
+    fields of fitacf_schema, which are length-1 bytes (DATACHAR);
+    arrays are numpy arrays of any dimension.
+    """
+    scalars = []
+    arrays = []
+    for name in rec:
+        value = rec[name]
+        if isinstance(value, np.ndarray):
+            dtype = value.dtype.newbyteorder("<")
+            arrays.append(_encode_name(name, DMAP_TYPE_CODES[dtype]) +
+                          _INT32.pack(value.ndim) +
+                          struct.pack("<%di" % value.ndim,
+                                      *value.shape[::-1]) +
+                          value.astype(dtype).tobytes())
+        elif name in VOID_NAMES:
+            scalars.append(_encode_name(name, dmap_reader.DATACHAR) + value)
+        elif isinstance(value, str):
+            scalars.append(_encode_name(name, dmap_reader.DATASTRING) +
+                           value.encode("latin-1") + b"\0")
+        else:
+            if not isinstance(value, np.generic):
+                value = np.asarray(value)[()]
+            key = (name, value.dtype)
+            if key not in _scalar_encoders:
+                code = DMAP_TYPE_CODES[value.dtype.newbyteorder("<")]
+                _scalar_encoders[key] = (_encode_name(name, code),
+                                         _SCALAR_STRUCTS[code])
+            head, fmt = _scalar_encoders[key]
+            scalars.append(head + fmt.pack(value))
+    body = struct.pack("<ii", len(scalars), len(arrays)) + \
+        b"".join(scalars) + b"".join(arrays)
+    return struct.pack("<ii", dmap_reader.DMAP_CODE, len(body) + 8) + body
+
+
+def write_dmap_records(records, fname):
+    """Write records (dicts as encode_record takes them) to the
+    (uncompressed) dmap file fname. Returns the number of records
+    written."""
+    nrec = 0
+    with open(fname, "wb") as fp:
+        for rec in records:
+            fp.write(encode_record(rec))
+            nrec += 1
+    return nrec
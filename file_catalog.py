@@ -0,0 +1,233 @@
+"""
+Persistent SQLite catalog of the SuperDARN archive files.
+
+Files under a data tree (e.g. /sd-data/) are indexed by radar, channel,
+file type and start/end time, so that the files of any time range are
+found with one indexed query instead of listing directories step by
+step. The catalog is updated incrementally: directories whose mtime has
+not changed since the last update are not rescanned.
+"""
+
+import calendar
+import datetime as dt
+import logging
+import os
+import re
+import sqlite3
+
+# Names such as 20121205.0001.00.bks.fitacf.bz2, 20121205.00.bks.a.fitacf
+# or 20121205.C0.bks.fitacf
+FNAME_REGEX = re.compile(r"^(?P<date>\d{8})\."
+                         r"(?:(?P<hour>\d{2})(?P<min>\d{2})?\.(?:(?P<sec>\d{2})\.)?)?"
+                         r"(?:C\d\.)?"
+                         r"(?P<radar>[a-z]{3})\."
+                         r"(?:(?P<channel>[a-z])\.)?"
+                         r"(?P<ftype>[a-z]+)"
+                         r"(?:\.(?P<compression>bz2|gz|zip))?$")
+
+# Time span assumed for the last file of a sequence, in seconds
+HOURLY_SPAN = 2 * 3600
+DAILY_SPAN = 24 * 3600
+
+
+def parse_file_name(fname):
+    """Parses an archive file name.
+
+    Parameters
+    ----------
+    fname : str
+        Base name of a file.
+
+    Returns
+    -------
+    dict or None
+        radar, channel ("" if none), ftype, compression ("" if none),
+        stime (seconds since the epoch) and span (default duration in
+        seconds), or None if the name is not a SuperDARN file name.
+
+    """
+    match = FNAME_REGEX.match(fname)
+    if match is None:
+        return None
+    parts = match.groupdict()
+    try:
+        stime = dt.datetime.strptime(parts["date"], "%Y%m%d")
+    except ValueError:
+        return None
+    if parts["hour"] is not None:
+        stime += dt.timedelta(hours=int(parts["hour"]),
+                              minutes=int(parts["min"] or 0),
+                              seconds=int(parts["sec"] or 0))
+        span = HOURLY_SPAN
+    else:
+        span = DAILY_SPAN
+    return {"radar": parts["radar"], "channel": parts["channel"] or "",
+            "ftype": parts["ftype"], "compression": parts["compression"] or "",
+            "stime": calendar.timegm(stime.timetuple()), "span": span}
+
+
+class FileCatalog(object):
+    """
+    SQLite index of archive files keyed by radar, channel,
+    file type and start/end time.
+    """
+
+    def __init__(self, dbPath):
+        """
+        Open (or create) the catalog stored in dbPath
+        """
+        self.dbPath = dbPath
+        self.conn = sqlite3.connect(dbPath)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                dir TEXT NOT NULL,
+                radar TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                ftype TEXT NOT NULL,
+                compression TEXT NOT NULL,
+                stime REAL NOT NULL,
+                etime REAL NOT NULL,
+                span REAL NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS files_lookup
+                ON files (radar, ftype, channel, stime);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL);
+            """)
+
+    def close(self):
+        """Close the database connection."""
+        self.conn.close()
+
+    def update(self, rootDir):
+        """
+        Bring the catalog up to date with the files under rootDir.
+        Only directories whose mtime changed since the last update
+        are rescanned. Returns the number of directories rescanned.
+        """
+        dirMtimes = dict(self.conn.execute("SELECT path, mtime FROM dirs"))
+        seenDirs = set()
+        groups = set()
+        nScanned = 0
+        for dirPath, dirNames, fileNames in os.walk(rootDir):
+            seenDirs.add(dirPath)
+            mtime = os.stat(dirPath).st_mtime
+            if dirMtimes.get(dirPath) == mtime:
+                continue
+            nScanned += 1
+            groups.update(self._scan_dir(dirPath, fileNames))
+            self.conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)",
+                              (dirPath, mtime))
+
+        # forget directories that were removed
+        root = os.path.join(rootDir, "")
+        for dirPath in set(dirMtimes.keys()) - seenDirs:
+            if dirPath == rootDir or dirPath.startswith(root):
+                groups.update(self.conn.execute(
+                    "SELECT DISTINCT radar, channel, ftype FROM files "
+                    "WHERE dir = ?", (dirPath,)))
+                self.conn.execute("DELETE FROM files WHERE dir = ?", (dirPath,))
+                self.conn.execute("DELETE FROM dirs WHERE path = ?", (dirPath,))
+
+        for group in groups:
+            self._update_end_times(*group)
+        self.conn.commit()
+        return nScanned
+
+    def _scan_dir(self, dirPath, fileNames):
+        """
+        Re-index the files of one directory. Returns the set of
+        (radar, channel, ftype) groups that changed.
+        """
+        groups = set()
+        known = dict((row[0], row[1:]) for row in self.conn.execute(
+            "SELECT path, size, mtime, radar, channel, ftype FROM files "
+            "WHERE dir = ?", (dirPath,)))
+        current = set()
+        for fname in fileNames:
+            info = parse_file_name(fname)
+            if info is None:
+                continue
+            path = os.path.join(dirPath, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            current.add(path)
+            old = known.get(path)
+            if old is not None and old[0] == st.st_size and old[1] == st.st_mtime:
+                continue
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                (path, dirPath, info["radar"], info["channel"], info["ftype"],
+                 info["compression"], info["stime"],
+                 info["stime"] + info["span"], info["span"], st.st_size,
+                 st.st_mtime))
+            groups.add((info["radar"], info["channel"], info["ftype"]))
+        for path in set(known.keys()) - current:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+            groups.add(tuple(known[path][2:]))
+        return groups
+
+    def _update_end_times(self, radar, channel, ftype):
+        """
+        Set the end time of each file of a group to the start time of
+        the next file, capped by the default span of the file.
+        """
+        rows = list(self.conn.execute(
+            "SELECT path, stime, span FROM files "
+            "WHERE radar = ? AND channel = ? AND ftype = ? ORDER BY stime",
+            (radar, channel, ftype)))
+        updates = []
+        for i, (path, stime, span) in enumerate(rows):
+            etime = stime + span
+            for nextRow in rows[i + 1:]:
+                if nextRow[1] > stime:
+                    etime = min(etime, nextRow[1])
+                    break
+            updates.append((etime, path))
+        self.conn.executemany("UPDATE files SET etime = ? WHERE path = ?",
+                              updates)
+
+    def query(self, stime, etime, radar, ftype="fitacf", channel=None):
+        """
+        Files overlapping [stime, etime), sorted by start time.
+
+        Parameters
+        ----------
+        stime, etime : datetime.datetime
+            Time range of interest.
+        radar : str
+            Three-letter radar code.
+        ftype : str
+            File type (e.g., fitacf).
+        channel : Optional[str]
+            Channel letter; None or "." selects all channels.
+
+        Returns
+        -------
+        list
+            Full paths of the matching files.
+        """
+        sql = "SELECT path FROM files WHERE radar = ? AND ftype = ? " +\
+              "AND stime < ? AND etime > ?"
+        args = [radar, ftype, calendar.timegm(etime.timetuple()),
+                calendar.timegm(stime.timetuple())]
+        if channel is not None and channel != ".":
+            sql += " AND channel = ?"
+            args.append(channel)
+        sql += " ORDER BY stime, path"
+        return [row[0] for row in self.conn.execute(sql, args)]
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    catalog = FileCatalog("./sd-data-catalog.sqlite")
+    nDirs = catalog.update("/sd-data/")
+    print("rescanned {:d} directories".format(nDirs))
+    print(catalog.query(dt.datetime(2012,12,5), dt.datetime(2012,12,6), "bks"))
+    catalog.close()
@@ -0,0 +1,263 @@
+"""
+Canonical description of every field of a fitacf record.
+
+Names, kinds (scalar, array or void), data types, units and descriptions
+of the 85 fitacf fields, shared by the HDF5 (generate_hdf5_files),
+Parquet (generate_parquet_files) and columnar (dmap_columns) code paths.
+"""
+
+import numpy as np
+
+# Bump when the types or names below change in a way that
+# affects files already written.
+SCHEMA_VERSION = 1
+
+# (name, kind, dtype, unit, description)
+# dtype is the numpy type of the value (of each element for arrays);
+# "str" marks variable-length strings.
+FIELDS = [
+    ("atten",                 "scalar", "int16",   " ",
+     "Attenuation level."),
+    ("bmazm",                 "scalar", "float32", "degree",
+     "Beam azimuth."),
+    ("bmnum",                 "scalar", "int16",   " ",
+     "Beam number."),
+    ("channel",               "scalar", "int16",   " ",
+     "Channel number for a stereo radar (zero for all others)."),
+    ("combf",                 "scalar", "str",     " ",
+     "Comment buffer."),
+    ("cp",                    "scalar", "int16",   " ",
+     "Control program identifier."),
+    ("ercod",                 "scalar", "int16",   " ",
+     "Error code."),
+    ("fitacf.revision.major", "scalar", "int32",   " ",
+     "Major version number of the FitACF algorithm."),
+    ("fitacf.revision.minor", "scalar", "int32",   " ",
+     "Minor version number of the FitACF algorithm."),
+    ("frang",                 "scalar", "int16",   "kilometers",
+     "Distance to first range."),
+    ("ifmode",                "scalar", "int16",   " ",
+     "IF mode."),
+    ("intt.sc",               "scalar", "int16",   "seconds",
+     "Whole number of seconds of integration time."),
+    ("intt.us",               "scalar", "int32",   "microseconds",
+     "Fractional number of microseconds of integration time."),
+    ("lagfr",                 "scalar", "int32",   "microseconds",
+     "Lag to first range."),
+    ("lvmax",                 "scalar", "int32",   " ",
+     "Maximum noise level allowed."),
+    ("mpinc",                 "scalar", "int32",   "microseconds",
+     "Multi-pulse increment."),
+    ("mplgexs",               "scalar", "int32",   " ",
+     "Number of lags in the extended lag table."),
+    ("mplgs",                 "scalar", "int16",   " ",
+     "Number of lags in sequence."),
+    ("mppul",                 "scalar", "int16",   " ",
+     "Number of pulses in sequence."),
+    ("mxpwr",                 "scalar", "int32",   " ",
+     "Maximum power."),
+    ("nave",                  "scalar", "int16",   " ",
+     "Number of pulse sequences transmitted."),
+    ("noise.lag0",            "scalar", "float32", " ",
+     "Lag zero power of noise ACF."),
+    ("noise.mean",            "scalar", "float32", " ",
+     "Average noise across frequency band."),
+    ("noise.search",          "scalar", "float32", " ",
+     "Calculated noise from clear frequency search."),
+    ("noise.sky",             "scalar", "float32", " ",
+     "Sky noise."),
+    ("noise.vel",             "scalar", "float32", " ",
+     "Velocity from fitting the noise ACF."),
+    ("nrang",                 "scalar", "int16",   " ",
+     "Number of ranges."),
+    ("offset",                "scalar", "int16",   " ",
+     "Offset between channels for a stereo radar (zero for all others)."),
+    ("origin.command",        "scalar", "str",     " ",
+     "The command line or control program used to generate the data."),
+    ("origin.time",           "scalar", "str",     " ",
+     "ASCII representation of when the data was generated."),
+    ("rsep",                  "scalar", "int16",   "kilometers",
+     "Range separation."),
+    ("rxrise",                "scalar", "int16",   "microseconds",
+     "Receiver rise time."),
+    ("scan",                  "scalar", "int16",   " ",
+     "Scan flag."),
+    ("smsep",                 "scalar", "int16",   "microseconds",
+     "Sample separation."),
+    ("stat.agc",              "scalar", "int16",   " ",
+     "AGC status word."),
+    ("stat.lopwr",            "scalar", "int16",   " ",
+     "LOPWR status word."),
+    ("stid",                  "scalar", "int16",   " ",
+     "Station identifier."),
+    ("tfreq",                 "scalar", "int32",   "kHz",
+     "Transmitted frequency."),
+    ("time",                  "scalar", "float64", "seconds since 1970-01-01",
+     "Time of the record."),
+    ("txpl",                  "scalar", "int16",   "microseconds",
+     "Transmit pulse length."),
+    ("txpow",                 "scalar", "int32",   "kW",
+     "Transmitted power."),
+    ("xcf",                   "scalar", "int32",   " ",
+     "XCF flag."),
+    ("origin.code",           "void",   "V1",      " ",
+     "Code indicating origin of the data."),
+    ("radar.revision.major",  "void",   "V1",      " ",
+     "Major version number of the radar operating system."),
+    ("radar.revision.minor",  "void",   "V1",      " ",
+     "Minor version number of the radar operating system."),
+    ("gflg",                  "array",  "int16",   " ",
+     "Ground scatter flag for ACF."),
+    ("ltab",                  "array",  "int16",   " ",
+     "Lag table."),
+    ("nlag",                  "array",  "int16",   " ",
+     "Number of points in the fit."),
+    ("p_l",                   "array",  "float32", "dB",
+     "Power from lambda fit of ACF."),
+    ("p_l_e",                 "array",  "float32", "dB",
+     "Power error from lambda fit of ACF."),
+    ("p_s",                   "array",  "float32", "dB",
+     "Power from sigma fit of ACF."),
+    ("p_s_e",                 "array",  "float32", "dB",
+     "Power error from sigma fit of ACF."),
+    ("ptab",                  "array",  "int16",   " ",
+     "Pulse table."),
+    ("pwr0",                  "array",  "float32", " ",
+     "Lag zero power."),
+    ("qflg",                  "array",  "int16",   " ",
+     "Quality of fit flag for ACF."),
+    ("sd_l",                  "array",  "float32", " ",
+     "Standard deviation of lambda fit."),
+    ("sd_phi",                "array",  "float32", " ",
+     "Standard deviation of phase fit of ACF."),
+    ("sd_s",                  "array",  "float32", " ",
+     "Standard deviation of sigma fit."),
+    ("slist",                 "array",  "int16",   " ",
+     "List of stored ranges."),
+    ("v",                     "array",  "float32", "m/s",
+     "Velocity from ACF."),
+    ("v_e",                   "array",  "float32", "m/s",
+     "Velocity error from ACF."),
+    ("w_l",                   "array",  "float32", "m/s",
+     "Spectral width from lambda fit of ACF."),
+    ("w_l_e",                 "array",  "float32", "m/s",
+     "Spectral width error from lambda fit of ACF."),
+    ("w_s",                   "array",  "float32", "m/s",
+     "Spectral width from sigma fit of ACF."),
+    ("w_s_e",                 "array",  "float32", "m/s",
+     "Spectral width error from sigma fit of ACF."),
+    ("x_qflg",                "array",  "int16",   " ",
+     "Quality of fit flag for XCF."),
+    ("x_gflg",                "array",  "int16",   " ",
+     "Ground scatter flag for XCF."),
+    ("x_p_l",                 "array",  "float32", "dB",
+     "Power from lambda fit of XCF."),
+    ("x_p_l_e",               "array",  "float32", "dB",
+     "Power error from lambda fit of XCF."),
+    ("x_p_s",                 "array",  "float32", "dB",
+     "Power from sigma fit of XCF."),
+    ("x_p_s_e",               "array",  "float32", "dB",
+     "Power error from sigma fit of XCF."),
+    ("x_v",                   "array",  "float32", "m/s",
+     "Velocity from XCF."),
+    ("x_v_e",                 "array",  "float32", "m/s",
+     "Velocity error from XCF."),
+    ("x_w_l",                 "array",  "float32", "m/s",
+     "Spectral width from lambda fit of XCF."),
+    ("x_w_l_e",               "array",  "float32", "m/s",
+     "Spectral width error from lambda fit of XCF."),
+    ("x_w_s",                 "array",  "float32", "m/s",
+     "Spectral width from sigma fit of XCF."),
+    ("x_w_s_e",               "array",  "float32", "m/s",
+     "Spectral width error from sigma fit of XCF."),
+    ("phi0",                  "array",  "float32", " ",
+     "Phase determination at lag zero of the ACF."),
+    ("phi0_e",                "array",  "float32", " ",
+     "Phase determination error at lag zero of the ACF."),
+    ("elv",                   "array",  "float32", "degree",
+     "Angle of arrival estimate."),
+    ("elv_low",               "array",  "float32", "degree",
+     "Lowest estimate of angle of arrival."),
+    ("elv_high",              "array",  "float32", "degree",
+     "Highest estimate of angle of arrival."),
+    ("x_sd_l",                "array",  "float32", " ",
+     "Standard deviation of lambda fit of XCF."),
+    ("x_sd_s",                "array",  "float32", " ",
+     "Standard deviation of sigma fit of XCF."),
+    ("x_sd_phi",              "array",  "float32", " ",
+     "Standard deviation of phase fit of XCF."),
+]
+
+# Array fields stored with more than one dimension;
+# ltab is a list of (pulse, pulse) pairs.
+ARRAY_NDIM = {"ltab": 2}
+
+FIELD_DICT = dict((fld[0], fld) for fld in FIELDS)
+
+# 42 scalar, 40 array and 3 single-character (numpy void) fields
+SCALAR_NAMES = [fld[0] for fld in FIELDS if fld[1] == "scalar"]
+ARRAY_NAMES = [fld[0] for fld in FIELDS if fld[1] == "array"]
+VOID_NAMES = [fld[0] for fld in FIELDS if fld[1] == "void"]
+
+
+def numpy_dtype(name):
+    """numpy dtype of a field (of its elements, for arrays)."""
+    dtype = FIELD_DICT[name][2]
+    if dtype == "str":
+        return np.dtype(object)
+    return np.dtype(dtype)
+
+
+# name -> numpy dtype, for all the fields
+COLUMN_DTYPES = dict((fld[0], numpy_dtype(fld[0])) for fld in FIELDS)
+
+
+def unit(name):
+    """Unit of a field (" " if it has none)."""
+    return FIELD_DICT[name][3]
+
+
+def description(name):
+    """One line description of a field."""
+    return FIELD_DICT[name][4]
+
+
+def hdf5_dtype(name):
+    """h5py dtype used for a field in vlen layout hdf5 files:
+    a vlen of the element type for scalars and arrays alike."""
+    import h5py
+    kind, dtype = FIELD_DICT[name][1:3]
+    if kind == "void":
+        return np.dtype(dtype)
+    if dtype == "str":
+        return h5py.special_dtype(vlen=str)
+    return h5py.special_dtype(vlen=np.dtype(dtype))
+
+
+def arrow_type(name):
+    """pyarrow type of a field."""
+    import pyarrow as pa
+    kind, dtype = FIELD_DICT[name][1:3]
+    if dtype == "str":
+        valType = pa.string()
+    elif kind == "void":
+        valType = pa.binary(np.dtype(dtype).itemsize)
+    else:
+        valType = pa.from_numpy_dtype(np.dtype(dtype))
+    if kind == "array":
+        for _ in range(ARRAY_NDIM.get(name, 1)):
+            valType = pa.list_(valType)
+    return valType
+
+
+def arrow_schema(names=None):
+    """pyarrow schema of the given fields (default: all of them,
+    sorted by name), with units and descriptions as field metadata."""
+    import pyarrow as pa
+    if names is None:
+        names = sorted(FIELD_DICT.keys())
+    return pa.schema([pa.field(name, arrow_type(name),
+                               metadata={"Unit": unit(name),
+                                         "Information": description(name)})
+                      for name in names],
+                     metadata={"schema_version": str(SCHEMA_VERSION)})
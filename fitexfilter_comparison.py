@@ -0,0 +1,128 @@
+"""
+Regression comparison of median_filter with the fitexfilter binary of
+the RST.
+
+Filters a dmap file both with fitexfilter and with
+median_filter.boxcar_median_filter and compares the records, range
+gate by range gate:
+    python fitexfilter_comparison.py [fitacf file] [path to fitexfilter]
+Without a file, six hours of synthetic bks data (see synthetic_fitacf)
+are filtered. fitexfilter needs the SD_RADAR and SD_HDWPATH environment
+variables of the RST. The exit status is 1 if the outputs differ.
+"""
+
+import datetime as dt
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+from dmap_columns import ColumnBatch, read_dmap_columns
+from dmap_writer import write_dmap_records
+from median_filter import filter_dmap_columns
+from synthetic_fitacf import synthetic_records
+
+
+def compare_filtered(colBatch, refBatch,
+                     params=("v", "p_l", "w_l", "elv", "phi0", "v_e",
+                             "gflg")):
+    """Compares filtered records with reference ones (e.g. the output of
+    fitexfilter), matching records by time and beam.
+
+    Returns
+    -------
+    dict
+        nrec, nref and nmatched (records), cells (cells in the matched
+        records of refBatch), cell_agreement (fraction of those cells
+        also kept in colBatch), extra_cells (cells kept in colBatch
+        only) and, for each of params, the maximum absolute difference
+        over the cells kept in both.
+
+    """
+    def _keys(batch):
+        return np.round(batch.scalars["time"], 3) * 100 + \
+            batch.scalars["bmnum"]
+
+    keys, refKeys = _keys(colBatch), _keys(refBatch)
+    if np.array_equal(keys, refKeys):
+        # same records in the same order (repeated beams included)
+        idx = refIdx = np.arange(len(keys))
+    else:
+        common, idx, refIdx = np.intersect1d(keys, refKeys,
+                                             return_indices=True)
+    result = {"nrec": colBatch.nrec, "nref": refBatch.nrec,
+              "nmatched": len(idx), "cells": 0, "cell_agreement": 1.,
+              "extra_cells": 0}
+    nCommon = 0
+    diffs = dict((name, 0.) for name in params)
+    for i, j in zip(idx, refIdx):
+        gates = colBatch.row_array("slist", i)
+        refGates = refBatch.row_array("slist", j)
+        both, gi, rj = np.intersect1d(gates, refGates, return_indices=True)
+        result["cells"] += len(refGates)
+        result["extra_cells"] += len(gates) - len(both)
+        nCommon += len(both)
+        for name in params:
+            if name in colBatch.arrays and name in refBatch.arrays:
+                diff = np.abs(colBatch.row_array(name, i)[gi].astype(float) -
+                              refBatch.row_array(name, j)[rj])
+                if len(diff):
+                    diffs[name] = max(diffs[name], float(np.nanmax(diff)))
+    if result["cells"]:
+        result["cell_agreement"] = nCommon / float(result["cells"])
+    for name in params:
+        result["max_diff_" + name] = diffs[name]
+    return result
+
+
+def compare_with_fitexfilter(fname, path_to_filter="./fitexfilter",
+                             **kwargs):
+    """Filters an (uncompressed) dmap file both with fitexfilter and
+    with boxcar_median_filter and compares the results (see
+    compare_filtered). fitexfilter needs the SD_RADAR and SD_HDWPATH
+    environment variables of the RST."""
+    fd, ffname = tempfile.mkstemp(suffix=".fitacff")
+    os.close(fd)
+    try:
+        with open(ffname, "wb") as fp:
+            status = subprocess.call([path_to_filter, fname], stdout=fp)
+        if status != 0:
+            raise RuntimeError("{:s} failed with exit status {:d}".format(
+                path_to_filter, status))
+        ref = ColumnBatch.concat(list(read_dmap_columns(ffname)))
+    finally:
+        os.remove(ffname)
+    result = compare_filtered(filter_dmap_columns(fname, **kwargs), ref)
+    logging.info("comparison with fitexfilter: " + str(result))
+    return result
+
+
+def main(argv=None):
+    """Compares the outputs of boxcar_median_filter and fitexfilter,
+    printing the results; returns 0 if they are the same, 1 if not."""
+    argv = sys.argv[1:] if argv is None else argv
+    pathToFilter = argv[1] if len(argv) > 1 else "./fitexfilter"
+    if argv:
+        result = compare_with_fitexfilter(argv[0], pathToFilter)
+    else:
+        fd, fname = tempfile.mkstemp(suffix=".fitacf")
+        os.close(fd)
+        try:
+            write_dmap_records(synthetic_records(
+                "bks", dt.datetime(2012, 12, 5), dt.datetime(2012, 12, 5, 6)),
+                fname)
+            result = compare_with_fitexfilter(fname, pathToFilter)
+        finally:
+            os.remove(fname)
+    for key in sorted(result.keys()):
+        print("{:s}: {}".format(key, result[key]))
+    same = result["nrec"] == result["nref"] == result["nmatched"] and \
+        result["cell_agreement"] == 1. and result["extra_cells"] == 0 and \
+        all(result[key] == 0 for key in result if key.startswith("max_diff"))
+    print("same output as fitexfilter" if same else "OUTPUT DIFFERS")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
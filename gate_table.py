@@ -0,0 +1,104 @@
+"""
+Long-format (one row per range gate) tables of fitacf data.
+
+flatten_to_gates turns the per-beam ragged arrays of a ColumnBatch
+(v, p_l, ... indexed by slist) into flat columns with one value per
+range gate, repeating the per-beam scalars (time, bmnum, ...) over the
+gates with np.repeat. The result can be turned into a pandas
+DataFrame, a pyarrow Table or written to a Parquet file.
+"""
+
+import numpy as np
+
+
+def flatten_to_gates(colBatch, scalar_names=("time", "bmnum"),
+                     array_names=("slist", "v"), rename=None):
+    """Flattens records into one row per range gate.
+
+    Parameters
+    ----------
+    colBatch : dmap_columns.ColumnBatch
+        Records to flatten.
+    scalar_names : sequence of str
+        Per-record parameters, repeated for every gate of a record.
+    array_names : sequence of str
+        Range-gate parameters; all must have the same number of values
+        in each record (as the parameters indexed by slist do).
+    rename : Optional[dict]
+        Parameter name -> output column name.
+
+    Returns
+    -------
+    dict
+        Output column name -> 1-D numpy array, one value per gate.
+
+    Raises
+    ------
+    ValueError
+        If the array parameters have different lengths in a record.
+
+    """
+    rename = {} if rename is None else rename
+    array_names = list(array_names)
+    if not array_names:
+        raise ValueError("at least one array parameter is needed")
+    lens = None
+    for name in array_names:
+        if name in colBatch.arrays:
+            nameLens = colBatch.lengths(name)
+            if lens is None:
+                lens = nameLens
+            elif not np.array_equal(lens, nameLens):
+                raise ValueError("{:s} and {:s} have different lengths".format(
+                    name, array_names[0]))
+    if lens is None:
+        lens = np.zeros(colBatch.nrec, dtype=np.int64)
+    ngates = int(lens.sum())
+
+    table = {}
+    for name in scalar_names:
+        col = colBatch.scalars.get(name)
+        if col is None:
+            col = np.full(colBatch.nrec, np.nan)
+        table[rename.get(name, name)] = np.repeat(col, lens)
+    for name in array_names:
+        if name in colBatch.arrays:
+            values, offsets = colBatch.arrays[name]
+            # the gates of all the records, skipping any leading values
+            table[rename.get(name, name)] = values[offsets[0]:offsets[-1]]
+        else:
+            table[rename.get(name, name)] = np.full(ngates, np.nan)
+    return table
+
+
+def gates_to_dataframe(table, time_column="time"):
+    """pandas DataFrame of a flatten_to_gates table; time_column
+    (seconds since the epoch) is converted to datetime64."""
+    import pandas as pd
+    df = pd.DataFrame(table, columns=list(table.keys()))
+    if time_column in df.columns:
+        usec = np.round(df[time_column].values * 1e6).astype(np.int64)
+        df[time_column] = usec.astype("datetime64[us]")
+    return df
+
+
+def gates_to_arrow(table, time_column="time"):
+    """pyarrow Table of a flatten_to_gates table; time_column
+    (seconds since the epoch) is converted to a timestamp."""
+    import pyarrow as pa
+    columns = []
+    for name, values in table.items():
+        if name == time_column:
+            usec = np.round(values * 1e6).astype(np.int64)
+            columns.append(pa.array(usec, type=pa.timestamp("us")))
+        else:
+            columns.append(pa.array(values))
+    return pa.Table.from_arrays(columns, names=list(table.keys()))
+
+
+def write_gates_parquet(table, fname, time_column="time", **kwargs):
+    """Writes a flatten_to_gates table to a Parquet file.
+    **kwargs correspond to pyarrow.parquet.write_table()"""
+    import pyarrow.parquet as pq
+    pq.write_table(gates_to_arrow(table, time_column=time_column), fname,
+                   **kwargs)
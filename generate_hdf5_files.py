@@ -2,13 +2,16 @@
 Written by Xueling on 09/06/2018
 """
 
-from davitpy import pydarn
+import dmap_reader
+import dmap_columns
+import hdf5_reader
+import median_filter
+import fitacf_schema
 import datetime as dt
 import numpy as np
 import pandas 
 import h5py
 import os
-import ipdb
 import time
 
 class HDF5Converter(object):
@@ -33,270 +36,14 @@ class HDF5Converter(object):
 
     def get_param_dict(self):
         """
-        Parameter names and datatypes in a fitacf file
+        Parameter names and datatypes in a fitacf file,
+        from the shared fitacf_schema
         """
         colNamesDict = {}
-
-        # Downcasting some vars
-        colNamesDict["atten"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Attenuation level.",\
-									"Unit": " "}
-        colNamesDict["bmazm"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Beam azimuth.",\
-									"Unit": "degree"}
-        colNamesDict["bmnum"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Beam number.",\
-									"Unit": " "}
-        colNamesDict["channel"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Channel number for a stereo radar (zero for all others).",\
-									"Unit": " "}
-        colNamesDict["combf"] = {"dt": h5py.special_dtype(vlen=str),\
-									"Information": "Comment buffer.",\
-									"Unit": " "}
-        colNamesDict["cp"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Control program identifier.",\
-									"Unit": " "}
-        colNamesDict["ercod"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Error code.",\
-									"Unit": " "}
-        colNamesDict["fitacf.revision.major"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": "Major version number of the FitACF algorithm.",\
-									"Unit": " "}
-        colNamesDict["fitacf.revision.minor"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": "Minor version number of the FitACF algorithm.",\
-									"Unit": " "}
-        colNamesDict["frang"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Distance to first range.",\
-									"Unit": "kilometers"}
-        colNamesDict["gflg"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Ground scatter flag for ACF.",\
-									"Unit": " "}
-        colNamesDict["ifmode"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "if mode",\
-									"Unit": " "}
-        colNamesDict["intt.sc"] ={"dt":  h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Whole number of seconds of integration time.",\
-									"Unit": " "}
-        colNamesDict["intt.us"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": "Fractional number of microseconds of integration time.",\
-									"Unit": " "}
-        colNamesDict["lagfr"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": "Lag to first range.",\
-									"Unit": "microseconds"}
-        colNamesDict["ltab"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Lag table.",\
-									"Unit": " "}
-        colNamesDict["lvmax"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": "Maximum noise level allowed.",\
-									"Unit": " "}
-        colNamesDict["mpinc"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": "Multi-pulse increment.",\
-									"Unit": "microseconds"}
-        colNamesDict["mplgexs"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": " ",\
-									"Unit": " "}
-        colNamesDict["mplgs"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Number of lags in sequence.",\
-									"Unit": " "}
-        colNamesDict["mppul"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Number of pulses in sequence.",\
-									"Unit": " "}
-        colNamesDict["mxpwr"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": "Maximum power.",\
-									"Unit": "kHz"}
-        colNamesDict["nave"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Number of pulse sequences transmitted.",\
-									"Unit": " "}
-        colNamesDict["nlag"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Number of points in the fit.",\
-									"Unit": " "}
-        colNamesDict["noise.lag0"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Lag zero power of noise ACF.",\
-									"Unit": " "}
-        colNamesDict["noise.mean"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Average noise across frequency band.",\
-									"Unit": " "}
-        colNamesDict["noise.search"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Calculated noise from clear frequency search.",\
-									"Unit": " "}
-        colNamesDict["noise.sky"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Sky noise.",\
-									"Unit": " "}
-        colNamesDict["noise.vel"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Velocity from fitting the noise noise ACF.",\
-									"Unit": " "}
-        colNamesDict["nrang"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Number of ranges.",\
-									"Unit": " "}
-        colNamesDict["offset"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Offset between channels for a stereo radar (zero for all others).",\
-									"Unit": " "}
-        #colNamesDict["origin.code"] = h5py.special_dtype(vlen=str) #ValueError: VLEN strings do not support embedded NULLs
-        colNamesDict["origin.code"] = {"dt": np.dtype('V1'),\
-									"Information": "Code indicating origin of the data.",\
-									"Unit": " "}
-        colNamesDict["origin.command"] = {"dt": h5py.special_dtype(vlen=str),\
-									"Information": "The command line or control program used to generate the data.",\
-									"Unit": " "}
-        colNamesDict["origin.time"] = {"dt": h5py.special_dtype(vlen=str),\
-									"Information": "ASCII representation of when the data was generated.",\
-									"Unit": " "}
-        colNamesDict["p_l"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Power from lambda fit of ACF.",\
-									"Unit": " "}
-        colNamesDict["p_l_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Power error from lambda fit of ACF.",\
-									"Unit": " "}
-        colNamesDict["p_s"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Power from sigma fit of ACF.",\
-									"Unit": " "}
-        colNamesDict["p_s_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Powr error from sigma fit of ACF.",\
-									"Unit": " "}
-        colNamesDict["ptab"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Pulse table.",\
-									"Unit": " "}
-        colNamesDict["pwr0"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Lag zero power.",\
-									"Unit": " "}
-        colNamesDict["qflg"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Quality of fit flag for ACF.",\
-									"Unit": " "}
-        #colNamesDict["radar.revision.major"] = h5py.special_dtype(vlen=str)  #ValueError: VLEN strings do not support embedded NULLs
-        #colNamesDict["radar.revision.minor"] = h5py.special_dtype(vlen=str)  #ValueError: VLEN strings do not support embedded NULLs
-        colNamesDict["radar.revision.major"] =  {"dt": np.dtype('V1'),\
-									"Information": "Major version number of the radar operating system.",\
-									"Unit": " "}
-        colNamesDict["radar.revision.minor"] = {"dt":  np.dtype('V1'),\
-									"Information": "Minor version number of the radar operating system.",\
-									"Unit": " "}
-        colNamesDict["rsep"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Range separation.",\
-									"Unit": "kilometers"}
-        colNamesDict["rxrise"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Receiver rise time.",\
-									"Unit": "microseconds"}
-        colNamesDict["scan"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Scan flag.",\
-									"Unit": " "}
-        colNamesDict["sd_l"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Standard deviation of lambda fit.",\
-									"Unit": " "}
-        colNamesDict["sd_phi"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Standard deviation of phase fit of ACF.",\
-									"Unit": " "}
-        colNamesDict["sd_s"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Standard deviation of sigma fit.",\
-									"Unit": " "}
-        colNamesDict["slist"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "List of stored ranges.",\
-									"Unit": " "}
-        colNamesDict["smsep"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Sample separation",\
-									"Unit": "microseconds"}
-        colNamesDict["stat.agc"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "AGC status word.",\
-									"Unit": " "}
-        colNamesDict["stat.lopwr"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "LOPWR status word.",\
-									"Unit": " "}
-        colNamesDict["stid"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Station identifier.",\
-									"Unit": " "}
-        colNamesDict["tfreq"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": "Transmitted frequency.",\
-									"Unit": " "}
-        colNamesDict["time"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "time",\
-									"Unit": " "}
-        colNamesDict["txpl"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Transmit pulse length.",\
-									"Unit": "microseconds"}
-        colNamesDict["txpow"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": "Transmitted power.",\
-									"Unit": "kW"}
-        colNamesDict["v"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Velocity from ACF.",\
-									"Unit": "m/s"}
-        colNamesDict["v_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Velocity error from ACF.",\
-									"Unit": "m/s"}
-        colNamesDict["w_l"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Spectral width from lambda fit of ACF.",\
-									"Unit": "m/s"}
-        colNamesDict["w_l_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Spectral width error from lambda fit of ACF.",\
-									"Unit": "m/s"}
-        colNamesDict["w_s"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Spectral width from sigma fit of ACF.",\
-									"Unit": "m/s"}
-        colNamesDict["w_s_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Spectral width error from sigma fit of ACF.",\
-									"Unit": " "}
-        colNamesDict["xcf"] = {"dt": h5py.special_dtype(vlen=np.dtype('int32')),\
-									"Information": "XCF flag.",\
-									"Unit": " "}
-
-        colNamesDict["x_qflg"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Quality of fit flag for XCF.",\
-									"Unit": " "}
-        colNamesDict["x_gflg"] = {"dt": h5py.special_dtype(vlen=np.dtype('int16')),\
-									"Information": "Ground scatter flag for XCF.",\
-									"Unit": " "}
-        colNamesDict["x_p_l"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Power from lambda fit of XCF.",\
-									"Unit": " "}
-        colNamesDict["x_p_l_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Power error from lambda fit of XCF.",\
-									"Unit": " "}
-        colNamesDict["x_p_s"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Power from sigma fit of XCF.",\
-									"Unit": " "}
-        colNamesDict["x_p_s_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Power error from sigma fit of XCF.",\
-									"Unit": " "}
-        colNamesDict["x_v"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Velocity from XCF.",\
-									"Unit": " "}
-        colNamesDict["x_v_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Velocity error from XCF.",\
-									"Unit": " "}
-        colNamesDict["x_w_l"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Spectral width from lambda fit of XCF.",\
-									"Unit": " "}
-        colNamesDict["x_w_l_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Spectral width error from lambda fit of XCF.",\
-									"Unit": " "}
-        colNamesDict["x_w_s"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Spectral width from sigma fit of XCF.",\
-									"Unit": " "}
-        colNamesDict["x_w_s_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Spectral width error from sigma fit of XCF.",\
-									"Unit": " "}
-        colNamesDict["phi0"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Phase determination at lag zero of the ACF.",\
-									"Unit": " "}
-        colNamesDict["phi0_e"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Phase determination error at lag zero of the ACF.",\
-									"Unit": " "}
-        colNamesDict["elv"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Angle of arrival estimate.",\
-									"Unit": " "}
-        colNamesDict["elv_low"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Lowest estimate of angle of arrival.",\
-									"Unit": " "}
-        colNamesDict["elv_high"] ={"dt":  h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Highest estimat of angle of arrival.",\
-									"Unit": " "}
-        colNamesDict["x_sd_l"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Standard deviation of lambda fit of XCF.",\
-									"Unit": " "}
-        colNamesDict["x_sd_s"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Standard deviation of sigma fit of XCF.",\
-									"Unit": " "}
-        colNamesDict["x_sd_phi"] = {"dt": h5py.special_dtype(vlen=np.dtype('f')),\
-									"Information": "Standard deviation of phase fit of XCF.",\
-									"Unit": " "}
+        for column in fitacf_schema.FIELD_DICT.keys():
+            colNamesDict[column] = {"dt": fitacf_schema.hdf5_dtype(column),\
+                                    "Information": fitacf_schema.description(column),\
+                                    "Unit": fitacf_schema.unit(column)}
 
         return colNamesDict
 
@@ -306,7 +53,7 @@ class HDF5Converter(object):
         3 numpy void colNames in a fitacf file
         """
 
-        void_colNames = ["origin.code","radar.revision.major","radar.revision.minor"]
+        void_colNames = list(fitacf_schema.VOID_NAMES)
 
         return void_colNames
 
@@ -316,13 +63,7 @@ class HDF5Converter(object):
         42 Scalar_colNames in a fitacf file
         """
 
-        scalar_colNames = ["atten","bmazm","bmnum","channel","combf","cp","ercod","fitacf.revision.major",\
-							"fitacf.revision.minor","frang","ifmode","intt.sc","intt.us","lagfr","lvmax",\
-							"mpinc","mplgexs","mplgs","mppul","mxpwr","nave","noise.lag0","noise.mean",\
-							"noise.search","noise.sky","noise.vel","nrang","offset",\
-							"origin.command","origin.time",\
-							"rsep","rxrise","scan","smsep","stat.agc","stat.lopwr","stid","tfreq","time",\
-							"txpl","txpow","xcf"]
+        scalar_colNames = list(fitacf_schema.SCALAR_NAMES)
 
         return scalar_colNames
 
@@ -332,19 +73,23 @@ class HDF5Converter(object):
         40 Array_colNames in a fitacf file
         """
 
-        array_colNames = ["gflg","ltab","nlag","p_l","p_l_e","p_s","p_s_e","ptab","pwr0","qflg",\
-							"sd_l","sd_phi","sd_s","slist","v","v_e","w_l","w_l_e","w_s","w_s_e",\
-							"x_qflg","x_gflg","x_p_l","x_p_l_e","x_p_s","x_p_s_e","x_v","x_v_e",\
-							"x_w_l","x_w_l_e","x_w_s","x_w_s_e","phi0","phi0_e","elv","elv_low",\
-							"elv_high","x_sd_l","x_sd_s","x_sd_phi"]
+        array_colNames = list(fitacf_schema.ARRAY_NAMES)
 
         return array_colNames
 
 
-    def get_dmap_dicts(self, filtered=False):
+    def get_dmap_dicts(self, filtered=False, fname=None):
         """
-        Get a list of dictionaries from dmap files
+        Get a list of dictionaries from dmap files.
+        If fname (an uncompressed dmap file) is given it is
+        read with the native reader instead of davitpy.
         """
+        if fname is not None:
+            recAll = list(dmap_reader.read_dmap_records(fname,
+                        stime=self.startTime, etime=self.endTime))
+            return recAll if recAll else None
+
+        from davitpy import pydarn
         f = pydarn.sdio.radDataOpen(self.startTime, self.inpRad,
                     self.endTime, filtered=filtered,
                     fileType=self.ftype)
@@ -355,16 +100,46 @@ class HDF5Converter(object):
         return None
 
 
-    def create_hdf5_file(self, fitData, FileName, **kwargs):
+    def get_filtered_columns(self, fname, **kwargs):
+        """
+        Read a dmap file (or a dmap_streams.VirtualDay) natively and
+        boxcar median filter it in memory (instead of with fitexfilter).
+        Returns a dmap_columns.ColumnBatch; **kwargs correspond to
+        median_filter.boxcar_median_filter().
+        """
+        colBatch = median_filter.filter_dmap_columns(fname,
+                        stime=self.startTime, etime=self.endTime, **kwargs)
+        return colBatch if colBatch.nrec > 0 else None
+
+
+    def create_hdf5_file(self, fitData, FileName, bulk=True,
+                         chunkSize=10000, layout="vlen", index=False,
+                         **kwargs):
         """
         Create a hdf5 file from the list of dicts (fitdata).
+        If bulk is True, each column is built in memory chunkSize
+        records at a time and written with a single slice assignment
+        per chunk; otherwise data are written cell by cell.
+        layout="flat" writes the flat ragged-array layout instead
+        of vlen datasets (see create_flat_hdf5_file).
+        If index is True the time and beam indexes of
+        hdf5_reader.write_index (and an nrec attribute) are added;
+        otherwise a vlen file holds only the columns, as it always has.
         """
+        if layout == "flat":
+            if fitData is not None:
+                colBatch = dmap_columns.records_to_columns(fitData)
+                self.create_flat_hdf5_file(colBatch, FileName,
+                                           chunkSize=chunkSize, index=index,
+                                           **kwargs)
+            return
+
         if fitData is not None:
             # get parameter names from the datadict
             colNames = set()
             for row in fitData:
-            	names = set(row.keys())
-            	colNames = colNames.union(names)
+                names = set(row.keys())
+                colNames = colNames.union(names)
             colNames = sorted(list(colNames))
 
             #create datasets
@@ -373,26 +148,241 @@ class HDF5Converter(object):
             f = h5py.File(FileName, "w")
 
             for column in colNames:
-            	#print column
-            	tmp_dset = f.create_dataset(column, (num_rec,), dtype=self._paramDict_[column]["dt"], **kwargs)
-            	tmp_dset.attrs['Information'] = self._paramDict_[column]["Information"]
-            	tmp_dset.attrs['Unit'] = self._paramDict_[column]["Unit"]
+                #print column
+                tmp_dset = f.create_dataset(column, (num_rec,), dtype=self._paramDict_[column]["dt"], **kwargs)
+                tmp_dset.attrs['Information'] = self._paramDict_[column]["Information"]
+                tmp_dset.attrs['Unit'] = self._paramDict_[column]["Unit"]
+
+            scalarCols = set(self._scalar_colNames_)
+            arrayCols = set(self._array_colNames_)
+            voidCols = set(self._void_colNames_)
 
             #Read data into datasets
-            for nr,row in enumerate(fitData):
-            	#print nr
-            	#ipdb.set_trace()
-            	for column in colNames:
-					if column in self._scalar_colNames_:
-						f[column][nr] = [row.get(column)] #[] if row.get(column) is None else [row.get(column)]
+            if bulk:
+                for nStart in range(0, num_rec, chunkSize):
+                    rows = fitData[nStart:nStart+chunkSize]
+                    for column in colNames:
+                        chunk = self._get_column_chunk(rows, column,
+                                    scalarCols, arrayCols, voidCols)
+                        if chunk is not None:
+                            f[column].write_direct(chunk,
+                                dest_sel=np.s_[nStart:nStart+len(rows)])
+            else:
+                for nr,row in enumerate(fitData):
+                    for column in colNames:
+                        if column in scalarCols:
+                            f[column][nr] = [row.get(column)] #[] if row.get(column) is None else [row.get(column)]
+
+                        if column in arrayCols:
+                            f[column][nr] = [] if row.get(column) is None else np.array(row.get(column)).ravel()
+
+                        if column in voidCols:
+                            f[column][nr] =  np.void(row.get(column))
+
+            if index:
+                f.attrs["nrec"] = num_rec
+                hdf5_reader.write_index(f)
+            f.close()
 
-					if column in self._array_colNames_:
-						f[column][nr] = [] if row.get(column) is None else np.array(row.get(column)).ravel()
 
-					if column in self._void_colNames_:
-						f[column][nr] =  np.void(row.get(column))
+    def _get_column_chunk(self, rows, column, scalarCols, arrayCols, voidCols):
+        """
+        Build the values of one column for a chunk of
+        rows, in the form create_hdf5_file writes them.
+        """
+        dtype = self._paramDict_[column]["dt"]
+        if column in voidCols:
+            return np.array([np.void(row.get(column)) for row in rows],
+                            dtype=dtype)
+
+        baseType = h5py.check_dtype(vlen=dtype)
+        chunk = np.empty(len(rows), dtype=object)
+        if column in scalarCols:
+            if baseType is str or baseType is bytes:
+                chunk[:] = [row.get(column) for row in rows]
+            else:
+                for nr,row in enumerate(rows):
+                    chunk[nr] = np.array([row.get(column)], dtype=baseType)
+        elif column in arrayCols:
+            for nr,row in enumerate(rows):
+                val = row.get(column)
+                chunk[nr] = np.array([] if val is None else val,
+                                     dtype=baseType).ravel()
+        else:
+            return None
+        return chunk
+
+
+    def create_flat_hdf5_file(self, colBatch, FileName, chunkSize=10000,
+                              index=True, **kwargs):
+        """
+        Create a hdf5 file with the flat ragged-array layout from a
+        dmap_columns.ColumnBatch.
+        Scalars are written as fixed-dtype 1-D datasets. Each array
+        parameter (v, p_l, slist, ...) is written as a group holding
+        a flat "values" dataset and an int64 "offsets" dataset of
+        length nrec+1; the values of record i are
+        values[offsets[i]:offsets[i+1]].
+        All datasets are chunked (chunkSize) and gzip compressed unless
+        other compression options are given in **kwargs.
+        If index is True the time and beam indexes of
+        hdf5_reader.write_index are added.
+        """
+        f = h5py.File(FileName, "w")
+        f.attrs["layout"] = "flat"
+        f.attrs["nrec"] = 0
+        self._append_flat_columns(f, colBatch, chunkSize=chunkSize, **kwargs)
+        if index:
+            hdf5_reader.write_index(f)
+        f.close()
+
+
+    def create_hdf5_file_stream(self, records, FileName, layout="flat",
+                                batchSize=10000, chunkSize=10000, index=True,
+                                **kwargs):
+        """
+        Create a hdf5 file from an iterator of dicts, e.g.,
+        dmap_reader.read_dmap_records(fname), without loading all the
+        records first. Datasets are created resizable (maxshape=(None,))
+        and chunked, and records are appended batchSize at a time, so
+        memory use does not grow with the number of records.
+        layout is "flat" (see create_flat_hdf5_file) or "vlen"
+        (the layout of create_hdf5_file).
+        If index is True the time and beam indexes of
+        hdf5_reader.write_index are added once all records are written.
+        Returns the number of records written.
+        """
+        f = h5py.File(FileName, "w")
+        f.attrs["layout"] = layout
+        f.attrs["nrec"] = 0
+        rows = []
+        for row in records:
+            rows.append(row)
+            if len(rows) >= batchSize:
+                self._append_rows(f, rows, layout, chunkSize, **kwargs)
+                rows = []
+        if rows:
+            self._append_rows(f, rows, layout, chunkSize, **kwargs)
+        nrec = int(f.attrs["nrec"])
+        if index:
+            hdf5_reader.write_index(f)
+        f.close()
+        return nrec
+
+
+    def _append_rows(self, f, rows, layout, chunkSize, **kwargs):
+        """
+        Append a list of dicts to an open hdf5 file of the given layout.
+        """
+        if layout == "flat":
+            self._append_flat_columns(f, dmap_columns.records_to_columns(rows),
+                                      chunkSize=chunkSize, **kwargs)
+        else:
+            self._append_vlen_rows(f, rows, chunkSize=chunkSize, **kwargs)
 
-            f.close()
+
+    def _append_vlen_rows(self, f, rows, chunkSize=10000, **kwargs):
+        """
+        Append a list of dicts to an open hdf5 file with the vlen layout,
+        creating resizable datasets for columns seen for the first time.
+        """
+        nOld = int(f.attrs["nrec"])
+        nNew = nOld + len(rows)
+        colNames = set()
+        for row in rows:
+            colNames.update(row.keys())
+        colNames = sorted(list(colNames))
+
+        for column in colNames:
+            if column not in f:
+                tmp_dset = f.create_dataset(column, (nOld,), dtype=self._paramDict_[column]["dt"],
+                                            maxshape=(None,), chunks=(chunkSize,), **kwargs)
+                self._set_column_attrs(tmp_dset, column)
+        for column in f.keys():
+            f[column].resize((nNew,))
+
+        scalarCols = set(self._scalar_colNames_)
+        arrayCols = set(self._array_colNames_)
+        voidCols = set(self._void_colNames_)
+        for column in colNames:
+            chunk = self._get_column_chunk(rows, column,
+                        scalarCols, arrayCols, voidCols)
+            if chunk is not None:
+                f[column].write_direct(chunk, dest_sel=np.s_[nOld:nNew])
+
+        f.attrs["nrec"] = nNew
+
+
+    def _append_flat_columns(self, f, colBatch, chunkSize=10000, **kwargs):
+        """
+        Append a ColumnBatch to an open hdf5 file with the flat layout,
+        creating (resizable) datasets for columns seen for the first time.
+        """
+        if "compression" not in kwargs:
+            kwargs["compression"] = "gzip"
+            kwargs.setdefault("shuffle", True)
+        nOld = int(f.attrs["nrec"])
+        nNew = nOld + colBatch.nrec
+
+        for column, col in colBatch.scalars.items():
+            if column not in f:
+                if col.dtype.kind == "O":
+                    dtype = h5py.special_dtype(vlen=str)
+                    fill = {}
+                else:
+                    dtype = col.dtype
+                    fill = {} if col.dtype.kind == "V" else\
+                           {"fillvalue": dmap_columns.fill_value(col.dtype)}
+                dset = f.create_dataset(column, (nOld,), dtype=dtype,
+                                        maxshape=(None,), chunks=(chunkSize,),
+                                        **dict(kwargs, **fill))
+                self._set_column_attrs(dset, column)
+            dset = f[column]
+            dset.resize((nNew,))
+            dset[nOld:nNew] = col
+
+        for column, (values, offsets) in colBatch.arrays.items():
+            if column not in f:
+                grp = f.create_group(column)
+                self._set_column_attrs(grp, column)
+                if column in colBatch.shapes:
+                    grp.attrs["shape"] = colBatch.shapes[column]
+                grp.create_dataset("values", (0,), dtype=values.dtype,
+                                   maxshape=(None,), chunks=(chunkSize,),
+                                   **kwargs)
+                grp.create_dataset("offsets", data=np.zeros(nOld+1, dtype=np.int64),
+                                   maxshape=(None,), chunks=(chunkSize,),
+                                   **kwargs)
+            valDset = f[column]["values"]
+            offDset = f[column]["offsets"]
+            nVal = valDset.shape[0]
+            valDset.resize((nVal+values.size,))
+            valDset[nVal:] = values
+            offDset.resize((nNew+1,))
+            offDset[nOld+1:] = offsets[1:] + nVal
+
+        # columns already in the file but absent from this batch
+        for column in f.keys():
+            if isinstance(f[column], h5py.Group):
+                offDset = f[column]["offsets"]
+                nOff = offDset.shape[0]
+                if nOff < nNew+1:
+                    nVal = offDset[nOff-1]
+                    offDset.resize((nNew+1,))
+                    offDset[nOff:] = nVal
+            elif f[column].shape[0] < nNew:
+                f[column].resize((nNew,))
+
+        f.attrs["nrec"] = nNew
+
+
+    def _set_column_attrs(self, obj, column):
+        """
+        Copy Information and Unit of a column to a dataset/group.
+        """
+        if column in self._paramDict_:
+            obj.attrs['Information'] = self._paramDict_[column]["Information"]
+            obj.attrs['Unit'] = self._paramDict_[column]["Unit"]
 
 
 if __name__ == "__main__":
@@ -410,5 +400,5 @@ if __name__ == "__main__":
     Obj.create_hdf5_file(fData, outFile)
     t1 = time.time()
 
-    print t1-t0
-    print 'Done on '+sTime.strftime("%Y%m%d")+" for the "+rad+" radar!"
+    print(t1-t0)
+    print('Done on '+sTime.strftime("%Y%m%d")+" for the "+rad+" radar!")
@@ -1,7 +1,10 @@
 import pyarrow as pa
 import pandas 
 import numpy
-from davitpy import pydarn
+import dmap_reader
+import dmap_columns
+import median_filter
+import fitacf_schema
 import datetime
 import os
 
@@ -22,56 +25,26 @@ class ParquetConverter(object):
 
     def get_schema_dict(self):
         """
-        Get colNames for A FEW fields
-        NOTE : Some fields are given default
-        colNames, i.e., whatever is assigned by pyarrow
+        Get the pyarrow types of all the fields
+        in a fitacf file, from the shared fitacf_schema
         """
         colNamesDict = {}
-        # Downcasting some vars
-        colNamesDict["atten"] = pa.int16()
-        colNamesDict["bmnum"] = pa.int16()
-        colNamesDict["bmnum"] = pa.int16()
-        colNamesDict["cp"] = pa.int16()
-        colNamesDict["ercod"] = pa.int16()
-        colNamesDict["fitacf.revision.major"] = pa.int32()
-        colNamesDict["fitacf.revision.minor"] = pa.int32()
-        colNamesDict["frang"] = pa.int16()
-        colNamesDict["gflg"] = pa.list_(pa.int16())
-        colNamesDict["ifmode"] = pa.int16()
-        colNamesDict["intt.sc"] = pa.int16()
-        colNamesDict["intt.us"] = pa.int32()
-        colNamesDict["lagfr"] = pa.int32()
-        colNamesDict["lagfr"] = pa.int32()
-        colNamesDict["ltab"] = pa.list_(pa.list_(pa.int16()))
-        colNamesDict["lvmax"] = pa.int32()
-        colNamesDict["mpinc"] = pa.int32()
-        colNamesDict["mplgexs"] = pa.int32()
-        colNamesDict["mplgs"] = pa.int16()
-        colNamesDict["mppul"] = pa.int16()
-        colNamesDict["nave"] = pa.int16()
-        colNamesDict["nlag"] = pa.list_(pa.int16())
-        colNamesDict["nrang"] = pa.int16()
-        colNamesDict["offset"] = pa.int16()
-        colNamesDict["ptab"] = pa.list_(pa.int16())
-        colNamesDict["qflg"] = pa.list_(pa.int16())
-        colNamesDict["rsep"] = pa.int16()
-        colNamesDict["rxrise"] = pa.int16()
-        colNamesDict["scan"] = pa.int16()
-        colNamesDict["slist"] = pa.list_(pa.int16())
-        colNamesDict["smsep"] = pa.int16()
-        colNamesDict["stat.agc"] = pa.int16()
-        colNamesDict["stat.lopwr"] = pa.int16()
-        colNamesDict["stid"] = pa.int16()
-        colNamesDict["tfreq"] = pa.int32()
-        colNamesDict["txpl"] = pa.int16()
-        colNamesDict["txpow"] = pa.int32()
-        colNamesDict["xcf"] = pa.int32()
+        for column in fitacf_schema.FIELD_DICT.keys():
+            colNamesDict[column] = fitacf_schema.arrow_type(column)
         return colNamesDict
 
-    def get_dmap_dicts(self, filtered=False):
+    def get_dmap_dicts(self, filtered=False, fname=None):
         """
-        Get a list of dictionaries from dmap files
+        Get a list of dictionaries from dmap files.
+        If fname (an uncompressed dmap file) is given it is
+        read with the native reader instead of davitpy.
         """
+        if fname is not None:
+            recAll = list(dmap_reader.read_dmap_records(fname,
+                        stime=self.startTime, etime=self.endTime))
+            return recAll if recAll else None
+
+        from davitpy import pydarn
         f = pydarn.sdio.radDataOpen(self.startTime, self.inpRad,
                     self.endTime, filtered=filtered,
                     fileType=self.ftype)
@@ -81,6 +54,17 @@ class ParquetConverter(object):
                 return [ rec.recordDict for rec in recAll]
         return None
 
+    def get_filtered_columns(self, fname, **kwargs):
+        """
+        Read a dmap file (or a dmap_streams.VirtualDay) natively and
+        boxcar median filter it in memory (instead of with fitexfilter).
+        Returns a dmap_columns.ColumnBatch; **kwargs correspond to
+        median_filter.boxcar_median_filter().
+        """
+        colBatch = median_filter.filter_dmap_columns(fname,
+                        stime=self.startTime, etime=self.endTime, **kwargs)
+        return colBatch if colBatch.nrec > 0 else None
+
     def get_dicts_csv(self):
         import dmap_to_csv
         import csv_to_dict
@@ -96,8 +80,13 @@ class ParquetConverter(object):
     def json_to_pyarrow_table(self, fitData, useSchemaDict=True):
         """
         Convert the list of dicts (fitdata)
-        into pyarrow table!
+        into pyarrow table! With useSchemaDict the
+        table is built column by column with the fixed
+        schema (see records_to_pyarrow_table), otherwise
+        the types are inferred from the values.
         """
+        if useSchemaDict:
+            return self.records_to_pyarrow_table(fitData)
         # get pyarrow record batches from the datadict
         colNames = set()
         for row in fitData:
@@ -112,16 +101,8 @@ class ParquetConverter(object):
                 _col.append(row.get(column))
                 colFitData[column] = _col
 
-        if useSchemaDict:
-            for column in colNames:
-                _col = colFitData.get(column)
-                if column in self._schemaDict_.keys():
-                    arrFitData.append( pa.array(_col, type= self._schemaDict_[column] ) )
-                else:
-                    arrFitData.append( pa.array(_col) )
-        else:
-            for column in colNames:
-                arrFitData.append( pa.array(colFitData.get(column)) )
+        for column in colNames:
+            arrFitData.append( pa.array(colFitData.get(column)) )
         outRecBatch = pa.RecordBatch.from_arrays(arrFitData, colNames)
         # write to a pyarrow table
         try:
@@ -130,6 +111,95 @@ class ParquetConverter(object):
             table = pa.Table.from_batches([outRecBatch])
         return table
 
+    def get_arrow_schema(self):
+        """
+        Fixed pyarrow schema covering every fitacf column,
+        so that no type inference is needed.
+        """
+        return fitacf_schema.arrow_schema()
+
+    def columns_to_record_batch(self, colBatch, schema=None):
+        """
+        Convert a dmap_columns.ColumnBatch into a pyarrow RecordBatch
+        with the given (default: get_arrow_schema) schema, building the
+        arrays straight from the numpy buffers. Columns missing from
+        colBatch are all-null, as are integer scalars that were
+        missing from a record.
+        """
+        if schema is None:
+            schema = self.get_arrow_schema()
+        arrFitData = []
+        for field in schema:
+            column = field.name
+            if column in colBatch.scalars:
+                arrFitData.append(self._scalar_to_arrow(\
+                        colBatch.scalars[column], field.type))
+            elif column in colBatch.arrays:
+                values, offsets = colBatch.arrays[column]
+                arrFitData.append(self._list_to_arrow(values, offsets,\
+                        field.type, colBatch.shapes.get(column)))
+            else:
+                arrFitData.append(pa.nulls(colBatch.nrec, type=field.type))
+        return pa.RecordBatch.from_arrays(arrFitData, schema=schema)
+
+    def _scalar_to_arrow(self, col, paType):
+        """
+        pyarrow array of a scalar column (a 1-D numpy array)
+        """
+        if col.dtype.kind == "V":
+            arr = pa.Array.from_buffers(pa.binary(col.dtype.itemsize),\
+                    len(col), [None, pa.py_buffer(col.tobytes())])
+            return arr.cast(paType)
+        mask = None
+        if col.dtype.kind == "i":
+            mask = col == dmap_columns.fill_value(col.dtype)
+        return pa.array(col, mask=mask).cast(paType)
+
+    def _list_to_arrow(self, values, offsets, paType, shape=None):
+        """
+        pyarrow list array from flat values and offsets.
+        A list of lists type (e.g., ltab) is rebuilt using
+        the trailing shape of the values.
+        """
+        valType = paType.value_type
+        if pa.types.is_list(valType):
+            width = int(numpy.prod(shape)) if shape else 1
+            innerOffsets = numpy.arange(0, len(values) + 1, width)
+            inner = pa.ListArray.from_arrays(\
+                    pa.array(innerOffsets.astype(numpy.int32)),\
+                    pa.array(values).cast(valType.value_type))
+            return pa.ListArray.from_arrays(\
+                    pa.array((offsets // width).astype(numpy.int32)), inner)
+        return pa.ListArray.from_arrays(pa.array(offsets.astype(numpy.int32)),\
+                    pa.array(values).cast(valType))
+
+    def iter_record_batches(self, records, batchSize=10000):
+        """
+        Yield pyarrow RecordBatches of at most batchSize records
+        (all with the same schema) from an iterator of dicts, e.g.,
+        dmap_reader.read_dmap_records(fname).
+        """
+        schema = self.get_arrow_schema()
+        rows = []
+        for row in records:
+            rows.append(row)
+            if len(rows) >= batchSize:
+                yield self.columns_to_record_batch(\
+                        dmap_columns.records_to_columns(rows), schema)
+                rows = []
+        if rows:
+            yield self.columns_to_record_batch(\
+                    dmap_columns.records_to_columns(rows), schema)
+
+    def records_to_pyarrow_table(self, records, batchSize=10000):
+        """
+        Convert an iterator of dicts into a pyarrow table
+        with the fixed schema of get_arrow_schema.
+        """
+        return pa.Table.from_batches(\
+                list(self.iter_record_batches(records, batchSize)),\
+                schema=self.get_arrow_schema())
+
     def create_parquet_file(self, inpTable, parquetFileName, **kwargs):
         """
         Create a parquet file from a pyarrow table
@@ -138,6 +208,56 @@ class ParquetConverter(object):
         import pyarrow.parquet as pq
         pq.write_table(inpTable, parquetFileName, **kwargs)
 
+    def create_parquet_file_stream(self, recBatches, parquetFileName,
+                                   rowGroupSize=50000,
+                                   useDictionary=None, **kwargs):
+        """
+        Write an iterator of pyarrow RecordBatches (e.g. from
+        iter_record_batches) to a parquet file through an open
+        ParquetWriter, one row group per rowGroupSize records.
+        Records are expected in time order, so the min/max statistics
+        of the time column of each row group let readers skip row
+        groups by time. Columns in useDictionary (default: bmnum, cp,
+        channel, stid) are dictionary encoded.
+        **kwargs correspond to pyarrow.parquet.ParquetWriter()
+        Returns the number of records written.
+        """
+        import pyarrow.parquet as pq
+        if useDictionary is None:
+            useDictionary = ["bmnum", "cp", "channel", "stid"]
+        kwargs.setdefault("write_statistics", True)
+        writer = None
+        pending = []
+        nPending = 0
+        nrec = 0
+        try:
+            for recBatch in recBatches:
+                if writer is None:
+                    writer = pq.ParquetWriter(parquetFileName, recBatch.schema,\
+                                use_dictionary=useDictionary, **kwargs)
+                pending.append(recBatch)
+                nPending += recBatch.num_rows
+                if nPending >= rowGroupSize:
+                    # write every full row group, keep the rest pending
+                    table = pa.Table.from_batches(pending)
+                    offset = 0
+                    while nPending >= rowGroupSize:
+                        writer.write_table(\
+                                table.slice(offset, rowGroupSize),\
+                                row_group_size=rowGroupSize)
+                        offset += rowGroupSize
+                        nrec += rowGroupSize
+                        nPending -= rowGroupSize
+                    pending = table.slice(offset).to_batches()
+            if nPending > 0:
+                writer.write_table(pa.Table.from_batches(pending),\
+                                   row_group_size=rowGroupSize)
+                nrec += nPending
+        finally:
+            if writer is not None:
+                writer.close()
+        return nrec
+
 
 if __name__ == "__main__":
     sTime = datetime.datetime(2017,12,2)
@@ -146,9 +266,9 @@ if __name__ == "__main__":
     pqObj = ParquetConverter(sTime, eTime, radSel)
     fData = pqObj.get_dmap_dicts()
     # fData = pqObj.get_dicts_csv()
-    paTab = pqObj.json_to_pyarrow_table(fData)
     outParquetFile = "/home/bharat/Documents/data/fit_cmpr_formats/pq/" +\
                     sTime.strftime("%Y%m%d") + radSel + ".parquet"
-    pqObj.create_parquet_file(paTab, outParquetFile,\
-             compression='brotli',version="2.0")
-    print paTab
\ No newline at end of file
+    nrec = pqObj.create_parquet_file_stream(\
+             pqObj.iter_record_batches(fData), outParquetFile,\
+             compression='brotli')
+    print("{:d} records written to {:s}".format(nrec, outParquetFile))
@@ -0,0 +1,276 @@
+"""
+Time and beam indexes of the HDF5 files written by HDF5Converter, and a
+reader that uses them.
+
+write_index adds an "index" group to a file of either layout (vlen or
+flat) holding
+  - "time": the int64 record times (microseconds since the epoch),
+    sorted, with "order" the record numbers in that order;
+  - "beams/<bmnum>": the increasing record numbers of each beam.
+HDF5Reader binary searches the sorted times for a time window,
+intersects the result with the beam indexes, and reads only the rows
+of the selected records instead of parsing every timestamp.
+"""
+
+import h5py
+import numpy as np
+import dmap_columns
+from dmap_reader import datetime_to_epoch
+from fitacf_schema import COLUMN_DTYPES, ARRAY_NAMES, VOID_NAMES
+
+INDEX_GROUP = "index"
+
+# Trailing shape of the multi-dimensional arrays, which are stored
+# flattened in vlen layout files
+VLEN_SHAPES = {"ltab": (2,)}
+
+# Selected rows are read with a point selection when they are fewer
+# than these fractions of the rows they span, else as that span: vlen
+# cells are decoded one by one, while the chunks of fixed size datasets
+# decompress faster than h5py selects points
+VLEN_FRACTION = 0.5
+FIXED_FRACTION = 1. / 64
+# The values of flat array columns are read run by run (of consecutive
+# records) up to this number of runs, else as the span of values from
+# the first to the last selected record
+MAX_RUNS = 32
+
+
+def _layout(f):
+    """Layout of an open hdf5 file ("vlen" for files without the
+    layout attribute, written by create_hdf5_file)."""
+    layout = f.attrs.get("layout", "vlen")
+    if isinstance(layout, bytes):
+        layout = layout.decode("utf-8")
+    return layout
+
+
+def _vlen_scalars(cells, dtype):
+    """1-D array of the first value of each vlen cell (scalars are
+    stored as one element arrays), fill_value for empty cells."""
+    col = np.full(len(cells), dmap_columns.fill_value(dtype), dtype=dtype)
+    for i, cell in enumerate(cells):
+        if len(cell) > 0:
+            col[i] = cell[0]
+    return col
+
+
+def _vlen_arrays(cells, dtype):
+    """(values, offsets) of a vlen array column."""
+    lens = np.array([len(cell) for cell in cells], dtype=np.int64)
+    offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+    np.cumsum(lens, out=offsets[1:])
+    if offsets[-1] > 0:
+        values = np.concatenate([np.asarray(c) for c in cells if len(c) > 0])
+    else:
+        values = np.zeros(0)
+    return values.astype(dtype, copy=False), offsets
+
+
+def _decode(cells):
+    """Object array of str from vlen string cells (bytes in h5py 3)."""
+    return np.array([c.decode("utf-8") if isinstance(c, bytes) else c
+                     for c in cells], dtype=object)
+
+
+def _read_rows(ds, index):
+    """Rows of a dataset at an increasing index array, read with a
+    point selection when sparse (see VLEN_FRACTION, FIXED_FRACTION)."""
+    start, stop = int(index[0]), int(index[-1]) + 1
+    fraction = VLEN_FRACTION if ds.dtype.kind == "O" else FIXED_FRACTION
+    if len(index) < fraction * (stop - start):
+        return ds[index]
+    return ds[start:stop][index - start]
+
+
+def read_scalar_column(f, name, start=0, stop=None):
+    """Values of a scalar column of an open hdf5 file (of either
+    layout) for records start:stop, as a 1-D numpy array."""
+    return _scalar_values(f, name, f[name][start:stop])
+
+
+def _scalar_values(f, name, data):
+    """1-D numpy array of the values of a scalar column from the rows
+    of its dataset."""
+    dtype = COLUMN_DTYPES.get(name)
+    if _layout(f) == "flat" or name in VOID_NAMES:
+        return _decode(data) if data.dtype.kind == "O" else data
+    if dtype is None or dtype.kind == "O":
+        return _decode([c[0] if not isinstance(c, (str, bytes)) else c
+                        for c in data])
+    return _vlen_scalars(data, dtype)
+
+
+def write_index(f):
+    """Adds (or replaces) the time and beam indexes of an open
+    hdf5 file of either layout."""
+    if INDEX_GROUP in f:
+        del f[INDEX_GROUP]
+    grp = f.create_group(INDEX_GROUP)
+    nrec = int(f.attrs["nrec"]) if "nrec" in f.attrs else f["time"].shape[0]
+    if nrec == 0 or "time" not in f:
+        usec = np.zeros(0, dtype=np.int64)
+    else:
+        usec = np.round(read_scalar_column(f, "time") * 1e6).astype(np.int64)
+    order = np.argsort(usec, kind="mergesort")
+    dset = grp.create_dataset("time", data=usec[order])
+    dset.attrs["Unit"] = "microseconds since 1970-01-01"
+    grp.create_dataset("order", data=order.astype(np.int64))
+    beams = grp.create_group("beams")
+    if nrec > 0 and "bmnum" in f:
+        bmnum = read_scalar_column(f, "bmnum")
+        for beam in np.unique(bmnum):
+            beams.create_dataset(str(int(beam)),
+                                 data=np.flatnonzero(bmnum == beam))
+
+
+class HDF5Reader(object):
+    """
+    Reads time windows and beams of an hdf5 file written by
+    HDF5Converter (vlen or flat layout).
+    """
+
+    def __init__(self, fname):
+        """
+        Parameters
+        ----------
+        fname : str
+            Full path of the hdf5 file.
+        """
+        self.fname = fname
+        self.f = h5py.File(fname, "r")
+        self.layout = _layout(self.f)
+
+    def close(self):
+        """Close the file."""
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def has_index(self):
+        """True if the file has time and beam indexes."""
+        return INDEX_GROUP in self.f
+
+    def column_names(self):
+        """Names of the columns in the file."""
+        return sorted(name for name in self.f.keys() if name != INDEX_GROUP)
+
+    def select(self, stime=None, etime=None, beams=None):
+        """
+        Increasing numbers of the records in [stime, etime] (both
+        included) of the given beams. Files without indexes are
+        scanned.
+        """
+        if not self.has_index():
+            times = read_scalar_column(self.f, "time")
+            mask = np.ones(len(times), dtype=bool)
+            if stime is not None:
+                mask &= times >= datetime_to_epoch(stime)
+            if etime is not None:
+                mask &= times <= datetime_to_epoch(etime)
+            if beams is not None:
+                mask &= np.isin(read_scalar_column(self.f, "bmnum"),
+                                list(beams))
+            return np.flatnonzero(mask)
+
+        grp = self.f[INDEX_GROUP]
+        usec = grp["time"][:]
+        lo = 0 if stime is None else np.searchsorted(
+            usec, int(round(datetime_to_epoch(stime) * 1e6)), side="left")
+        hi = len(usec) if etime is None else np.searchsorted(
+            usec, int(round(datetime_to_epoch(etime) * 1e6)), side="right")
+        index = np.sort(grp["order"][lo:hi])
+        if beams is not None:
+            beamIndex = [grp["beams"][str(int(b))][:] for b in beams
+                         if str(int(b)) in grp["beams"]]
+            beamIndex = np.concatenate(beamIndex) if beamIndex else\
+                np.zeros(0, dtype=np.int64)
+            index = np.intersect1d(index, beamIndex)
+        return index.astype(np.int64)
+
+    def read(self, stime=None, etime=None, beams=None, columns=None):
+        """
+        Read the selected records (see select) into a
+        dmap_columns.ColumnBatch holding the given columns
+        (default: all). Only the rows of the selected records are read
+        (see _read_selection) unless they are dense enough for reading
+        the rows in between to be faster.
+        """
+        index = self.select(stime, etime, beams)
+        if columns is None:
+            columns = self.column_names()
+        if len(index) == 0:
+            return dmap_columns.ColumnBatch(0)
+        start, stop = int(index[0]), int(index[-1]) + 1
+        if len(index) == stop - start:
+            return self._read_span(columns, start, stop)
+        return self._read_selection(columns, index)
+
+    def _read_span(self, columns, start, stop):
+        """ColumnBatch of the given columns for records start:stop."""
+        scalars = {}
+        arrays = {}
+        shapes = {}
+        for name in columns:
+            obj = self.f[name]
+            if isinstance(obj, h5py.Group):
+                offsets = obj["offsets"][start:stop + 1]
+                values = obj["values"][offsets[0]:offsets[-1]]
+                arrays[name] = (values, offsets - offsets[0])
+                if "shape" in obj.attrs:
+                    shapes[name] = tuple(obj.attrs["shape"])
+            elif self.layout != "flat" and name in ARRAY_NAMES:
+                arrays[name] = _vlen_arrays(obj[start:stop],
+                                            COLUMN_DTYPES[name])
+                if name in VLEN_SHAPES:
+                    shapes[name] = VLEN_SHAPES[name]
+            else:
+                scalars[name] = read_scalar_column(self.f, name, start, stop)
+        return dmap_columns.ColumnBatch(stop - start, scalars, arrays, shapes)
+
+    def _read_selection(self, columns, index):
+        """ColumnBatch of the given columns for the records of an
+        increasing index array. Datasets are read row by row when
+        sparse (see _read_rows) and the values of flat array columns
+        run by run of consecutive records (see MAX_RUNS)."""
+        # runs index[first[k]:last[k]] of consecutive records
+        breaks = np.flatnonzero(np.diff(index) != 1) + 1
+        first = np.append(0, breaks)
+        last = np.append(breaks, len(index))
+        # records whose offsets (start and end) are needed
+        ends = np.union1d(index, index + 1)
+        scalars = {}
+        arrays = {}
+        shapes = {}
+        for name in columns:
+            obj = self.f[name]
+            if isinstance(obj, h5py.Group):
+                offs = _read_rows(obj["offsets"], ends)
+                lo = offs[np.searchsorted(ends, index)]
+                hi = offs[np.searchsorted(ends, index + 1)]
+                offsets = np.zeros(len(index) + 1, dtype=np.int64)
+                np.cumsum(hi - lo, out=offsets[1:])
+                vals = obj["values"]
+                if len(first) <= MAX_RUNS:
+                    values = np.concatenate(
+                        [vals[lo[i]:hi[j - 1]] for i, j in zip(first, last)])
+                else:
+                    pos = np.repeat(lo - offsets[:-1], hi - lo) + \
+                        np.arange(offsets[-1])
+                    values = vals[lo[0]:hi[-1]][pos - lo[0]]
+                arrays[name] = (values, offsets)
+                if "shape" in obj.attrs:
+                    shapes[name] = tuple(obj.attrs["shape"])
+            elif self.layout != "flat" and name in ARRAY_NAMES:
+                arrays[name] = _vlen_arrays(_read_rows(obj, index),
+                                            COLUMN_DTYPES[name])
+                if name in VLEN_SHAPES:
+                    shapes[name] = VLEN_SHAPES[name]
+            else:
+                scalars[name] = _scalar_values(self.f, name,
+                                               _read_rows(obj, index))
+        return dmap_columns.ColumnBatch(len(index), scalars, arrays, shapes)
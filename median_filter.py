@@ -0,0 +1,322 @@
+"""
+Boxcar (time x beam x range) median filter of fitacf data.
+
+A vectorised NumPy version of the 3x3x3 weighted median filter applied
+by the fitexfilter binary, working on ColumnBatch objects (see
+dmap_columns) instead of on files, so filtering can be a stage of the
+in-memory conversion pipeline. For each scan, a range cell is kept if
+the weight of the cells with an echo (qflg set) in the box around it,
+in the previous, current and next scans, is at least a fraction of the
+weight of the cells of the box that exist; its velocity, powers,
+spectral width, elevation and phase are then replaced by the weighted
+medians of those cells (so isolated echoes are removed and small gaps
+are filled). The output matches that of fitexfilter range gate for
+range gate (see fitexfilter_comparison).
+"""
+
+import numpy as np
+from dmap_columns import ColumnBatch, read_dmap_columns, columns_to_records
+from dmap_reader import record_datetime
+from dmap_writer import write_dmap_records
+from fitacf_schema import COLUMN_DTYPES
+from scan_cubes import scan_ids, build_scan_cubes
+
+# Range-gate parameters replaced by the weighted median of the box;
+# pwr0 (lag-0 power of each range gate) is filtered the same way
+MEDIAN_PARAMS = ["v", "p_l", "w_l", "elv", "phi0"]
+
+# Array parameters not indexed by range gate, kept as they are
+RECORD_ARRAYS = ["ltab", "ptab"]
+
+# Weights of the cells of the box, indexed [time][beam][range]: one, plus
+# one for each dimension in which the cell is centred, plus one for the
+# centre cell itself (as fitexfilter weighs them)
+BOX_WEIGHTS = np.array([[[1, 2, 1], [2, 3, 2], [1, 2, 1]],
+                        [[2, 3, 2], [3, 5, 3], [2, 3, 2]],
+                        [[1, 2, 1], [2, 3, 2], [1, 2, 1]]], dtype=np.float64)
+
+
+def _box_offsets(tdim, bdim, rdim):
+    """(dt, db, dr, weight) of the cells of a tdim x bdim x rdim box."""
+    offsets = []
+    for dt in range(3):
+        for db in range(3):
+            for dr in range(3):
+                if (tdim == 1 and dt != 1) or (bdim == 1 and db != 1) or \
+                   (rdim == 1 and dr != 1):
+                    continue
+                offsets.append((dt - 1, db - 1, dr - 1,
+                                BOX_WEIGHTS[dt, db, dr]))
+    return offsets
+
+
+def _weighted_median(vals, weights):
+    """Weighted median along the last axis, ignoring NaN values, taken
+    as the middle element of the sorted list in which each value is
+    repeated according to its weight."""
+    order = np.argsort(vals, axis=-1)
+    sVals = np.take_along_axis(vals, order, axis=-1)
+    sWeights = np.take_along_axis(weights, order, axis=-1)
+    cumWeights = np.cumsum(sWeights, axis=-1)
+    half = np.floor(cumWeights[..., -1:] / 2.)
+    idx = np.argmax(cumWeights > half, axis=-1)
+    return np.take_along_axis(sVals, idx[..., np.newaxis], axis=-1)[..., 0]
+
+
+def _pad(cube, fill):
+    """cube with a border of fill values one cell wide on every side."""
+    pad = np.full(tuple(n + 2 for n in cube.shape), fill, dtype=cube.dtype)
+    pad[1:-1, 1:-1, 1:-1] = cube
+    return pad
+
+
+def _filter_cubes(padCubes, padAvail, padOcc, scans, offsets, thresh):
+    """Filters the given scans of (n_scans, n_beams, n_ranges) cubes,
+    padded with _pad; padAvail marks the cells that exist and padOcc
+    those with an echo. Returns the mask of the cells of those scans
+    that pass the threshold and the filtered values of those cells."""
+    nBeam, nRang = padOcc.shape[1] - 2, padOcc.shape[2] - 2
+    shape = (len(scans), nBeam, nRang)
+    onWeight = np.zeros(shape)
+    totWeight = np.zeros(shape)
+    for dt, db, dr, w in offsets:
+        box = (scans + 1 + dt,
+               slice(1 + db, nBeam + 1 + db), slice(1 + dr, nRang + 1 + dr))
+        onWeight += w * padOcc[box]
+        if dt == 0 and db == 0 and dr == 0:
+            # the centre cell always counts in the total weight
+            totWeight += w
+        else:
+            totWeight += w * padAvail[box]
+    keep = onWeight > 0
+    keep[keep] = onWeight[keep] / totWeight[keep] >= thresh
+
+    # weighted medians of the boxes of the kept cells
+    kS, kB, kR = np.nonzero(keep)
+    cells = [(scans[kS] + 1 + dt, kB + 1 + db, kR + 1 + dr)
+             for dt, db, dr, w in offsets]
+    weights = np.array([w for dt, db, dr, w in offsets])
+    boxOcc = np.stack([padOcc[cell] for cell in cells], axis=-1)
+    boxWeights = boxOcc * weights
+    filtered = {}
+    for name, pad in padCubes.items():
+        boxVals = np.stack([pad[cell] for cell in cells], axis=-1)
+        boxVals[~boxOcc] = np.nan
+        filtered[name] = _weighted_median(boxVals, boxWeights)
+    return keep, filtered
+
+
+def _range_cube(colBatch, name, records, nRang):
+    """(scan, beam, range) cube of an array parameter with one value per
+    range gate (e.g. pwr0) of the records placed in a scan grid."""
+    cube = np.full(records.shape + (nRang,), np.nan)
+    sIdx, bIdx = np.nonzero(records >= 0)
+    recs = records[sIdx, bIdx]
+    values, offsets = colBatch.arrays[name]
+    lens = np.minimum(offsets[recs + 1] - offsets[recs], nRang)
+    cell = np.repeat(np.arange(len(recs)), lens)
+    rIdx = np.arange(len(cell)) - np.repeat(np.cumsum(lens) - lens, lens)
+    cube[sIdx[cell], bIdx[cell], rIdx] = values[offsets[recs][cell] + rIdx]
+    return cube
+
+
+def _carried_values(colBatch, names, rows, ranges):
+    """Values of range-gate parameters at the (record, range gate) cells
+    given by rows and ranges, taken as fitexfilter takes them: from the
+    record if it has the gate, else from the last earlier record that
+    has it (fitexfilter keeps the values of gates missing from a record
+    from the records read before it), else zero. Parameters that are
+    not aligned with slist are left out."""
+    slist, offsets = colBatch.arrays["slist"]
+    nrec = colBatch.nrec
+    rec = np.repeat(np.arange(nrec), np.diff(offsets))
+    # (gate, record) order of the values
+    order = np.argsort(slist.astype(np.int64) * nrec + rec, kind="mergesort")
+    keys = slist[order].astype(np.int64) * nrec + rec[order]
+    idx = np.searchsorted(keys, ranges * nrec + rows, side="right") - 1
+    found = idx >= 0
+    found[found] = slist[order][idx[found]] == ranges[found]
+    src = order[idx[found]]
+
+    carried = {}
+    for name in names:
+        values, vOffsets = colBatch.arrays[name]
+        if not np.array_equal(vOffsets, offsets):
+            continue
+        vals = np.zeros(len(rows), dtype=values.dtype)
+        vals[found] = values[src]
+        carried[name] = vals
+    return carried
+
+
+def _filter_channel(colBatch, tdim, bdim, rdim, thresh, scanChunk):
+    """Filters a ColumnBatch holding the records of one channel."""
+    sid = scan_ids(colBatch)
+    # as fitexfilter, leave out the last scan (it is neither filtered
+    # nor used as the next scan of the one before)
+    nScan = int(sid.max())
+    if nScan == 0:
+        return ColumnBatch(0)
+    sel = colBatch.take(sid < nScan)
+    sid = sid[sid < nScan]
+    bmnum = sel.scalars["bmnum"].astype(np.int64)
+
+    # (scan, beam, range) cubes of the filtered parameters; the last
+    # record of each (scan, beam) is the one in the box of the others
+    params = [name for name in MEDIAN_PARAMS if name in sel.arrays]
+    grid = build_scan_cubes(sel, params + ["qflg"], sid=sid)
+    nBeam, nRang = grid.records.shape[1], grid.occupied.shape[2]
+    cubes = dict((name, grid.cubes[name]) for name in params)
+    if "pwr0" in sel.arrays:
+        cubes["p_0"] = _range_cube(sel, "pwr0", grid.records, nRang)
+
+    # cells of the beams present in a scan, up to their nrang
+    if "nrang" in sel.scalars:
+        nrang = sel.scalars["nrang"].astype(np.int64)
+    else:
+        nrang = np.full(sel.nrec, nRang, dtype=np.int64)
+    gates = np.arange(nRang)
+    placed = grid.records >= 0
+    avail = placed[..., np.newaxis] & \
+        (gates < nrang[np.maximum(grid.records, 0)][..., np.newaxis])
+    occupied = grid.occupied & avail
+    if "qflg" in grid.cubes:
+        occupied &= grid.cubes["qflg"] != 0
+
+    # filter the scans, a chunk at a time to bound memory use
+    padCubes = dict((name, _pad(cube, np.nan))
+                    for name, cube in cubes.items())
+    padAvail = _pad(avail, False)
+    padOcc = _pad(occupied, False)
+    fCubes = dict((name, np.full(cube.shape, np.nan))
+                  for name, cube in cubes.items())
+    keep = np.zeros(occupied.shape, dtype=bool)
+    boxOffsets = _box_offsets(tdim, bdim, rdim)
+    for first in range(0, nScan, scanChunk):
+        scans = np.arange(first, min(first + scanChunk, nScan))
+        chunkKeep, filtered = _filter_cubes(padCubes, padAvail, padOcc,
+                                            scans, boxOffsets, thresh)
+        keep[scans] = chunkKeep
+        kS, kB, kR = np.nonzero(chunkKeep)
+        for name in fCubes.keys():
+            fCubes[name][scans[kS], kB, kR] = filtered[name]
+
+    # every record gets the cells of its (scan, beam) up to its nrang
+    valid = (bmnum >= 0) & (bmnum < nBeam)
+    recKeep = keep[sid, np.where(valid, bmnum, 0)] & \
+        valid[:, np.newaxis] & (gates < nrang[:, np.newaxis])
+    rows, ranges = np.nonzero(recKeep)
+    newOffsets = np.zeros(sel.nrec + 1, dtype=np.int64)
+    np.cumsum(recKeep.sum(axis=1), out=newOffsets[1:])
+    cells = (sid[rows], bmnum[rows], ranges)
+
+    arrays = {"slist": (ranges.astype(COLUMN_DTYPES["slist"]), newOffsets)}
+    for name in params:
+        arrays[name] = (fCubes[name][cells].astype(COLUMN_DTYPES[name]),
+                        newOffsets.copy())
+    if "qflg" in sel.arrays:
+        arrays["qflg"] = (np.ones(len(ranges), dtype=COLUMN_DTYPES["qflg"]),
+                          newOffsets.copy())
+    if "gflg" in sel.arrays and "v" in params and "w_l" in params:
+        # ground scatter flag of the filtered velocity and width
+        gflg = np.abs(fCubes["v"][cells]) < 30. - fCubes["w_l"][cells] / 3.
+        arrays["gflg"] = (gflg.astype(COLUMN_DTYPES["gflg"]),
+                          newOffsets.copy())
+    others = [name for name in sel.arrays if name not in arrays and
+              name not in RECORD_ARRAYS + ["pwr0"]]
+    for name, vals in _carried_values(sel, others, rows, ranges).items():
+        arrays[name] = (vals, newOffsets.copy())
+    if "pwr0" in sel.arrays:
+        # filtered power of the kept gates, zero elsewhere
+        values, offsets = sel.arrays["pwr0"]
+        inside = ranges < offsets[rows + 1] - offsets[rows]
+        pwr0 = np.zeros(len(values), dtype=values.dtype)
+        pwr0[offsets[rows[inside]] + ranges[inside]] = \
+            fCubes["p_0"][cells][inside]
+        arrays["pwr0"] = (pwr0, offsets)
+    shapes = {}
+    for name in RECORD_ARRAYS:
+        if name in sel.arrays:
+            arrays[name] = sel.arrays[name]
+            if name in sel.shapes:
+                shapes[name] = sel.shapes[name]
+    return ColumnBatch(sel.nrec, sel.scalars, arrays, shapes)
+
+
+def boxcar_median_filter(colBatch, tdim=3, bdim=3, rdim=3, thresh=0.4,
+                         scanChunk=64):
+    """Boxcar median filters a block of fitacf records.
+
+    Parameters
+    ----------
+    colBatch : dmap_columns.ColumnBatch
+        Records in time order (e.g. a whole day).
+    tdim, bdim, rdim : int
+        Time, beam and range dimensions of the box, 1 or 3.
+    thresh : float
+        A cell is kept if the weight of the cells of its box with an
+        echo is at least thresh (in [0, 1]) times the weight of the
+        cells of the box that exist.
+    scanChunk : int
+        Number of scans filtered at a time.
+
+    Returns
+    -------
+    dmap_columns.ColumnBatch
+        The records, except those of the last scan, with their scalars
+        and RECORD_ARRAYS unchanged, the kept gates in slist, the
+        weighted medians of MEDIAN_PARAMS and pwr0, qflg set, gflg
+        recomputed from the filtered v and w_l, and the other range-gate
+        parameters copied as fitexfilter copies them.
+
+    """
+    for dim in [tdim, bdim, rdim]:
+        if dim not in [1, 3]:
+            raise ValueError("box dimensions must be 1 or 3")
+    if not 0 <= thresh <= 1:
+        raise ValueError("thresh must be in [0,1]")
+    if colBatch.nrec == 0 or "slist" not in colBatch.arrays:
+        return ColumnBatch(0)
+
+    if "channel" not in colBatch.scalars:
+        return _filter_channel(colBatch, tdim, bdim, rdim, thresh, scanChunk)
+    channels = colBatch.scalars["channel"]
+    parts = [_filter_channel(colBatch.take(channels == ch), tdim, bdim,
+                             rdim, thresh, scanChunk)
+             for ch in np.unique(channels)]
+    out = ColumnBatch.concat(parts)
+    if len(parts) > 1:
+        out = out.take(np.argsort(out.scalars["time"], kind="mergesort"))
+    return out
+
+
+def filter_dmap_columns(source, stime=None, etime=None, **kwargs):
+    """Reads a dmap file (or a dmap_streams.VirtualDay) and returns its
+    boxcar median filtered records as one ColumnBatch. **kwargs are
+    passed to boxcar_median_filter."""
+    colBatch = ColumnBatch.concat(list(read_dmap_columns(
+        source, stime=stime, etime=etime)))
+    return boxcar_median_filter(colBatch, **kwargs)
+
+
+def _dmap_record(rec):
+    """A record of columns_to_records with its time split back into
+    the time.* fields, as dmap_writer.encode_record takes it."""
+    t = record_datetime(rec)
+    del rec["time"]
+    rec.update({"time.yr": np.int16(t.year), "time.mo": np.int16(t.month),
+                "time.dy": np.int16(t.day), "time.hr": np.int16(t.hour),
+                "time.mt": np.int16(t.minute), "time.sc": np.int16(t.second),
+                "time.us": np.int32(t.microsecond)})
+    return rec
+
+
+def write_filtered_dmap(source, fname, stime=None, etime=None, **kwargs):
+    """Boxcar median filters a dmap file (or a dmap_streams.VirtualDay)
+    into the (uncompressed) dmap file fname, as fitexfilter does.
+    **kwargs are passed to boxcar_median_filter. Returns the number of
+    records written."""
+    colBatch = filter_dmap_columns(source, stime=stime, etime=etime,
+                                   **kwargs)
+    return write_dmap_records((_dmap_record(rec) for rec in
+                               columns_to_records(colBatch)), fname)
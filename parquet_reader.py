@@ -0,0 +1,187 @@
+"""
+Reads the Parquet files written by ParquetConverter / CreateFiles
+(one file per radar per day, named YYYYMMDDrad.parquet, in a single
+directory or in the partitioned layout of dataset_layout) for a time
+range, a set of radars, a set of beams and a set of columns.
+
+The selection is pushed down as far as the files allow:
+  - day files outside the time range or of other radars are skipped
+    from the manifest, the partition directories or their names,
+    without opening them;
+  - row groups whose time (and bmnum) min/max statistics cannot match
+    are skipped from the file footer, without reading them;
+  - only the requested columns (plus time/bmnum when needed to filter
+    rows) are read from the remaining row groups.
+The rows of the row groups read are then filtered exactly.
+"""
+
+import datetime as dt
+import os
+import re
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dmap_reader import datetime_to_epoch
+import dataset_layout
+
+PARQUET_NAME = re.compile(r"^(\d{8})([a-z0-9]+)\.parquet$")
+
+
+def list_parquet_files(pqDir, stime=None, etime=None, radars=None):
+    """Day files of pqDir that may hold data of radars in [stime, etime].
+
+    Returns
+    -------
+    list
+        (radar, day, full path) tuples sorted by day and radar.
+
+    """
+    if dataset_layout.is_partitioned(pqDir):
+        return dataset_layout.select_files(pqDir, stime, etime, radars,
+                                           fileFormat="parquet")
+    if radars is not None:
+        radars = set(radars)
+    files = []
+    for name in os.listdir(pqDir):
+        match = PARQUET_NAME.match(name)
+        if match is None:
+            continue
+        day = dt.datetime.strptime(match.group(1), "%Y%m%d")
+        rad = match.group(2)
+        if radars is not None and rad not in radars:
+            continue
+        if etime is not None and day > etime:
+            continue
+        if stime is not None and day + dt.timedelta(days=1) <= stime:
+            continue
+        files.append((day, rad, os.path.join(pqDir, name)))
+    return [(rad, day, path) for day, rad, path in sorted(files)]
+
+
+def _column_index(rowGroup, name):
+    """Index of the (flat) column name in a row group, or None."""
+    for i in range(rowGroup.num_columns):
+        if rowGroup.column(i).path_in_schema == name:
+            return i
+    return None
+
+
+def row_group_bounds(metadata, name):
+    """(min, max) of column name in each row group of a file, from
+    its statistics; None for row groups without statistics."""
+    bounds = []
+    for i in range(metadata.num_row_groups):
+        rowGroup = metadata.row_group(i)
+        idx = _column_index(rowGroup, name)
+        stats = None if idx is None else rowGroup.column(idx).statistics
+        if stats is None or not stats.has_min_max:
+            bounds.append(None)
+        else:
+            bounds.append((stats.min, stats.max))
+    return bounds
+
+
+def select_row_groups(metadata, stime=None, etime=None, beams=None):
+    """Indices of the row groups of a file that may hold records in
+    [stime, etime] of the given beams."""
+    selected = list(range(metadata.num_row_groups))
+    if stime is not None or etime is not None:
+        sEpoch = None if stime is None else datetime_to_epoch(stime)
+        eEpoch = None if etime is None else datetime_to_epoch(etime)
+        bounds = row_group_bounds(metadata, "time")
+        selected = [i for i in selected if bounds[i] is None or
+                    ((sEpoch is None or bounds[i][1] >= sEpoch) and
+                     (eEpoch is None or bounds[i][0] <= eEpoch))]
+    if beams is not None:
+        bounds = row_group_bounds(metadata, "bmnum")
+        selected = [i for i in selected if bounds[i] is None or
+                    any(bounds[i][0] <= b <= bounds[i][1] for b in beams)]
+    return selected
+
+
+def _row_mask(table, stime, etime, beams):
+    """Boolean mask of the rows of table in [stime, etime] and beams."""
+    mask = np.ones(table.num_rows, dtype=bool)
+    if stime is not None or etime is not None:
+        times = np.asarray(table.column("time").to_pandas(), dtype=np.float64)
+        if stime is not None:
+            mask &= times >= datetime_to_epoch(stime)
+        if etime is not None:
+            mask &= times <= datetime_to_epoch(etime)
+    if beams is not None:
+        bmnum = np.asarray(table.column("bmnum").to_pandas())
+        mask &= np.isin(bmnum, list(beams))
+    return mask
+
+
+class ParquetReader(object):
+    """
+    Query interface over a directory of day Parquet files.
+    """
+
+    def __init__(self, pqDir):
+        """
+        Parameters
+        ----------
+        pqDir : str
+            Directory the day files were written to.
+        """
+        self.pqDir = pqDir
+
+    def plan(self, stime=None, etime=None, radars=None, beams=None):
+        """
+        Files and row groups a query has to read.
+        Returns a list of (radar, day, path, row group indices), leaving
+        out the files where no row group can match.
+        """
+        plan = []
+        for rad, day, path in list_parquet_files(self.pqDir, stime, etime,
+                                                 radars):
+            metadata = pq.ParquetFile(path).metadata
+            rowGroups = select_row_groups(metadata, stime, etime, beams)
+            if rowGroups:
+                plan.append((rad, day, path, rowGroups))
+        return plan
+
+    def iter_tables(self, stime=None, etime=None, radars=None, beams=None,
+                    columns=None):
+        """
+        Yield one pyarrow Table per matching day file, holding the
+        records in [stime, etime] (both included) of the given radars
+        (three-letter codes) and beams, with the given columns (default:
+        all) plus a "radar" column first.
+        """
+        readCols = None
+        if columns is not None:
+            readCols = [c for c in columns if c != "radar"]
+            if (stime is not None or etime is not None) and \
+                    "time" not in readCols:
+                readCols.append("time")
+            if beams is not None and "bmnum" not in readCols:
+                readCols.append("bmnum")
+        for rad, day, path, rowGroups in self.plan(stime, etime, radars,
+                                                   beams):
+            table = pq.ParquetFile(path).read_row_groups(rowGroups,
+                                                         columns=readCols)
+            mask = _row_mask(table, stime, etime, beams)
+            if not mask.all():
+                table = table.filter(pa.array(mask))
+            if table.num_rows == 0:
+                continue
+            names = table.schema.names if columns is None else \
+                [c for c in columns if c != "radar"]
+            arrays = [pa.array(np.full(table.num_rows, rad, dtype=object),
+                               type=pa.string())]
+            arrays += [table.column(name) for name in names]
+            yield pa.Table.from_arrays(arrays, names=["radar"] + names)
+
+    def read(self, stime=None, etime=None, radars=None, beams=None,
+             columns=None):
+        """
+        Read a selection (see iter_tables) into a single pyarrow
+        Table, or None if no record matches.
+        """
+        tables = list(self.iter_tables(stime, etime, radars, beams, columns))
+        if not tables:
+            return None
+        return pa.concat_tables(tables)
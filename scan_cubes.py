@@ -0,0 +1,233 @@
+"""
+Scan (full beam sweep) aggregation of fitacf data.
+
+Records are grouped into scans with the scan flag, and the range-gate
+parameters of each scan are placed into dense (n_scans, n_beams, nrang)
+NumPy cubes using bmnum and slist, so that scan-based analyses (fan
+plots, convection inputs, the median filter) don't have to rebuild the
+grid record by record. ScanAggregator builds the cubes incrementally,
+one block of complete scans at a time, so a day of data never has to
+be held in memory at once.
+"""
+
+import numpy as np
+from dmap_columns import ColumnBatch, read_dmap_columns
+
+# Parameters placed into cubes by default
+SCAN_PARAMS = ["v", "p_l", "w_l", "gflg"]
+
+
+def scan_ids(colBatch):
+    """Scan number of each record, counted from 0 at the first record.
+    A new scan starts at each record whose scan flag is +/-1; without a
+    scan flag, records are grouped into one minute scans."""
+    if "scan" in colBatch.scalars:
+        starts = np.abs(colBatch.scalars["scan"]) == 1
+        ids = np.cumsum(starts)
+        return ids - ids[0] if len(ids) else ids
+    time = colBatch.scalars["time"]
+    return np.floor((time - time[0]) / 60.).astype(np.int64)
+
+
+class ScanCubes(object):
+    """
+    Range-gate parameters of a block of scans on a dense grid.
+
+    Attributes
+    ----------
+    nscan, nbeam, nrang : int
+        Dimensions of the cubes.
+    cubes : dict
+        name -> float64 array of shape (nscan, nbeam, nrang); NaN where
+        the parameter has no value.
+    occupied : numpy.ndarray
+        Boolean (nscan, nbeam, nrang) array of the cells with a value.
+    records : numpy.ndarray
+        (nscan, nbeam) numbers of the records of colBatch placed in
+        the grid (the last record of each beam in a scan), -1 where a
+        scan has no record of a beam.
+    scan_time : numpy.ndarray
+        Time (seconds since the epoch) of the first record of each scan.
+    colBatch : dmap_columns.ColumnBatch
+        The records the grid was built from.
+    """
+
+    def __init__(self, colBatch, cubes, occupied, records, scan_time):
+        self.colBatch = colBatch
+        self.cubes = cubes
+        self.occupied = occupied
+        self.records = records
+        self.scan_time = scan_time
+        self.nscan, self.nbeam, self.nrang = occupied.shape
+
+    def __len__(self):
+        return self.nscan
+
+    def beam_times(self):
+        """(nscan, nbeam) times of the placed records, NaN where none."""
+        times = np.full(self.records.shape, np.nan)
+        placed = self.records >= 0
+        times[placed] = self.colBatch.scalars["time"][self.records[placed]]
+        return times
+
+    def record_scalar(self, name):
+        """(nscan, nbeam) values of a scalar parameter of the placed
+        records (e.g. bmazm, tfreq), NaN where none."""
+        values = np.full(self.records.shape, np.nan)
+        placed = self.records >= 0
+        values[placed] = self.colBatch.scalars[name][self.records[placed]]
+        return values
+
+
+def build_scan_cubes(colBatch, params=SCAN_PARAMS, sid=None, nBeam=None,
+                     nRang=None):
+    """Places the records of a ColumnBatch into scan cubes.
+
+    Parameters
+    ----------
+    colBatch : dmap_columns.ColumnBatch
+        Records of a single channel, in time order.
+    params : list
+        Range-gate parameters to place; those missing from colBatch
+        are left out of the cubes.
+    sid : Optional[numpy.ndarray]
+        Scan number of each record (default: scan_ids(colBatch)).
+    nBeam, nRang : Optional[int]
+        Beam and range dimensions of the cubes (default: the largest
+        bmnum + 1, and the largest of nrang and slist + 1). Values of
+        beams or range gates outside the cubes are dropped.
+
+    Returns
+    -------
+    ScanCubes
+
+    """
+    if sid is None:
+        sid = scan_ids(colBatch)
+    bmnum = colBatch.scalars["bmnum"].astype(np.int64)
+    slist = colBatch.arrays["slist"][0]
+    if nBeam is None:
+        nBeam = int(bmnum.max()) + 1 if colBatch.nrec else 1
+    if nRang is None:
+        nRang = max(int(colBatch.scalars["nrang"].max()) if "nrang" in
+                    colBatch.scalars else 0, int(slist.max()) + 1 if
+                    len(slist) else 1)
+    nScan = int(sid.max()) + 1 if colBatch.nrec else 0
+
+    # the last record of each (scan, beam) is the one placed in the grid
+    records = np.full((nScan, nBeam), -1, dtype=np.int64)
+    valid = np.nonzero((bmnum >= 0) & (bmnum < nBeam))[0]
+    cellId = sid[valid] * nBeam + bmnum[valid]
+    order = np.lexsort((valid, cellId))
+    last = np.append(cellId[order][1:] != cellId[order][:-1], True)
+    last = valid[order][last]
+    records[sid[last], bmnum[last]] = last
+
+    # (scan, beam, range) cells of the values of the placed records
+    recs = np.sort(records[records >= 0])
+    sel = colBatch.take(recs)
+    valRec = np.repeat(np.arange(len(recs)), sel.lengths("slist"))
+    cS = sid[recs][valRec]
+    cB = bmnum[recs][valRec]
+    cR = sel.arrays["slist"][0].astype(np.int64)
+    inside = (cR >= 0) & (cR < nRang)
+    cS, cB, cR = cS[inside], cB[inside], cR[inside]
+    occupied = np.zeros((nScan, nBeam, nRang), dtype=bool)
+    occupied[cS, cB, cR] = True
+    cubes = {}
+    for name in params:
+        if name not in sel.arrays:
+            continue
+        cube = np.full((nScan, nBeam, nRang), np.nan)
+        cube[cS, cB, cR] = sel.arrays[name][0][inside]
+        cubes[name] = cube
+
+    scan_time = np.full(nScan, np.nan)
+    # records are in time order: the first record of a scan is its start
+    first = np.nonzero(np.diff(np.append(-1, sid)) != 0)[0]
+    scan_time[sid[first]] = colBatch.scalars["time"][first]
+    return ScanCubes(colBatch, cubes, occupied, records, scan_time)
+
+
+class ScanAggregator(object):
+    """
+    Builds scan cubes incrementally from blocks of records. The records
+    of the last, possibly incomplete, scan of a block are held back and
+    placed with the next block, so only complete scans are returned.
+    """
+
+    def __init__(self, params=SCAN_PARAMS, nBeam=None, nRang=None,
+                 channel=None):
+        """
+        Parameters
+        ----------
+        params : list
+            Range-gate parameters to place into cubes.
+        nBeam, nRang : Optional[int]
+            Fixed beam and range dimensions (default: taken from the
+            data of each block).
+        channel : Optional[int]
+            Only records of this channel are used (stereo radars
+            interleave channels, which must be gridded separately).
+        """
+        self.params = params
+        self.nBeam = nBeam
+        self.nRang = nRang
+        self.channel = channel
+        self._pending = ColumnBatch(0)
+
+    def add(self, colBatch):
+        """
+        Add a block of records (in time order). Returns the ScanCubes
+        of the scans completed by this block, or None.
+        """
+        if self.channel is not None and "channel" in colBatch.scalars:
+            colBatch = colBatch.take(colBatch.scalars["channel"] ==
+                                     self.channel)
+        data = ColumnBatch.concat([self._pending, colBatch])
+        if data.nrec == 0:
+            return None
+        sid = scan_ids(data)
+        complete = sid < sid[-1]
+        self._pending = data.take(~complete)
+        if not complete.any():
+            return None
+        return build_scan_cubes(data.take(complete), self.params,
+                                sid=sid[complete], nBeam=self.nBeam,
+                                nRang=self.nRang)
+
+    def flush(self):
+        """ScanCubes of the held back records, or None."""
+        data, self._pending = self._pending, ColumnBatch(0)
+        if data.nrec == 0:
+            return None
+        return build_scan_cubes(data, self.params, nBeam=self.nBeam,
+                                nRang=self.nRang)
+
+
+def iter_scan_cubes(source, stime=None, etime=None, batchSize=10000,
+                    **kwargs):
+    """Yields ScanCubes of the complete scans of a dmap file, reading
+    batchSize records at a time.
+
+    Parameters
+    ----------
+    source : str, VirtualDay or file-like
+        See dmap_reader.read_dmap_records.
+    stime, etime : Optional[datetime.datetime]
+        Time range of interest.
+    batchSize : int
+        Number of records read at a time.
+    **kwargs
+        See ScanAggregator.
+
+    """
+    aggregator = ScanAggregator(**kwargs)
+    for colBatch in read_dmap_columns(source, batch_size=batchSize,
+                                      stime=stime, etime=etime):
+        scans = aggregator.add(colBatch)
+        if scans is not None:
+            yield scans
+    scans = aggregator.flush()
+    if scans is not None:
+        yield scans
@@ -0,0 +1,213 @@
+"""
+Synthetic fitacf data in DMAP format.
+
+Writes archives of fitacf files laid out as the SuperDARN archive is
+("{year}/fitacf/{radar}/YYYYMMDD.HH00.00.rad.fitacf.bz2", two hours per
+file), with a chosen number of radars, beams, range gates and records
+per day, so that the conversion pipeline can be exercised and timed
+(see benchmark) without access to real data. Values are random but
+have the types, shapes and rough ranges of real fitacf records, and
+records sweep the beams in scans as a radar does.
+"""
+
+import bz2
+import datetime as dt
+import gzip
+import os
+
+import numpy as np
+
+import fitacf_schema
+from dmap_writer import encode_record
+
+# Station ids of some radars; others get ids from 200 on
+STATION_IDS = {"gbr": 1, "sch": 2, "kap": 3, "hal": 4, "sas": 5, "pgr": 6,
+               "kod": 7, "sto": 8, "pyk": 9, "han": 10, "wal": 32,
+               "bks": 33, "inv": 64, "rkn": 65, "cly": 66, "fhw": 204,
+               "fhe": 205}
+
+# Arrays with one value per range gate of slist
+GATE_ARRAYS = ["nlag", "qflg", "gflg", "p_l", "p_l_e", "p_s", "p_s_e", "v",
+               "v_e", "w_l", "w_l_e", "w_s", "w_s_e", "sd_l", "sd_s", "sd_phi"]
+# and those of the XCF (interferometer) fit, written if xcf is set
+XCF_ARRAYS = ["x_qflg", "x_gflg", "x_p_l", "x_p_l_e", "x_p_s", "x_p_s_e",
+              "x_v", "x_v_e", "x_w_l", "x_w_l_e", "x_w_s", "x_w_s_e",
+              "phi0", "phi0_e", "elv", "elv_low", "elv_high", "x_sd_l",
+              "x_sd_s", "x_sd_phi"]
+
+
+def _typed(name, value):
+    """value as a numpy scalar or array of the dtype of a fitacf field."""
+    return np.asarray(value).astype(fitacf_schema.numpy_dtype(name))[()]
+
+
+def synthetic_records(rad, stime, etime, nBeam=16, nRang=75,
+                      recordsPerDay=28800, fillFraction=0.3, xcf=True,
+                      seed=0):
+    """
+    Yield synthetic fitacf records (dicts as dmap_writer.encode_record
+    takes them) of a radar between stime and etime.
+
+    Parameters
+    ----------
+    rad : str
+        Three-letter radar code.
+    stime, etime : datetime.datetime
+        Time range of the records.
+    nBeam, nRang : int
+        Number of beams and of range gates.
+    recordsPerDay : int
+        Records per day, evenly spaced; the beams are swept in order,
+        one scan every nBeam records.
+    fillFraction : float
+        Average fraction of the range gates with a fitted value.
+    xcf : bool
+        Include the XCF fit and elevation arrays.
+    seed : int
+        Seed of the random values.
+    """
+    rng = np.random.RandomState(seed)
+    stid = STATION_IDS.get(rad, 200 + sum(ord(c) for c in rad) % 50)
+    step = 86400. / recordsPerDay
+    intt = max(int(step), 1)
+    day = dt.datetime(stime.year, stime.month, stime.day)
+    first = int(np.ceil((stime - day).total_seconds() / step))
+    last = int(np.ceil((etime - day).total_seconds() / step))
+    mplgs = 18
+    for i in range(first, last):
+        t = day + dt.timedelta(seconds=i * step)
+        bmnum = i % nBeam
+        rec = {"radar.revision.major": b"\x01",
+               "radar.revision.minor": b"\x03",
+               "origin.code": b"\x00",
+               "origin.time": t.strftime("%a %b %d %H:%M:%S %Y"),
+               "origin.command": "make_fit -fitacf2 synthetic",
+               "cp": _typed("cp", 153), "stid": _typed("stid", stid),
+               "time.yr": np.int16(t.year), "time.mo": np.int16(t.month),
+               "time.dy": np.int16(t.day), "time.hr": np.int16(t.hour),
+               "time.mt": np.int16(t.minute), "time.sc": np.int16(t.second),
+               "time.us": np.int32(t.microsecond)}
+        scalars = {"txpow": 9000, "nave": 20, "atten": 0, "lagfr": 1200,
+                   "smsep": 300, "ercod": 0, "stat.agc": 0,
+                   "stat.lopwr": 0, "noise.search": rng.uniform(1, 10),
+                   "noise.mean": rng.uniform(1, 10), "channel": 0,
+                   "bmnum": bmnum, "bmazm": (bmnum - nBeam / 2.) * 3.24,
+                   "scan": 1 if bmnum == 0 else 0, "offset": 0,
+                   "rxrise": 100, "intt.sc": intt, "intt.us": 0,
+                   "txpl": 300, "mpinc": 1500, "mppul": 8, "mplgs": mplgs,
+                   "mplgexs": 0, "ifmode": 0, "nrang": nRang, "frang": 180,
+                   "rsep": 45, "xcf": 1 if xcf else 0,
+                   "tfreq": 10500 + 10 * rng.randint(0, 100),
+                   "mxpwr": 1073741824, "lvmax": 20000,
+                   "fitacf.revision.major": 2, "fitacf.revision.minor": 5,
+                   "noise.sky": rng.uniform(1, 10), "noise.lag0": 0.,
+                   "noise.vel": 0.}
+        for name, value in scalars.items():
+            rec[name] = _typed(name, value)
+        rec["combf"] = "$Id: synthetic $"
+        rec["ptab"] = _typed("ptab", [0, 14, 22, 24, 27, 31, 42, 43])
+        rec["ltab"] = _typed("ltab", rng.randint(0, 44, (mplgs + 1, 2)))
+        rec["pwr0"] = _typed("pwr0", rng.uniform(0, 40, nRang))
+
+        slist = np.nonzero(rng.uniform(size=nRang) < fillFraction)[0]
+        ngood = len(slist)
+        if ngood == 0:
+            yield rec
+            continue
+        gates = {"slist": slist, "nlag": rng.randint(1, mplgs, ngood),
+                 "qflg": np.ones(ngood), "gflg": rng.randint(0, 2, ngood),
+                 "p_l": rng.uniform(0, 40, ngood),
+                 "v": rng.normal(0, 300, ngood),
+                 "w_l": rng.uniform(0, 300, ngood)}
+        if xcf:
+            gates["x_qflg"] = np.ones(ngood)
+            gates["x_gflg"] = gates["gflg"]
+            gates["elv"] = rng.uniform(0, 45, ngood)
+            gates["elv_low"] = gates["elv"] - rng.uniform(0, 5, ngood)
+            gates["elv_high"] = gates["elv"] + rng.uniform(0, 5, ngood)
+        for name in GATE_ARRAYS + (XCF_ARRAYS if xcf else []):
+            if name not in gates:
+                # errors, lambda/sigma fits, ...: positive values
+                gates[name] = rng.exponential(10., ngood)
+        for name, value in gates.items():
+            rec[name] = _typed(name, value)
+        yield rec
+
+
+def archive_file_name(rootDir, rad, ftime, compression="bz2"):
+    """Path of the archive file of a radar starting at ftime."""
+    fname = os.path.join(rootDir, ftime.strftime("%Y"), "fitacf", rad,
+                         ftime.strftime("%Y%m%d.%H%M.00.") + rad +
+                         ".fitacf")
+    if compression == "bz2":
+        return fname + ".bz2"
+    if compression == "gzip":
+        return fname + ".gz"
+    return fname
+
+
+def _open_output(fname, compression):
+    """Open a file for writing, compressed on the fly."""
+    if compression == "bz2":
+        return bz2.BZ2File(fname, "wb")
+    if compression == "gzip":
+        return gzip.open(fname, "wb")
+    return open(fname, "wb")
+
+
+def write_archive(rootDir, radars, days, hoursPerFile=2, compression="bz2",
+                  seed=0, **kwargs):
+    """
+    Write synthetic fitacf files of radars over days in the layout of
+    the archive, readable with localdirfmt "rootDir/{year}/{ftype}/
+    {radar}/" and fnamefmt "{date}.{hour}......{radar}.{ftype}" (see
+    dmap_to_csv.fetch_concat) or a file_catalog.FileCatalog.
+
+    Parameters
+    ----------
+    rootDir : str
+        Root directory of the archive.
+    radars : list
+        Three-letter radar codes.
+    days : list
+        Days (datetime.datetime) to write.
+    hoursPerFile : int
+        Hours of data per file.
+    compression : Optional[str]
+        "bz2" (as the archive), "gzip" or None.
+    seed : int
+        Seed of the first file; each file gets a different one.
+    **kwargs
+        See synthetic_records.
+
+    Returns
+    -------
+    list
+        Paths of the files written.
+    """
+    fnames = []
+    for rad in radars:
+        for day in days:
+            day = dt.datetime(day.year, day.month, day.day)
+            for hour in range(0, 24, hoursPerFile):
+                ftime = day + dt.timedelta(hours=hour)
+                fname = archive_file_name(rootDir, rad, ftime, compression)
+                if not os.path.exists(os.path.dirname(fname)):
+                    os.makedirs(os.path.dirname(fname))
+                records = synthetic_records(
+                    rad, ftime, ftime + dt.timedelta(hours=hoursPerFile),
+                    seed=seed + len(fnames), **kwargs)
+                f = _open_output(fname, compression)
+                try:
+                    for rec in records:
+                        f.write(encode_record(rec))
+                finally:
+                    f.close()
+                fnames.append(fname)
+    return fnames
+
+
+if __name__ == "__main__":
+    fnames = write_archive("./sd-data/", ["bks", "fhe"],
+                           [dt.datetime(2012, 12, 5)])
+    print("wrote {:d} files".format(len(fnames)))
@@ -0,0 +1,152 @@
+"""
+Parsing and validation of data queries.
+
+A query selects radars, a time range, parameters and beams of the
+converted data, e.g.
+    /api/data/?radar=bks,fhe&start=2012-12-05T00:00&end=2012-12-06
+        &params=v,p_l,slist&beams=7&format=csv
+"""
+
+import datetime as dt
+import hashlib
+import json
+
+import fitacf_schema
+
+# Parameters returned when none are asked for
+DEFAULT_PARAMS = ["time", "bmnum", "channel", "stid", "slist", "v", "p_l",
+                  "w_l", "gflg"]
+
+FORMATS = ["arrow", "csv"]
+SOURCES = ["parquet", "hdf5"]
+
+TIME_FORMATS = ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"]
+
+
+def parse_time(value):
+    """datetime of a query time (ISO 8601, UT, no time zone)."""
+    for fmt in TIME_FORMATS:
+        try:
+            return dt.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError("invalid time: " + value)
+
+
+def _list_param(params, name):
+    """Values of a parameter given as repeated and/or comma separated
+    values (radar=bks&radar=fhe or radar=bks,fhe), or None."""
+    values = []
+    for value in params.getlist(name):
+        values.extend(v.strip() for v in value.split(",") if v.strip())
+    return values if values else None
+
+
+class DataQuery(object):
+    """
+    A validated data query.
+    """
+
+    def __init__(self, radars, stime, etime, params, beams=None,
+                 format="arrow", source="parquet"):
+        """
+        Parameters
+        ----------
+        radars : list
+            Three-letter radar codes.
+        stime, etime : datetime.datetime
+            Time range (both included).
+        params : list
+            fitacf parameters to return.
+        beams : Optional[list]
+            Beam numbers (default: all).
+        format : str
+            "arrow" (Arrow IPC stream) or "csv".
+        source : str
+            Converted files read: "parquet" or "hdf5".
+        """
+        self.radars = radars
+        self.stime = stime
+        self.etime = etime
+        self.params = params
+        self.beams = beams
+        self.format = format
+        self.source = source
+
+    @classmethod
+    def from_params(cls, params, maxDays=None):
+        """
+        Build a query from request parameters (a QueryDict).
+        Raises ValueError for a missing or invalid parameter.
+        """
+        radars = _list_param(params, "radar")
+        if radars is None:
+            raise ValueError("radar is required")
+        for rad in radars:
+            if not (rad.isalnum() and rad.islower()):
+                raise ValueError("invalid radar: " + rad)
+        if "start" not in params or "end" not in params:
+            raise ValueError("start and end are required")
+        stime = parse_time(params["start"])
+        etime = parse_time(params["end"])
+        if etime < stime:
+            raise ValueError("end is before start")
+        if maxDays is not None and \
+                etime - stime > dt.timedelta(days=maxDays):
+            raise ValueError("at most {:d} days can be queried at "
+                             "once".format(maxDays))
+
+        names = _list_param(params, "params") or list(DEFAULT_PARAMS)
+        for name in names:
+            if name not in fitacf_schema.FIELD_DICT:
+                raise ValueError("unknown parameter: " + name)
+        if "time" not in names:
+            names.insert(0, "time")
+
+        beams = _list_param(params, "beams")
+        if beams is not None:
+            try:
+                beams = sorted(set(int(b) for b in beams))
+            except ValueError:
+                raise ValueError("beams must be integers")
+
+        fmt = params.get("format", "arrow")
+        if fmt not in FORMATS:
+            raise ValueError("format must be one of " + ", ".join(FORMATS))
+        source = params.get("source", "parquet")
+        if source not in SOURCES:
+            raise ValueError("source must be one of " + ", ".join(SOURCES))
+        return cls(sorted(set(radars)), stime, etime, names, beams, fmt,
+                   source)
+
+    def normalized(self):
+        """The query as a dict of JSON serializable values, the same
+        for all the ways of writing a query (order of the query string
+        parameters, repeated or comma separated values, ...)."""
+        return {"radars": self.radars, "stime": self.stime.isoformat(),
+                "etime": self.etime.isoformat(), "params": self.params,
+                "beams": self.beams, "format": self.format,
+                "source": self.source}
+
+    def cache_key(self, dataVersion=None):
+        """
+        Key of the response to the query; dataVersion identifies the
+        state of the dataset (e.g. the mtime of its manifest) so that
+        new data make new keys.
+        """
+        desc = dict(self.normalized(), data=dataVersion)
+        text = json.dumps(desc, sort_keys=True)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def file_name(self):
+        """Name of the file the response is downloaded as."""
+        return "{:s}.{:s}.{:s}.{:s}".format(
+            self.stime.strftime("%Y%m%d.%H%M%S"),
+            self.etime.strftime("%Y%m%d.%H%M%S"), "_".join(self.radars),
+            "arrows" if self.format == "arrow" else "csv")
+
+    def content_type(self):
+        """MIME type of the response."""
+        if self.format == "arrow":
+            return "application/vnd.apache.arrow.stream"
+        return "text/csv"
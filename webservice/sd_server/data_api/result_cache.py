@@ -0,0 +1,292 @@
+"""
+Cache of encoded query responses, with request coalescing.
+
+Responses are cached under a key of the normalised query (see
+DataQuery.cache_key) in two tiers: small responses are kept in memory
+(size-bounded LRU with a time to live), and all responses up to a
+maximum size are kept on disk, indexed by a conversion_cache
+.ConversionCache (size-bounded LRU with a time to live too).
+
+Identical requests arriving while a response is being produced are
+coalesced: the response is produced once, by a background task that
+spools its chunks to a file, and every waiting request streams from
+that file as it grows. Coalescing is done within a server process;
+the disk tier is shared by all the processes using the same cache
+directory.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+
+from conversion_cache import ConversionCache
+
+# Bytes read from a spooled or cached file at a time
+READ_SIZE = 1 << 20
+
+
+class MemoryCache(object):
+    """
+    In-memory LRU cache of bytes with a total size bound and a
+    time to live.
+    """
+
+    def __init__(self, maxBytes, ttl=None):
+        """
+        Parameters
+        ----------
+        maxBytes : int
+            Maximum total size of the cached values.
+        ttl : Optional[float]
+            Values older than ttl seconds are expired.
+        """
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Value cached under key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            data, created = entry
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self._entries[key]
+                self.nbytes -= len(data)
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        """Cache data under key, evicting least recently used values."""
+        if len(data) > self.maxBytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old[0])
+            self._entries[key] = (data, time.time())
+            self.nbytes += len(data)
+            while self.nbytes > self.maxBytes:
+                oldKey, (oldData, created) = self._entries.popitem(last=False)
+                self.nbytes -= len(oldData)
+
+
+class _Flight(object):
+    """A response being produced, spooled to a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        """Wake up the requests waiting for more data."""
+        event, self.changed = self.changed, asyncio.Event()
+        event.set()
+
+
+def _read_range(fp, offset, size):
+    """Read size bytes at offset of an open file."""
+    fp.seek(offset)
+    return fp.read(size)
+
+
+def _open_file(path):
+    """File open for reading, None if it no longer exists."""
+    try:
+        return open(path, "rb")
+    except IOError:
+        return None
+
+
+def _next_chunk(chunks):
+    """Next chunk of a generator, None at the end."""
+    return next(chunks, None)
+
+
+class ResultCache(object):
+    """
+    Two-tier response cache with coalescing of identical requests.
+    """
+
+    def __init__(self, cacheDir, memoryBytes=256 << 20, diskBytes=10 << 30,
+                 ttl=3600., memoryItemBytes=16 << 20, diskItemBytes=2 << 30):
+        """
+        Parameters
+        ----------
+        cacheDir : str
+            Directory of the disk tier (created if needed).
+        memoryBytes, diskBytes : int
+            Maximum total size of each tier.
+        ttl : Optional[float]
+            Time to live of the cached responses, in seconds.
+        memoryItemBytes, diskItemBytes : int
+            Larger responses are not kept in the tier.
+        """
+        self.cacheDir = cacheDir
+        self.diskBytes = diskBytes
+        self.ttl = ttl
+        self.memoryItemBytes = memoryItemBytes
+        self.diskItemBytes = diskItemBytes
+        self.memory = MemoryCache(memoryBytes, ttl)
+        self._disk = None
+        self._flights = {}
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+
+    def _disk_cache(self):
+        """
+        The disk tier index. Its SQLite connection is bound to one
+        thread, so it is only used through _disk_call.
+        """
+        if self._disk is None:
+            self._disk = ConversionCache(
+                os.path.join(self.cacheDir, "index.sqlite"),
+                maxBytes=self.diskBytes, maxAge=self.ttl)
+        return self._disk
+
+    async def _disk_call(self, method, *args):
+        """Call a method of the disk tier index in its thread."""
+        def _call():
+            return getattr(self._disk_cache(), method)(*args)
+        return await sync_to_async(_call, thread_sensitive=True)()
+
+    async def stream(self, key, produce):
+        """
+        Async iterator over the chunks of the response cached under
+        key. On a miss, produce() is called (once for all the identical
+        requests in flight) and must return a blocking generator of
+        chunks of bytes, which is run in worker threads.
+        """
+        data = self.memory.get(key)
+        if data is not None:
+            yield data
+            return
+
+        flight = self._flights.get(key)
+        if flight is None:
+            path = await self._disk_call("get", key)
+            fp = _open_file(path) if path is not None else None
+            if fp is not None:
+                async for chunk in self._stream_file(fp):
+                    yield chunk
+                return
+            # another request may have started it meanwhile (or the
+            # cached file been evicted by another process since)
+            flight = self._flights.get(key)
+        if flight is None:
+            flight = self._start(key, produce)
+        async for chunk in self._follow(flight):
+            yield chunk
+
+    async def _stream_file(self, fp):
+        """Chunks of an open cached file, which is closed at the end."""
+        with fp:
+            read = sync_to_async(fp.read, thread_sensitive=False)
+            while True:
+                chunk = await read(READ_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def _start(self, key, produce):
+        """Start producing the response of key in a background task."""
+        fd, path = tempfile.mkstemp(dir=self.cacheDir, suffix=".part")
+        os.close(fd)
+        flight = _Flight(path)
+        self._flights[key] = flight
+        asyncio.ensure_future(self._produce(key, flight, produce))
+        return flight
+
+    async def _produce(self, key, flight, produce):
+        """Spool the chunks of produce() to the file of a flight, then
+        put the response into the cache tiers."""
+        try:
+            chunks = await sync_to_async(produce, thread_sensitive=False)()
+            nextChunk = sync_to_async(_next_chunk, thread_sensitive=False)
+            with open(flight.path, "wb") as fp:
+                write = sync_to_async(fp.write, thread_sensitive=False)
+                while True:
+                    chunk = await nextChunk(chunks)
+                    if chunk is None:
+                        break
+                    await write(chunk)
+                    await sync_to_async(fp.flush, thread_sensitive=False)()
+                    flight.size += len(chunk)
+                    flight.notify()
+        except Exception as e:
+            logging.exception("failed to produce the response " + key)
+            flight.error = e
+        flight.done = True
+        flight.notify()
+
+        try:
+            # the flight is only forgotten once the response is cached,
+            # so identical requests never miss both
+            if flight.error is not None or flight.size > self.diskItemBytes:
+                os.remove(flight.path)
+                return
+            if flight.size <= self.memoryItemBytes:
+                with open(flight.path, "rb") as fp:
+                    data = await sync_to_async(fp.read,
+                                               thread_sensitive=False)()
+                self.memory.put(key, data)
+            path = os.path.join(self.cacheDir, key)
+            os.rename(flight.path, path)
+            # requests joining the flight from now on open the cached
+            # file
+            flight.path = path
+            await self._disk_call("put", key, path)
+        except Exception:
+            logging.exception("failed to cache the response " + key)
+        finally:
+            del self._flights[key]
+
+    async def _follow(self, flight):
+        """Chunks of a flight, as they are spooled."""
+        # the spooled file is renamed or removed once the flight is
+        # done, the open file stays readable
+        fp = open(flight.path, "rb")
+        with fp:
+            read = sync_to_async(_read_range, thread_sensitive=False)
+            offset = 0
+            while True:
+                changed = flight.changed
+                if offset < flight.size:
+                    size = min(flight.size - offset, READ_SIZE)
+                    chunk = await read(fp, offset, size)
+                    offset += len(chunk)
+                    yield chunk
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await changed.wait()
+
+
+_resultCache = None
+
+
+def get_result_cache():
+    """The ResultCache of the server process, configured by the
+    SD_CACHE_* settings."""
+    global _resultCache
+    if _resultCache is None:
+        from django.conf import settings
+        _resultCache = ResultCache(
+            settings.SD_CACHE_DIR, memoryBytes=settings.SD_CACHE_MEMORY_BYTES,
+            diskBytes=settings.SD_CACHE_DISK_BYTES, ttl=settings.SD_CACHE_TTL)
+    return _resultCache
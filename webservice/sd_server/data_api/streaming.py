@@ -0,0 +1,142 @@
+"""
+Reading query results as Arrow record batches and encoding them as
+chunks of an Arrow IPC stream or of a csv file, one day file at a time,
+so responses can be sent while the following files are still read.
+"""
+
+import io
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import dataset_layout
+import fitacf_schema
+from csv_writer import format_lines
+from generate_parquet_files import ParquetConverter
+from hdf5_reader import HDF5Reader
+from parquet_reader import ParquetReader
+
+
+def result_schema(query):
+    """Arrow schema of the results of a query: the radar code
+    followed by the query parameters."""
+    schema = fitacf_schema.arrow_schema(query.params)
+    return pa.schema([pa.field("radar", pa.string())] + list(schema),
+                     metadata=schema.metadata)
+
+
+def _iter_hdf5_tables(query, dataDir):
+    """One Table per day hdf5 file of the query, as iter_tables of
+    ParquetReader does for Parquet files."""
+    converter = ParquetConverter(query.stime, query.etime, None)
+    schema = fitacf_schema.arrow_schema(query.params)
+    for rad, day, path in dataset_layout.select_files(
+            dataDir, query.stime, query.etime, query.radars,
+            fileFormat="hdf5"):
+        with HDF5Reader(path) as reader:
+            names = set(reader.column_names())
+            colBatch = reader.read(query.stime, query.etime, query.beams,
+                                   [c for c in query.params if c in names])
+        if colBatch.nrec == 0:
+            continue
+        batch = converter.columns_to_record_batch(colBatch, schema)
+        radar = pa.array(np.full(batch.num_rows, rad, dtype=object),
+                         type=pa.string())
+        yield pa.Table.from_arrays([radar] + batch.columns,
+                                   names=["radar"] + schema.names)
+
+
+def iter_batches(query, dataDir, batchRows=20000):
+    """
+    Yield the results of a query (see query.DataQuery) as record
+    batches of at most batchRows rows with the schema of result_schema.
+
+    Parameters
+    ----------
+    query : data_api.query.DataQuery
+        The query.
+    dataDir : str
+        Root of the dataset (see dataset_layout).
+    batchRows : int
+        Maximum number of rows per batch.
+    """
+    schema = result_schema(query)
+    if query.source == "hdf5":
+        tables = _iter_hdf5_tables(query, dataDir)
+    else:
+        tables = ParquetReader(dataDir).iter_tables(
+            query.stime, query.etime, query.radars, query.beams,
+            query.params)
+    for table in tables:
+        table = table.cast(schema)
+        for batch in table.to_batches(max_chunksize=batchRows):
+            yield batch
+
+
+def _drain(sink):
+    """Bytes written to a BytesIO since the last call."""
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def arrow_stream(batches, schema):
+    """Yield the bytes of an Arrow IPC stream of record batches:
+    the schema first, then one chunk per batch."""
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+    yield _drain(sink)
+    for batch in batches:
+        writer.write_batch(batch)
+        yield _drain(sink)
+    writer.close()
+    yield _drain(sink)
+
+
+def _cell_strings(arr):
+    """String of each value of an Arrow array; lists are written
+    "[a, b, ...]" as in the csv files of dmap_to_csv."""
+    if pa.types.is_list(arr.type):
+        inner = pa.ListArray.from_arrays(arr.offsets,
+                                         _cell_strings(arr.values))
+        strs = pc.binary_join_element_wise(
+            "[", pc.binary_join(inner, ", "), "]", "")
+        return pc.if_else(arr.is_null(), "", strs)
+    return pc.fill_null(arr.cast(pa.string()), "")
+
+
+def csv_columns(batch):
+    """String columns of the csv lines of a record batch."""
+    columns = []
+    for name, arr in zip(batch.schema.names, batch.columns):
+        if name == "time":
+            usec = np.round(arr.to_numpy(zero_copy_only=False) *
+                            1e6).astype(np.int64)
+            strs = pa.array(usec, type=pa.timestamp("us")).cast(pa.string())
+            # drop the fraction of seconds, as csv_writer does
+            strs = pc.utf8_slice_codeunits(strs, 0, 19)
+        else:
+            strs = _cell_strings(arr)
+        columns.append(strs)
+    return columns
+
+
+def csv_stream(batches, schema, sep="|"):
+    """Yield the bytes of a csv file of record batches: the header
+    first, then one chunk of lines per batch. The default delimiter is
+    the one of dmap_to_csv, as the lists hold commas."""
+    yield (sep.join(schema.names) + "\n").encode("utf-8")
+    for batch in batches:
+        if batch.num_rows > 0:
+            yield format_lines(csv_columns(batch), sep)
+
+
+def encode(query, dataDir, batchRows=20000):
+    """Chunks of bytes of the response to a query, in its format."""
+    schema = result_schema(query)
+    batches = iter_batches(query, dataDir, batchRows)
+    if query.format == "csv":
+        return csv_stream(batches, schema)
+    return arrow_stream(batches, schema)
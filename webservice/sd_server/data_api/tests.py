@@ -0,0 +1,165 @@
+"""
+Tests of the data query API, run with "python manage.py test data_api".
+
+A day of synthetic bks data (see synthetic_fitacf) is converted to
+Parquet and hdf5 files of a partitioned dataset (see dataset_layout)
+with day_conversion.convert_day, and queried through the async test
+client, so the streamed responses go through the views, the readers
+and the result cache as they do when served.
+"""
+
+import csv
+import datetime as dt
+import io
+import os
+import shutil
+import tempfile
+
+import pyarrow as pa
+from django.test import SimpleTestCase, override_settings
+
+import dataset_layout
+import day_conversion
+import synthetic_fitacf
+
+from . import result_cache
+
+DAY = dt.datetime(2012, 12, 5)
+# records every 5 minutes, beams 0 to 15 swept in order
+RECORDS_PER_DAY = 288
+N_BEAM = 16
+
+
+def _build_dataset(rootDir):
+    """Convert a synthetic day of bks data into a partitioned dataset
+    under rootDir/data; returns its directory."""
+    archiveDir = os.path.join(rootDir, "archive")
+    synthetic_fitacf.write_archive(archiveDir, ["bks"], [DAY], nBeam=N_BEAM,
+                                   nRang=20, recordsPerDay=RECORDS_PER_DAY)
+    dataDir = os.path.join(rootDir, "data")
+    manifest = dataset_layout.Manifest(dataDir)
+    for fileFormat in ["parquet", "hdf5"]:
+        outFile = os.path.join(
+            dataset_layout.partition_dir(dataDir, "bks", DAY),
+            day_conversion.output_name("bks", DAY, fileFormat))
+        day_conversion.convert_day(
+            "bks", DAY, fileFormat, outFile, os.path.join(rootDir, "tmp", ""),
+            localdirfmt=os.path.join(archiveDir, "{year}/{ftype}/{radar}/"),
+            fnamefmt=["{date}.{hour}......{radar}.{ftype}"])
+        manifest.add_file(outFile)
+    manifest.save()
+    return dataDir
+
+
+class DataApiTests(SimpleTestCase):
+    """Queries of the data and catalog endpoints."""
+
+    @classmethod
+    def setUpClass(cls):
+        super(DataApiTests, cls).setUpClass()
+        cls.tmpDir = tempfile.mkdtemp(prefix="sd_data_api")
+        cls.dataDir = _build_dataset(cls.tmpDir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpDir, ignore_errors=True)
+        super(DataApiTests, cls).tearDownClass()
+
+    def setUp(self):
+        cacheDir = tempfile.mkdtemp(dir=self.tmpDir)
+        self.settings = override_settings(SD_DATA_DIR=self.dataDir,
+                                          SD_CACHE_DIR=cacheDir)
+        self.settings.enable()
+        # the cache of the process is made from the settings
+        result_cache._resultCache = None
+
+    def tearDown(self):
+        self.settings.disable()
+        result_cache._resultCache = None
+
+    async def get_content(self, url, params):
+        """Response to a GET request and its (streamed) content."""
+        response = await self.async_client.get(url, params)
+        if response.streaming:
+            content = b"".join([chunk async for chunk in
+                                response.streaming_content])
+        else:
+            content = response.content
+        return response, content
+
+    async def test_csv_query(self):
+        """Six hours of beam 3 as csv: the header, then one line per
+        record (times of both ends included)."""
+        response, content = await self.get_content("/api/data/", {
+            "radar": "bks", "start": "2012-12-05T00:00",
+            "end": "2012-12-05T06:00", "beams": "3", "params": "v,slist",
+            "format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn("20121205.000000.20121205.060000.bks.csv",
+                      response["Content-Disposition"])
+        rows = list(csv.reader(io.StringIO(content.decode("utf-8")),
+                               delimiter="|"))
+        self.assertEqual(rows[0], ["radar", "time", "v", "slist"])
+        # records 3, 19, 35, 51 and 67 of the day (one every 300 s)
+        times = [DAY + dt.timedelta(seconds=300 * i)
+                 for i in [3, 19, 35, 51, 67]]
+        self.assertEqual([row[1] for row in rows[1:]],
+                         [t.strftime("%Y-%m-%d %H:%M:%S") for t in times])
+        self.assertTrue(all(row[0] == "bks" for row in rows[1:]))
+
+    async def test_arrow_query(self):
+        """A day as an Arrow IPC stream, the same from the Parquet and
+        the hdf5 files."""
+        params = {"radar": "bks", "start": "2012-12-05",
+                  "end": "2012-12-05T23:59:59"}
+        tables = []
+        for source in ["parquet", "hdf5"]:
+            response, content = await self.get_content(
+                "/api/data/", dict(params, source=source))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"],
+                             "application/vnd.apache.arrow.stream")
+            tables.append(pa.ipc.open_stream(content).read_all())
+        table, hdf5Table = tables
+        self.assertEqual(table.num_rows, RECORDS_PER_DAY)
+        self.assertEqual(table.schema.names[:3], ["radar", "time", "bmnum"])
+        self.assertEqual(table.column("bmnum").to_pylist(),
+                         [i % N_BEAM for i in range(RECORDS_PER_DAY)])
+        self.assertTrue(table.equals(hdf5Table))
+
+    async def test_cached_response(self):
+        """A repeated query is answered from the cache with the same
+        content, and the same as without the cache."""
+        params = {"radar": "bks", "start": "2012-12-05T12:00",
+                  "end": "2012-12-05T14:00", "format": "csv"}
+        first = (await self.get_content("/api/data/", params))[1]
+        second = (await self.get_content("/api/data/", params))[1]
+        self.assertEqual(first, second)
+        self.assertEqual(result_cache.get_result_cache().memory.nbytes,
+                         len(first))
+        with override_settings(SD_CACHE_DIR=None):
+            uncached = (await self.get_content("/api/data/", params))[1]
+        self.assertEqual(first, uncached)
+
+    async def test_invalid_query(self):
+        """Invalid parameters are answered with 400 and the error."""
+        response, content = await self.get_content("/api/data/", {
+            "radar": "bks", "start": "2012-12-05", "end": "2012-12-04"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"end is before start", content)
+        response, content = await self.get_content("/api/data/", {
+            "radar": "bks", "start": "2012-12-05", "end": "2012-12-06",
+            "params": "nosuchparam"})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_catalog(self):
+        """The catalog lists the partition of the dataset."""
+        response, content = await self.get_content("/api/catalog/", {})
+        self.assertEqual(response.status_code, 200)
+        partitions = response.json()["partitions"]
+        self.assertEqual([p["partition"] for p in partitions],
+                         ["radar=bks/year=2012/month=12"])
+        response, content = await self.get_content("/api/catalog/",
+                                                   {"radar": "fhe"})
+        self.assertEqual(response.json()["partitions"], [])
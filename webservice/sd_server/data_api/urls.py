@@ -0,0 +1,13 @@
+"""
+URLs of the data query API (see views)
+"""
+from django.urls import path
+
+from . import views
+
+app_name = 'data_api'
+
+urlpatterns = [
+    path('data/', views.data, name='data'),
+    path('catalog/', views.catalog, name='catalog'),
+]
@@ -0,0 +1,108 @@
+"""
+Async views of the data query API.
+
+Results are streamed: the readers are blocking, so each chunk is
+produced in a worker thread (sync_to_async) and sent as soon as it is
+ready, instead of reading whole files before answering. Responses go
+through the result cache, which also coalesces identical concurrent
+requests (see result_cache). Streaming an
+async iterator needs Django >= 4.2 served through ASGI (see
+sd_server/asgi.py); under WSGI Django buffers it.
+"""
+
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import (HttpResponseNotAllowed, JsonResponse,
+                         StreamingHttpResponse)
+
+import dataset_layout
+
+from . import streaming
+from .query import DataQuery
+from .result_cache import get_result_cache
+
+
+def _next_chunk(chunks):
+    """Next chunk of a generator, None at the end."""
+    return next(chunks, None)
+
+
+async def aiter_chunks(chunks):
+    """Async iterator over a blocking generator of chunks, each one
+    produced in a worker thread."""
+    nextChunk = sync_to_async(_next_chunk, thread_sensitive=False)
+    while True:
+        chunk = await nextChunk(chunks)
+        if chunk is None:
+            return
+        if chunk:
+            yield chunk
+
+
+def data_version(dataDir):
+    """Version of the dataset used in cache keys: the mtime of its
+    manifest, which batch conversions rewrite."""
+    manifest = os.path.join(dataDir, dataset_layout.MANIFEST_NAME)
+    if os.path.exists(manifest):
+        return os.path.getmtime(manifest)
+    return None
+
+
+async def data(request):
+    """
+    Stream the data of radars over a time range, as an Arrow IPC stream
+    (format=arrow, the default) or as csv (format=csv).
+    Query parameters: radar, start, end, params, beams, format, source
+    (see query.DataQuery).
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    try:
+        query = DataQuery.from_params(request.GET,
+                                      maxDays=settings.SD_MAX_QUERY_DAYS)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    def produce():
+        return streaming.encode(query, settings.SD_DATA_DIR,
+                                batchRows=settings.SD_STREAM_BATCH_ROWS)
+
+    if settings.SD_CACHE_DIR is None:
+        chunks = aiter_chunks(produce())
+    else:
+        key = query.cache_key(data_version(settings.SD_DATA_DIR))
+        chunks = get_result_cache().stream(key, produce)
+    response = StreamingHttpResponse(chunks,
+                                     content_type=query.content_type())
+    response["Content-Disposition"] = 'attachment; filename="{:s}"'.format(
+        query.file_name())
+    return response
+
+
+def _read_catalog(dataDir):
+    """Partitions of the dataset, from its manifest."""
+    manifest = dataset_layout.Manifest(dataDir)
+    return [dict(((k, v) for k, v in part.items() if k != "files"),
+                 partition=name)
+            for name, part in sorted(manifest.partitions.items())]
+
+
+async def catalog(request):
+    """
+    List the partitions (radar, year, month) of the dataset with their
+    record counts and time bounds. The optional radar parameter
+    restricts the list to some radars.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    if not os.path.exists(settings.SD_DATA_DIR):
+        return JsonResponse({"partitions": []})
+    partitions = await sync_to_async(_read_catalog)(settings.SD_DATA_DIR)
+    radars = request.GET.get("radar")
+    if radars:
+        radars = set(radars.split(","))
+        partitions = [p for p in partitions if p["radar"] in radars]
+    return JsonResponse({"partitions": partitions},
+                        json_dumps_params={"sort_keys": True})
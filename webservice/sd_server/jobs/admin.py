@@ -0,0 +1,11 @@
+from django.contrib import admin
+
+from .models import ConversionJob
+
+
+@admin.register(ConversionJob)
+class ConversionJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "radar", "day", "file_format", "median_filter",
+                    "priority", "status", "created", "finished")
+    list_filter = ("status", "file_format", "radar")
+    ordering = ("-created",)
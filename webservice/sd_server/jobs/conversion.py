@@ -0,0 +1,69 @@
+"""
+Conversion of a radar-day, run in the processes of the job worker pool.
+Nothing here uses Django, so the pool processes never touch the
+database connection of the worker.
+"""
+
+import os
+import shutil
+import time
+import traceback
+
+import day_conversion
+from day_conversion import output_name
+
+
+def convert_day(jobId, rad, day, fileFormat, outDir, tmpDir, localdirfmt,
+                fnamefmt, medianFilter=False, pathToFilter="./fitexfilter"):
+    """
+    Convert a day of fitacf data of a radar to a csv, hdf5 or Parquet
+    file with day_conversion.convert_day.
+
+    Parameters
+    ----------
+    jobId : int
+        Id of the job; the job works in its own directory under tmpDir.
+    rad : str
+        Three-letter radar code.
+    day : datetime.datetime
+        Day to convert.
+    fileFormat : str
+        "csv", "hdf5" or "parquet".
+    outDir : str
+        Directory the output file is moved to once complete.
+    tmpDir : str
+        Directory of temporary files.
+    localdirfmt, fnamefmt :
+        Location of the raw files, see dmap_to_csv.fetch_concat.
+    medianFilter : bool
+        Boxcar median filter the data first (see median_filter), with
+        the fitexfilter binary at pathToFilter if that fails.
+
+    Returns
+    -------
+    dict
+        status ("done", "nodata" or "failed"), outFile, nbytes,
+        elapsed (seconds) and error (a traceback).
+    """
+    t0 = time.time()
+    result = {"status": "failed", "outFile": None, "nbytes": 0,
+              "elapsed": 0., "error": None}
+    jobTmpDir = os.path.join(tmpDir, "job{:d}".format(jobId)) + os.sep
+    try:
+        outFile = os.path.join(outDir, output_name(rad, day, fileFormat))
+        nrec = day_conversion.convert_day(rad, day, fileFormat, outFile,
+                                          jobTmpDir, localdirfmt, fnamefmt,
+                                          medianFilter=medianFilter,
+                                          pathToFilter=pathToFilter)
+        if nrec == 0:
+            result["status"] = "nodata"
+        else:
+            result["status"] = "done"
+            result["outFile"] = outFile
+            result["nbytes"] = os.path.getsize(outFile)
+    except Exception:
+        result["error"] = traceback.format_exc()
+    finally:
+        shutil.rmtree(jobTmpDir, ignore_errors=True)
+    result["elapsed"] = time.time() - t0
+    return result
@@ -0,0 +1,39 @@
+"""
+python manage.py runjobs: run the job worker (see jobs.worker), with
+the SD_JOB_* settings.
+"""
+
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs.worker import JobWorker
+
+
+class Command(BaseCommand):
+    help = "Run the queued conversion jobs on a local process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int,
+                            default=settings.SD_JOB_PROCESSES,
+                            help="number of worker processes")
+        parser.add_argument("--radar-limit", type=int,
+                            default=settings.SD_JOB_RADAR_LIMIT,
+                            help="maximum number of running jobs per radar")
+
+    def handle(self, *args, **options):
+        logging.getLogger().setLevel(logging.INFO)
+        worker = JobWorker(settings.SD_JOB_OUTPUT_DIR, settings.SD_JOB_TMP_DIR,
+                           settings.SD_RAW_DIR_FORMAT,
+                           settings.SD_RAW_FILE_FORMATS,
+                           nProcs=options["processes"],
+                           radarLimit=options["radar_limit"],
+                           radarLimits=settings.SD_JOB_RADAR_LIMITS,
+                           pollInterval=settings.SD_JOB_POLL_INTERVAL,
+                           pathToFilter=settings.SD_FITEXFILTER,
+                           keepDays=settings.SD_JOB_KEEP_DAYS)
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('radar', models.CharField(max_length=8)),
+                ('day', models.DateField()),
+                ('file_format', models.CharField(choices=[('csv', 'csv'), ('hdf5', 'HDF5'), ('parquet', 'Parquet')], max_length=8)),
+                ('median_filter', models.BooleanField(default=False)),
+                ('priority', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('nodata', 'no data'), ('failed', 'failed')], default='queued', max_length=8)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('output_file', models.CharField(blank=True, max_length=512)),
+                ('nbytes', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', '-priority', 'created'], name='jobs_queue_idx'), models.Index(fields=['radar', 'day', 'file_format'], name='jobs_unit_idx')],
+            },
+        ),
+    ]
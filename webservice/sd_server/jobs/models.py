@@ -0,0 +1,86 @@
+"""
+Conversion jobs, queued by the views and run by the job worker
+(see worker and the runjobs management command).
+"""
+
+from django.db import models
+from django.urls import reverse
+from django.utils import timezone
+
+FORMAT_CHOICES = [("csv", "csv"), ("hdf5", "HDF5"), ("parquet", "Parquet")]
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+NODATA = "nodata"
+FAILED = "failed"
+STATUS_CHOICES = [(QUEUED, "queued"), (RUNNING, "running"), (DONE, "done"),
+                  (NODATA, "no data"), (FAILED, "failed")]
+
+# Jobs with one of these statuses are still to be run or are usable
+ACTIVE_STATUSES = [QUEUED, RUNNING, DONE]
+
+
+class ConversionJob(models.Model):
+    """
+    Conversion of a day of fitacf data of a radar into a csv, hdf5
+    or Parquet file.
+    """
+    radar = models.CharField(max_length=8)
+    day = models.DateField()
+    file_format = models.CharField(max_length=8, choices=FORMAT_CHOICES)
+    median_filter = models.BooleanField(default=False)
+    # higher priorities run first, then the oldest jobs
+    priority = models.IntegerField(default=0)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    output_file = models.CharField(max_length=512, blank=True)
+    nbytes = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "-priority", "created"],
+                         name="jobs_queue_idx"),
+            models.Index(fields=["radar", "day", "file_format"],
+                         name="jobs_unit_idx"),
+        ]
+
+    def __str__(self):
+        return "{:s} {:s} {:s} ({:s})".format(
+            self.radar, self.day.strftime("%Y%m%d"), self.file_format,
+            self.status)
+
+    def queue_position(self):
+        """Number of queued jobs that run before this one, or None if
+        it is not queued."""
+        if self.status != QUEUED:
+            return None
+        ahead = ConversionJob.objects.filter(status=QUEUED).filter(
+            models.Q(priority__gt=self.priority) |
+            models.Q(priority=self.priority, created__lt=self.created))
+        return ahead.count()
+
+    def to_dict(self):
+        """Status of the job as returned by the status view."""
+        desc = {"id": self.pk, "radar": self.radar,
+                "day": self.day.isoformat(), "format": self.file_format,
+                "median_filter": self.median_filter,
+                "priority": self.priority, "status": self.status,
+                "created": self.created.isoformat(),
+                "started": self.started.isoformat() if self.started else None,
+                "finished": (self.finished.isoformat() if self.finished
+                             else None),
+                "status_url": reverse("jobs:status", args=[self.pk])}
+        if self.status == QUEUED:
+            desc["position"] = self.queue_position()
+        if self.status == DONE:
+            desc["nbytes"] = self.nbytes
+            desc["download_url"] = reverse("jobs:download", args=[self.pk])
+        if self.status == FAILED and self.error:
+            # the last line of the traceback
+            desc["error"] = self.error.strip().splitlines()[-1]
+        return desc
@@ -0,0 +1,168 @@
+"""
+Tests of the conversion jobs, run with "python manage.py test jobs":
+submitting jobs, polling their status and downloading their outputs
+through the test client, and running a job with the job worker on a
+day of synthetic data (see synthetic_fitacf).
+"""
+
+import datetime as dt
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import pyarrow.parquet as pq
+from django.test import TestCase
+
+import synthetic_fitacf
+
+from .models import DONE, FAILED, NODATA, QUEUED, RUNNING, ConversionJob
+from .worker import JobWorker
+
+DAY = dt.datetime(2012, 12, 5)
+RECORDS_PER_DAY = 288
+
+
+class JobViewTests(TestCase):
+    """Submit, status and download views."""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix="sd_jobs")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+    def submit(self, **params):
+        """Response to the submission of a job of bks on DAY."""
+        fields = {"radar": "bks", "day": DAY.strftime("%Y-%m-%d"),
+                  "format": "parquet"}
+        fields.update(params)
+        return self.client.post("/api/jobs/", fields)
+
+    def test_submit(self):
+        """A new job is queued (202); the same job again is the same
+        job (200), with its priority raised if asked."""
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        desc = response.json()
+        self.assertEqual(desc["status"], QUEUED)
+        self.assertEqual(desc["position"], 0)
+        self.assertEqual(desc["status_url"],
+                         "/api/jobs/{:d}/".format(desc["id"]))
+
+        response = self.submit(priority="5")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], desc["id"])
+        self.assertEqual(response.json()["priority"], 5)
+        # another format is another job
+        response = self.submit(format="csv")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(ConversionJob.objects.count(), 2)
+
+    def test_invalid_submission(self):
+        """Invalid parameters are answered with 400 and the error."""
+        for params in [{"radar": "BKS"}, {"day": "20121205"},
+                       {"format": "txt"}, {"median_filter": "yes"},
+                       {"priority": "99"}]:
+            response = self.submit(**params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn("error", response.json())
+        self.assertEqual(ConversionJob.objects.count(), 0)
+
+    def test_status(self):
+        """Status of a job, 404 for an unknown one; listing by status."""
+        job = ConversionJob.objects.create(radar="bks", day=DAY.date(),
+                                           file_format="hdf5")
+        response = self.client.get("/api/jobs/{:d}/".format(job.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["format"], "hdf5")
+        self.assertEqual(self.client.get("/api/jobs/999/").status_code, 404)
+
+        response = self.client.get("/api/jobs/", {"status": QUEUED})
+        self.assertEqual([j["id"] for j in response.json()["jobs"]],
+                         [job.pk])
+        response = self.client.get("/api/jobs/", {"status": DONE})
+        self.assertEqual(response.json()["jobs"], [])
+
+    def test_download(self):
+        """Outputs are downloaded once done: 409 while queued or
+        running, 404 if the job failed, 410 once the output expired."""
+        outFile = os.path.join(self.tmpDir, "20121205.bks.csv")
+        with open(outFile, "wb") as f:
+            f.write(b"time|bmnum\n")
+        job = ConversionJob.objects.create(radar="bks", day=DAY.date(),
+                                           file_format="csv")
+        url = "/api/jobs/{:d}/download/".format(job.pk)
+        for status in [QUEUED, RUNNING]:
+            ConversionJob.objects.filter(pk=job.pk).update(status=status)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json()["status"], status)
+
+        ConversionJob.objects.filter(pk=job.pk).update(
+            status=DONE, output_file=outFile, nbytes=11)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content),
+                         b"time|bmnum\n")
+        self.assertIn("20121205.bks.csv", response["Content-Disposition"])
+        response.close()
+
+        os.remove(outFile)
+        self.assertEqual(self.client.get(url).status_code, 410)
+        ConversionJob.objects.filter(pk=job.pk).update(status=FAILED)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class JobWorkerTests(TestCase):
+    """Running jobs with the job worker."""
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix="sd_jobs")
+        self.archiveDir = os.path.join(self.tmpDir, "archive")
+        synthetic_fitacf.write_archive(self.archiveDir, ["bks"], [DAY],
+                                       nRang=20,
+                                       recordsPerDay=RECORDS_PER_DAY)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+    def test_run_job(self):
+        """A submitted job is run in the pool and its output downloaded;
+        a day without data ends as nodata."""
+        jobId = self.client.post("/api/jobs/", {
+            "radar": "bks", "day": "2012-12-05"}).json()["id"]
+        emptyId = self.client.post("/api/jobs/", {
+            "radar": "bks", "day": "2012-12-06"}).json()["id"]
+        worker = JobWorker(
+            os.path.join(self.tmpDir, "out"), os.path.join(self.tmpDir, "tmp"),
+            os.path.join(self.archiveDir, "{year}/{ftype}/{radar}/"),
+            ["{date}.{hour}......{radar}.{ftype}"], nProcs=2)
+        pool = multiprocessing.Pool(2)
+        try:
+            worker.schedule(pool)
+            # one job of the radar at a time
+            self.assertEqual(list(worker._running.keys()), [jobId])
+            deadline = time.time() + 120
+            while ConversionJob.objects.filter(
+                    status__in=[QUEUED, RUNNING]).exists():
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.1)
+                worker.collect()
+                worker.schedule(pool)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        desc = self.client.get("/api/jobs/{:d}/".format(jobId)).json()
+        self.assertEqual(desc["status"], DONE)
+        response = self.client.get(desc["download_url"])
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content)
+        response.close()
+        self.assertEqual(len(content), desc["nbytes"])
+        table = pq.read_table(ConversionJob.objects.get(pk=jobId).output_file)
+        self.assertEqual(table.num_rows, RECORDS_PER_DAY)
+        self.assertEqual(ConversionJob.objects.get(pk=emptyId).status,
+                         NODATA)
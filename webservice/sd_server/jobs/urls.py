@@ -0,0 +1,14 @@
+"""
+URLs of the conversion jobs (see views)
+"""
+from django.urls import path
+
+from . import views
+
+app_name = 'jobs'
+
+urlpatterns = [
+    path('', views.jobs, name='jobs'),
+    path('<int:jobId>/', views.status, name='status'),
+    path('<int:jobId>/download/', views.download, name='download'),
+]
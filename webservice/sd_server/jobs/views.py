@@ -0,0 +1,127 @@
+"""
+Views of the conversion jobs: submit a job, poll its status and
+download its output once done. Converting a day takes minutes, so the
+views only queue jobs; they are run by the job worker (see worker).
+"""
+
+import datetime as dt
+import os
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+
+from .models import (ACTIVE_STATUSES, DONE, FORMAT_CHOICES, QUEUED,
+                     STATUS_CHOICES, ConversionJob)
+
+FORMATS = [fmt for fmt, label in FORMAT_CHOICES]
+STATUSES = [status for status, label in STATUS_CHOICES]
+
+# Jobs listed at most
+MAX_LISTED = 100
+
+
+def parse_job(params):
+    """
+    Fields of a job from request parameters: radar, day (YYYY-MM-DD),
+    format (csv, hdf5 or parquet), median_filter (0 or 1) and priority.
+    Raises ValueError for a missing or invalid parameter.
+    """
+    rad = params.get("radar", "")
+    if not (rad.isalnum() and rad.islower()):
+        raise ValueError("invalid or missing radar")
+    try:
+        day = dt.datetime.strptime(params.get("day", ""), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("day must be given as YYYY-MM-DD")
+    fmt = params.get("format", "parquet")
+    if fmt not in FORMATS:
+        raise ValueError("format must be one of " + ", ".join(FORMATS))
+    medianFilter = params.get("median_filter", "0")
+    if medianFilter not in ("0", "1"):
+        raise ValueError("median_filter must be 0 or 1")
+    try:
+        priority = int(params.get("priority", 0))
+    except ValueError:
+        raise ValueError("priority must be an integer")
+    if not 0 <= priority <= settings.SD_JOB_MAX_PRIORITY:
+        raise ValueError("priority must be between 0 and {:d}".format(
+            settings.SD_JOB_MAX_PRIORITY))
+    return {"radar": rad, "day": day, "file_format": fmt,
+            "median_filter": medianFilter == "1", "priority": priority}
+
+
+def find_job(fields):
+    """A queued, running or done job converting the same radar-day to
+    the same format, or None."""
+    jobs = ConversionJob.objects.filter(
+        radar=fields["radar"], day=fields["day"],
+        file_format=fields["file_format"],
+        median_filter=fields["median_filter"],
+        status__in=ACTIVE_STATUSES).order_by("-created")
+    for job in jobs:
+        if job.status != DONE or os.path.exists(job.output_file):
+            return job
+    return None
+
+
+@csrf_exempt
+def jobs(request):
+    """
+    POST: submit a job (see parse_job); answers 202 with the status of
+    the new job, or 200 with the status of a job already converting
+    the same radar-day (whose priority is raised if needed).
+    GET: list the latest jobs, optionally of a status and/or radar.
+    """
+    if request.method == "POST":
+        try:
+            fields = parse_job(request.POST)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        job = find_job(fields)
+        if job is None:
+            job = ConversionJob.objects.create(**fields)
+            return JsonResponse(job.to_dict(), status=202)
+        if job.status == QUEUED and job.priority < fields["priority"]:
+            job.priority = fields["priority"]
+            job.save(update_fields=["priority"])
+        return JsonResponse(job.to_dict())
+
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET", "POST"])
+    jobList = ConversionJob.objects.order_by("-created")
+    status = request.GET.get("status")
+    if status:
+        if status not in STATUSES:
+            return JsonResponse({"error": "status must be one of " +
+                                 ", ".join(STATUSES)}, status=400)
+        jobList = jobList.filter(status=status)
+    if request.GET.get("radar"):
+        jobList = jobList.filter(radar=request.GET["radar"])
+    return JsonResponse({"jobs": [job.to_dict()
+                                  for job in jobList[:MAX_LISTED]]})
+
+
+def status(request, jobId):
+    """Status of a job (see ConversionJob.to_dict)."""
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    job = get_object_or_404(ConversionJob, pk=jobId)
+    return JsonResponse(job.to_dict())
+
+
+def download(request, jobId):
+    """Output file of a done job; 409 if the job is not done yet."""
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    job = get_object_or_404(ConversionJob, pk=jobId)
+    if job.status != DONE:
+        return JsonResponse({"error": "job is " + job.status,
+                             "status": job.status},
+                            status=409 if job.status in ACTIVE_STATUSES
+                            else 404)
+    if not os.path.exists(job.output_file):
+        return JsonResponse({"error": "output expired"}, status=410)
+    return FileResponse(open(job.output_file, "rb"), as_attachment=True,
+                        filename=os.path.basename(job.output_file))
@@ -0,0 +1,186 @@
+"""
+The job worker: runs the queued conversion jobs on a local pool of
+processes, without any message broker, the database being the queue.
+
+Jobs are started by decreasing priority then age, as long as a process
+is free and the radar of the job has fewer running jobs than its
+concurrency limit (conversions of a radar read the same archive
+directory, and a backlog of one radar should not hold back the
+others). A job is claimed with a conditional update of its status, so
+it never runs twice. One worker is meant to run per database: jobs
+left running by a stopped worker are queued again when it starts.
+"""
+
+import datetime as dt
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import time
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import conversion
+from .models import (ConversionJob, DONE, FAILED, NODATA, QUEUED, RUNNING)
+
+
+def _init_process():
+    """Leave interrupts to the worker, which stops the pool."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class JobWorker(object):
+    """
+    Run conversion jobs on a pool of worker processes.
+    """
+
+    def __init__(self, outDir, tmpDir, localdirfmt, fnamefmt, nProcs=None,
+                 radarLimit=1, radarLimits=None, pollInterval=2.,
+                 pathToFilter="./fitexfilter", keepDays=None):
+        """
+        Parameters
+        ----------
+        outDir : str
+            Outputs are written to outDir/<job id>/.
+        tmpDir : str
+            Directory of temporary files.
+        localdirfmt, fnamefmt :
+            Location of the raw files, see dmap_to_csv.fetch_concat.
+        nProcs : Optional[int]
+            Number of worker processes (default: number of cpus).
+        radarLimit : int
+            Maximum number of running jobs of a radar (at least 1).
+        radarLimits : Optional[dict]
+            Radar code -> maximum number of running jobs of the radar,
+            overriding radarLimit.
+        pollInterval : float
+            Seconds between looks at the queue.
+        pathToFilter : str
+            fitexfilter binary used by median filtered jobs if the
+            native filter (see median_filter) fails.
+        keepDays : Optional[float]
+            Outputs of jobs finished more than keepDays days ago are
+            deleted (never if None).
+        """
+        self.outDir = outDir
+        self.tmpDir = tmpDir
+        self.localdirfmt = localdirfmt
+        self.fnamefmt = fnamefmt
+        self.nProcs = nProcs if nProcs else multiprocessing.cpu_count()
+        self.radarLimit = radarLimit
+        self.radarLimits = radarLimits if radarLimits else {}
+        self.pollInterval = pollInterval
+        self.pathToFilter = pathToFilter
+        self.keepDays = keepDays
+        # job id -> (job, AsyncResult) of the running jobs
+        self._running = {}
+        self._lastExpire = 0.
+
+    def run(self):
+        """
+        Run jobs until interrupted. Jobs still running then are
+        queued again.
+        """
+        # the pool is started before the database is used, so that the
+        # forked processes don't share its connection; each job gets a
+        # fresh process, which gives the memory of a conversion back
+        pool = multiprocessing.Pool(self.nProcs, initializer=_init_process,
+                                    maxtasksperchild=1)
+        try:
+            self.requeue_interrupted()
+            while True:
+                self.collect()
+                self.schedule(pool)
+                self.expire()
+                close_old_connections()
+                time.sleep(self.pollInterval)
+        finally:
+            pool.terminate()
+            pool.join()
+            ids = list(self._running.keys())
+            self._running = {}
+            ConversionJob.objects.filter(pk__in=ids, status=RUNNING).update(
+                status=QUEUED, started=None)
+
+    def requeue_interrupted(self):
+        """Queue again the jobs left running by a stopped worker."""
+        n = ConversionJob.objects.filter(status=RUNNING).update(
+            status=QUEUED, started=None)
+        if n:
+            logging.warning("{:d} interrupted jobs queued again".format(n))
+
+    def radar_limit(self, rad):
+        """Maximum number of running jobs of a radar."""
+        return self.radarLimits.get(rad, self.radarLimit)
+
+    def schedule(self, pool):
+        """Start queued jobs while processes are free."""
+        while len(self._running) < self.nProcs:
+            running = {}
+            for runJob, res in self._running.values():
+                running[runJob.radar] = running.get(runJob.radar, 0) + 1
+            busy = [rad for rad, n in running.items()
+                    if n >= self.radar_limit(rad)]
+            job = ConversionJob.objects.filter(status=QUEUED).exclude(
+                radar__in=busy).order_by("-priority", "created").first()
+            if job is None:
+                return
+            self.start(pool, job)
+
+    def start(self, pool, job):
+        """Claim a queued job and run it in the pool. Returns False if
+        it was claimed meanwhile (e.g. by another worker)."""
+        now = timezone.now()
+        claimed = ConversionJob.objects.filter(
+            pk=job.pk, status=QUEUED).update(status=RUNNING, started=now)
+        if not claimed:
+            return False
+        job.status = RUNNING
+        job.started = now
+        day = dt.datetime(job.day.year, job.day.month, job.day.day)
+        res = pool.apply_async(
+            conversion.convert_day,
+            (job.pk, job.radar, day, job.file_format,
+             os.path.join(self.outDir, str(job.pk)), self.tmpDir,
+             self.localdirfmt, self.fnamefmt),
+            {"medianFilter": job.median_filter,
+             "pathToFilter": self.pathToFilter})
+        self._running[job.pk] = (job, res)
+        logging.info("started job {:d}: {:s}".format(job.pk, str(job)))
+        return True
+
+    def collect(self):
+        """Record the results of the finished jobs."""
+        for jobId, (job, res) in list(self._running.items()):
+            if not res.ready():
+                continue
+            del self._running[jobId]
+            try:
+                result = res.get()
+            except Exception as e:
+                # convert_day catches its own errors, this is e.g. a
+                # result that could not be sent back
+                result = {"status": FAILED, "outFile": None, "nbytes": 0,
+                          "error": repr(e)}
+            status = {"done": DONE, "nodata": NODATA}.get(result["status"],
+                                                          FAILED)
+            ConversionJob.objects.filter(pk=jobId).update(
+                status=status, finished=timezone.now(),
+                output_file=result["outFile"] or "",
+                nbytes=result["nbytes"], error=result["error"] or "")
+            logging.info("job {:d} {:s}".format(jobId, status))
+
+    def expire(self):
+        """Delete the outputs of the jobs finished more than keepDays
+        days ago (at most once an hour)."""
+        if self.keepDays is None or time.time() - self._lastExpire < 3600.:
+            return
+        self._lastExpire = time.time()
+        limit = timezone.now() - dt.timedelta(days=self.keepDays)
+        old = ConversionJob.objects.filter(finished__lt=limit)
+        for jobId in old.values_list("pk", flat=True):
+            shutil.rmtree(os.path.join(self.outDir, str(jobId)),
+                          ignore_errors=True)
+        old.delete()
@@ -2,7 +2,14 @@
 import os
 import sys
 
+# The SD_exodus converters and readers (the top-level modules of the
+# repository), used by the data API and the jobs
+SD_EXODUS_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
 if __name__ == '__main__':
+    if SD_EXODUS_DIR not in sys.path:
+        sys.path.append(SD_EXODUS_DIR)
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sd_server.settings')
     try:
         from django.core.management import execute_from_command_line
@@ -0,0 +1,26 @@
+"""
+ASGI config for sd_server project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The async views of data_api stream their responses only when served
+through ASGI (e.g. ``uvicorn sd_server.asgi:application``).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+import sys
+
+from django.core.asgi import get_asgi_application
+
+# The SD_exodus converters and readers (the top-level modules of the
+# repository), imported by the views
+SD_EXODUS_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))))
+if SD_EXODUS_DIR not in sys.path:
+    sys.path.append(SD_EXODUS_DIR)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sd_server.settings')
+
+application = get_asgi_application()
@@ -15,6 +15,10 @@ import os
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# The SD_exodus converters and readers, used by the data API and the
+# jobs; manage.py, asgi.py and wsgi.py put it on the Python path
+SD_EXODUS_DIR = os.path.dirname(os.path.dirname(BASE_DIR))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.1/howto/deployment/checklist/
@@ -37,6 +41,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'data_api',
+    'jobs',
 ]
 
 MIDDLEWARE = [
@@ -68,6 +74,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'sd_server.wsgi.application'
+ASGI_APPLICATION = 'sd_server.asgi.application'
 
 
 # Database
@@ -119,3 +126,46 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, "static/")
+
+
+# Data query API
+
+# Root of the partitioned dataset served (see dataset_layout)
+SD_DATA_DIR = os.environ.get("SD_DATA_DIR", os.path.join(BASE_DIR, "data"))
+
+# Longest time range of a single query, in days
+SD_MAX_QUERY_DAYS = 31
+
+# Rows per streamed chunk
+SD_STREAM_BATCH_ROWS = 20000
+
+# Response cache (see data_api.result_cache); None disables it
+SD_CACHE_DIR = os.path.join(BASE_DIR, "cache")
+SD_CACHE_MEMORY_BYTES = 256 << 20
+SD_CACHE_DISK_BYTES = 10 << 30
+# Time to live of the cached responses, in seconds
+SD_CACHE_TTL = 3600
+
+
+# Conversion jobs (see jobs.worker, run with "python manage.py runjobs")
+
+# Location of the raw fitacf files (see dmap_to_csv.fetch_concat)
+SD_RAW_DIR_FORMAT = os.environ.get("SD_RAW_DIR_FORMAT",
+                                   "/sd-data/{year}/{ftype}/{radar}/")
+SD_RAW_FILE_FORMATS = ['{date}.{hour}......{radar}.{channel}.{ftype}',
+                       '{date}.{hour}......{radar}.{ftype}']
+SD_FITEXFILTER = os.path.join(SD_EXODUS_DIR, "fitexfilter")
+
+SD_JOB_OUTPUT_DIR = os.path.join(BASE_DIR, "jobs_output")
+SD_JOB_TMP_DIR = os.path.join(BASE_DIR, "jobs_tmp")
+# Worker processes (None: number of cpus)
+SD_JOB_PROCESSES = None
+# Maximum number of running jobs per radar, and per radar exceptions
+SD_JOB_RADAR_LIMIT = 1
+SD_JOB_RADAR_LIMITS = {}
+# Seconds between looks of the worker at the queue
+SD_JOB_POLL_INTERVAL = 2
+# Outputs of older jobs are deleted (None keeps them)
+SD_JOB_KEEP_DAYS = 7
+# Priorities clients can give (higher runs first)
+SD_JOB_MAX_PRIORITY = 9
@@ -8,9 +8,17 @@ https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
 """
 
 import os
+import sys
 
 from django.core.wsgi import get_wsgi_application
 
+# The SD_exodus converters and readers (the top-level modules of the
+# repository), imported by the views
+SD_EXODUS_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))))
+if SD_EXODUS_DIR not in sys.path:
+    sys.path.append(SD_EXODUS_DIR)
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sd_server.settings')
 
 application = get_wsgi_application()